@@ -1,23 +1,32 @@
+from config import create_db_app
+from models import db
+from subscriber_io import import_subscribers
 from weather_service import WeatherService
 
 def add_new_subscriber():
     print("Welcome to the Weather Alert Service!")
     print("Please provide the following information:")
     
-    email = input("Email address: ")
-    location = input("Location (city, state): ")
-    yard_size = float(input("Yard size (in acres): "))
-    elevation = float(input("Elevation (in feet): "))
+    row = {
+        'email': input("Email address: "),
+        'location': input("Location (zip code or city, state): "),
+        'yard_size': input("Yard size (in acres): "),
+        'elevation': input("Elevation (in feet): "),
+    }
     
-    service = WeatherService()
-    
-    try:
-        service.add_subscriber(email, location, yard_size, elevation)
+    app = create_db_app()
+    with app.app_context():
+        db.create_all()
+        report = import_subscribers(WeatherService(), [(1, row)])
+        
+    if report.inserted:
         print("\nSubscription successful! You will receive:")
         print("1. Daily weather updates at 8:00 AM")
         print("2. Weekly weather summaries on Sundays at 9:00 AM")
-    except Exception as e:
-        print(f"\nError adding subscriber: {str(e)}")
+    elif report.duplicates:
+        print("\nThat email address is already subscribed.")
+    else:
+        print(f"\nError adding subscriber: {report.errors[0][2]}")
 
 if __name__ == "__main__":
-    add_new_subscriber() 
\ No newline at end of file
+    add_new_subscriber() 
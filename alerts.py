@@ -0,0 +1,149 @@
+import hashlib
+import json
+import logging
+import os
+from datetime import date, datetime
+from typing import Callable, Dict, Iterable, Iterator, List, Sequence, Tuple
+
+from sqlalchemy import tuple_
+from sqlalchemy.exc import IntegrityError
+
+from models import ForecastDigest, db
+from rules import FIELDS
+
+logger = logging.getLogger(__name__)
+
+# How far a forecast field may drift from the last alerted forecast before it
+# counts as a material change (imperial units: °F, mm, probability, mph)
+DEFAULT_TOLERANCES = {'temp': 5.0, 'snow': 1.0, 'rain': 2.0, 'pop': 0.3, 'wind': 10.0}
+
+def parse_tolerances(value: str) -> Dict[str, float]:
+    """Parse tolerances given as `field=amount,...` over the defaults, e.g. `temp=3,wind=15`."""
+    tolerances = dict(DEFAULT_TOLERANCES)
+    for item in filter(None, (part.strip() for part in value.split(','))):
+        field, _, amount = item.partition('=')
+        field = field.strip()
+        if field not in DEFAULT_TOLERANCES:
+            raise ValueError(f"Unknown alert tolerance field {field!r}, expected one of {tuple(DEFAULT_TOLERANCES)}")
+        try:
+            tolerances[field] = float(amount)
+        except ValueError:
+            raise ValueError(f"Alert tolerance for {field} must be a number, got {amount!r}")
+    return tolerances
+
+def digest(features: Sequence[float], precautions: Sequence[str]) -> str:
+    """Fingerprint an analysed forecast, so an unchanged one is recognized without diffing it."""
+    values = [round(float(value), 2) for value in features]
+    return hashlib.sha1(json.dumps([values, list(precautions)]).encode('utf-8')).hexdigest()
+
+def changes(before: Tuple[Sequence[float], Sequence[str]], after: Tuple[Sequence[float], Sequence[str]],
+            tolerances: Dict[str, float]) -> List[str]:
+    """Describe the material changes between two (features, precautions) analyses.
+    Returns an empty list if the forecast is unchanged within the tolerances."""
+    (old_features, old_precautions), (new_features, new_precautions) = before, after
+    reasons = [f"new precaution: {message}" for message in new_precautions if message not in old_precautions]
+    reasons += [f"precaution cleared: {message}" for message in old_precautions if message not in new_precautions]
+    for field, tolerance in tolerances.items():
+        column = FIELDS.index(field)
+        old, new = float(old_features[column]), float(new_features[column])
+        if abs(new - old) > tolerance:
+            reasons.append(f"{field} {old:g} -> {new:g}")
+    return reasons
+
+class ChangeDetector:
+    """Decides which alert-mode subscribers get the daily email.
+    
+    For every forecast group (grid cell and elevation band) it keeps, in the
+    forecast_digest table, the forecast and precautions it last alerted on.
+    A group alerts when a precaution appears or disappears, or a forecast
+    field moves beyond its tolerance, compared with that baseline rather than
+    with yesterday, so slow drift still adds up to an alert. A group that
+    alerted earlier on the same run date keeps alerting, so reruns and other
+    shards send it too, and subscribers who joined since the group's previous
+    check get their first email regardless. Must be used inside an app context."""
+    def __init__(self, grid: float, tolerances: Dict[str, float] = None):
+        self.grid = grid
+        self.tolerances = tolerances or parse_tolerances(os.getenv('ALERT_TOLERANCES', ''))
+        self.alerting = set()
+        self.suppressed = 0
+        self._new_after: Dict[Tuple, datetime] = {}
+        
+    def _load(self, keys: List[Tuple]) -> Dict[Tuple, ForecastDigest]:
+        rows = {}
+        for start in range(0, len(keys), 500):
+            chunk = [(lat, lon, low, high) for (lat, lon), (low, high) in keys[start:start + 500]]
+            for row in ForecastDigest.query.filter(
+                ForecastDigest.grid == self.grid,
+                tuple_(ForecastDigest.lat_index, ForecastDigest.lon_index,
+                       ForecastDigest.band_low, ForecastDigest.band_high).in_(chunk)
+            ):
+                rows[((row.lat_index, row.lon_index), (row.band_low, row.band_high))] = row
+        return rows
+        
+    def update(self, analyses: Dict[Tuple, Tuple[Sequence[float], List[str]]], run_date: date) -> int:
+        """Compare each group's analysis with its baseline and record the outcome.
+        Returns the number of groups alerting."""
+        try:
+            return self._update(analyses, run_date)
+        except IntegrityError:
+            # Another shard recorded a new group first; its row decides now
+            db.session.rollback()
+            return self._update(analyses, run_date)
+            
+    def _update(self, analyses, run_date: date) -> int:
+        now = datetime.utcnow()
+        stored = self._load(list(analyses))
+        self.alerting = set()
+        for key, (features, precautions) in analyses.items():
+            fingerprint = digest(features, precautions)
+            row = stored.get(key)
+            if row is None:
+                reasons = ['first forecast']
+            elif row.alerted_on == run_date:
+                reasons = ['alerted earlier today']
+            elif row.digest == fingerprint:
+                reasons = []
+            else:
+                reasons = changes((json.loads(row.features), json.loads(row.precautions)),
+                                  (features, precautions), self.tolerances)
+                                  
+            if row is None:
+                row = ForecastDigest(grid=self.grid, lat_index=key[0][0], lon_index=key[0][1],
+                                     band_low=key[1][0], band_high=key[1][1])
+                db.session.add(row)
+            row.digest = fingerprint
+            if row.checked_on != run_date:
+                row.previous_check_at = row.checked_at
+                row.checked_on = run_date
+                row.checked_at = now
+            if reasons and row.alerted_on != run_date:
+                logger.debug(f"Forecast for cell {key[0]} band {key[1]} changed: {'; '.join(reasons)}")
+                row.features = json.dumps([float(value) for value in features])
+                row.precautions = json.dumps(list(precautions))
+                row.alerted_on = run_date
+                row.alerted_at = now
+            if reasons:
+                self.alerting.add(key)
+            self._new_after[key] = row.previous_check_at or row.alerted_at
+        db.session.commit()
+        return len(self.alerting)
+        
+    def wants(self, key: Tuple, subscriber) -> bool:
+        """Whether an alert-mode subscriber in group `key` should get today's email."""
+        if key in self.alerting or key not in self._new_after:
+            return True
+        return subscriber.created_at is not None and subscriber.created_at > self._new_after[key]
+        
+    def select(self, subscribers: Iterable, group_key: Callable, on_skip: Callable = None) -> Iterator:
+        """Yield the subscribers to email: everyone not in alert mode, and the
+        alert-mode subscribers whose group changed."""
+        for subscriber in subscribers:
+            if not getattr(subscriber, 'alert_mode', False) or self.wants(group_key(subscriber), subscriber):
+                yield subscriber
+                continue
+            self.suppressed += 1
+            if on_skip:
+                on_skip(subscriber)
+                
+    def summary(self, label: str) -> str:
+        return f"{label} alerts: {len(self.alerting)} of {len(self._new_after)} alert-mode forecast groups changed"
@@ -1,24 +1,53 @@
 import os
-from flask import Flask, render_template, request, flash, redirect, url_for, session
+import threading
+import time
+import click
+from flask import Blueprint, Flask, Response, current_app, render_template, request, flash, redirect, url_for, session, jsonify
 from flask_wtf import FlaskForm
 from wtforms import StringField, FloatField, PasswordField, BooleanField
 from wtforms.validators import DataRequired, Email, Length
-from models import db, Subscriber, Admin
-from weather_service import WeatherService
-from dotenv import load_dotenv
-import threading
-import schedule
-import time
+from models import db, Subscriber, Admin, page_subscribers, subscriber_counts
+from config import configure, context_runner, database_uri
+from jobs import JobRegistry
+from metrics import REGISTRY
 from functools import wraps
 
-load_dotenv()
+# Routes and CLI commands; create_app registers them on an app
+web = Blueprint('web', __name__, cli_group=None)
+
+DASHBOARD_PAGE_SIZE = 50
+
+_service_lock = threading.Lock()
+
+def get_weather_service():
+    """Return the current app's WeatherService, importing and creating it on
+    first use so the web app starts without the batch pipeline's modules."""
+    app = current_app._get_current_object()
+    with _service_lock:
+        if 'weather_service' not in app.extensions:
+            from weather_service import WeatherService
+            app.extensions['weather_service'] = WeatherService()
+    return app.extensions['weather_service']
+
+def get_jobs() -> JobRegistry:
+    return current_app.extensions['jobs']
 
-app = Flask(__name__)
-app.config['SECRET_KEY'] = os.urandom(24)
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///weather_service.db'
-db.init_app(app)
+_counts_lock = threading.Lock()
 
-weather_service = WeatherService()
+def dashboard_counts():
+    """Return (total, active) subscriber counts, cached for DASHBOARD_COUNTS_TTL
+    seconds so dashboard loads don't each count the whole table."""
+    app = current_app._get_current_object()
+    with _counts_lock:
+        expires_at, counts = app.extensions.get('subscriber_counts', (0, None))
+        if expires_at <= time.monotonic():
+            counts = subscriber_counts()
+            app.extensions['subscriber_counts'] = (time.monotonic() + app.config['DASHBOARD_COUNTS_TTL'], counts)
+    return counts
+
+def forget_dashboard_counts():
+    """Drop the cached counts after this process changes subscribers."""
+    current_app.extensions.pop('subscriber_counts', None)
 
 # Forms
 class SubscriptionForm(FlaskForm):
@@ -26,6 +55,7 @@ class SubscriptionForm(FlaskForm):
     zip_code = StringField('Zip Code', validators=[DataRequired()])
     yard_size = FloatField('Yard Size (in acres)', validators=[DataRequired()])
     elevation = FloatField('Elevation (in feet)', validators=[DataRequired()])
+    alert_mode = BooleanField('Only email me when the forecast changes')
 
 class AdminLoginForm(FlaskForm):
     email = StringField('Email', validators=[DataRequired(), Email()])
@@ -41,59 +71,121 @@ def admin_required(f):
     def decorated_function(*args, **kwargs):
         if 'admin_id' not in session:
             flash('Please log in as admin first.', 'error')
-            return redirect(url_for('admin_login'))
+            return redirect(url_for('web.admin_login'))
         return f(*args, **kwargs)
     return decorated_function
 
-def run_schedule():
-    while True:
-        schedule.run_pending()
-        time.sleep(60)
+def send_sample(progress, report_type, email, zip_code, yard_size, elevation):
+    """Background job: geocode the form's zip code and send a one-off sample report."""
+    service = get_weather_service()
+    progress('Looking up your location')
+    coords = service._get_coordinates(zip_code)
+    
+    # Create a temporary subscriber object
+    temp_subscriber = Subscriber(
+        email=email,
+        location=zip_code,  # store zip code in location field
+        yard_size=yard_size,
+        elevation=elevation,
+        latitude=coords['lat'],
+        longitude=coords['lon']
+    )
+    
+    progress('Fetching the forecast')
+    message = service.build_report(report_type, temp_subscriber)
+    progress('Sending the email')
+    service.deliver(*message)
+    if report_type == 'daily':
+        return 'Sample daily update is on its way to your email!'
+    return 'Sample weekly summary is on its way to your email!'
+
+def send_subscriber_report(progress, subscriber_id, report_type):
+    """Background job: send a report to an existing subscriber."""
+    subscriber = db.session.get(Subscriber, subscriber_id)
+    if subscriber is None:
+        raise ValueError('Subscriber no longer exists.')
+    service = get_weather_service()
+    progress('Fetching the forecast')
+    message = service.build_report(report_type, subscriber)
+    progress('Sending the email')
+    service.deliver(*message)
+    return f'{report_type.capitalize()} report on its way to {subscriber.email}!'
+
+def fill_subscriber_timezone(progress, subscriber_id):
+    """Background job: look up the time zone of a subscriber who signed up
+    before a forecast for their location was cached or stored."""
+    subscriber = db.session.get(Subscriber, subscriber_id)
+    if subscriber is None or subscriber.timezone:
+        return 'Nothing to do'
+    service = get_weather_service()
+    cell = service.forecast_cache.cell_key(subscriber.latitude, subscriber.longitude)
+    subscriber.timezone = service.timezones_for_cells({cell})[cell]
+    db.session.commit()
+    return f'Time zone for {subscriber.email} is {subscriber.timezone}'
 
-@app.route('/', methods=['GET', 'POST'])
+@web.route('/', methods=['GET', 'POST'])
 def index():
     form = SubscriptionForm()
+    job_id = None
     if form.validate_on_submit():
         try:
-            # Use zip code for coordinates
-            coords = weather_service._get_coordinates(form.zip_code.data)
-            
             # Determine the action from the form
             action = request.form.get('action')
             
-            # Create a temporary subscriber object
-            temp_subscriber = Subscriber(
-                email=form.email.data,
-                location=form.zip_code.data,  # store zip code in location field
-                yard_size=form.yard_size.data,
-                elevation=form.elevation.data,
-                latitude=coords['lat'],
-                longitude=coords['lon']
-            )
-            
             if action == 'subscribe':
+                # Use zip code for coordinates
+                service = get_weather_service()
+                coords = service._get_coordinates(form.zip_code.data)
+                subscriber = Subscriber(
+                    email=form.email.data,
+                    location=form.zip_code.data,  # store zip code in location field
+                    yard_size=form.yard_size.data,
+                    elevation=form.elevation.data,
+                    alert_mode=form.alert_mode.data,
+                    latitude=coords['lat'],
+                    longitude=coords['lon'],
+                    # Known only if a forecast for this location is already at hand;
+                    # otherwise it is looked up in the background below
+                    timezone=service.known_timezone(coords['lat'], coords['lon'])
+                )
                 # Save subscriber to DB
-                db.session.add(temp_subscriber)
+                db.session.add(subscriber)
                 db.session.commit()
+                if subscriber.timezone is None:
+                    get_jobs().submit(f'Time zone for {subscriber.email}', fill_subscriber_timezone, subscriber.id)
+                forget_dashboard_counts()
                 flash('Successfully subscribed to weather alerts!', 'success')
-                return redirect(url_for('index'))
-            elif action == 'sample_daily':
-                weather_service.send_daily_update_for_subscriber(temp_subscriber)
-                flash('Sample daily update sent to your email!', 'success')
-            elif action == 'sample_weekly':
-                weather_service.send_weekly_summary_for_subscriber(temp_subscriber)
-                flash('Sample weekly summary sent to your email!', 'success')
+                return redirect(url_for('web.index'))
+            elif action in ('sample_daily', 'sample_weekly'):
+                report_type = 'daily' if action == 'sample_daily' else 'weekly'
+                job_id = get_jobs().submit(
+                    f'Sample {report_type} report for {form.email.data}',
+                    send_sample, report_type, form.email.data, form.zip_code.data,
+                    form.yard_size.data, form.elevation.data
+                )
             else:
                 flash('Unknown action.', 'error')
         except Exception as e:
             flash(f'Error: {str(e)}', 'error')
-    return render_template('index.html', form=form)
+    return render_template('index.html', form=form, job_id=job_id)
+
+@web.route('/jobs/<job_id>')
+def job_status(job_id):
+    job = get_jobs().get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    return jsonify(job)
 
-@app.route('/admin/register', methods=['GET', 'POST'])
+@web.route('/metrics')
+def metrics():
+    """Pipeline timings and counters in the Prometheus text format."""
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
+@web.route('/admin/register', methods=['GET', 'POST'])
 def admin_register():
     if Admin.query.first():
         flash('Admin already registered.', 'error')
-        return redirect(url_for('admin_login'))
+        return redirect(url_for('web.admin_login'))
         
     form = AdminRegistrationForm()
     if form.validate_on_submit():
@@ -102,10 +194,10 @@ def admin_register():
         db.session.add(admin)
         db.session.commit()
         flash('Admin registered successfully!', 'success')
-        return redirect(url_for('admin_login'))
+        return redirect(url_for('web.admin_login'))
     return render_template('admin/register.html', form=form)
 
-@app.route('/admin/login', methods=['GET', 'POST'])
+@web.route('/admin/login', methods=['GET', 'POST'])
 def admin_login():
     form = AdminLoginForm()
     if form.validate_on_submit():
@@ -113,64 +205,170 @@ def admin_login():
         if admin and admin.check_password(form.password.data):
             session['admin_id'] = admin.id
             flash('Logged in successfully!', 'success')
-            return redirect(url_for('admin_dashboard'))
+            return redirect(url_for('web.admin_dashboard'))
         flash('Invalid email or password.', 'error')
     return render_template('admin/login.html', form=form)
 
-@app.route('/admin/logout')
+@web.route('/admin/logout')
 def admin_logout():
     session.pop('admin_id', None)
     flash('Logged out successfully.', 'success')
-    return redirect(url_for('index'))
+    return redirect(url_for('web.index'))
 
-@app.route('/admin/dashboard')
+@web.route('/admin/dashboard')
 @admin_required
 def admin_dashboard():
-    subscribers = Subscriber.query.order_by(Subscriber.created_at.desc()).all()
-    return render_template('admin/dashboard.html', subscribers=subscribers)
+    search = request.args.get('q', '').strip()
+    subscribers, next_cursor = page_subscribers(search, limit=DASHBOARD_PAGE_SIZE)
+    total, active = dashboard_counts()
+    return render_template('admin/dashboard.html', subscribers=subscribers, next_cursor=next_cursor,
+                           search=search, total=total, active=active, inactive=total - active)
+
+@web.route('/admin/api/subscribers')
+@admin_required
+def subscribers_api():
+    limit = max(1, min(request.args.get('limit', DASHBOARD_PAGE_SIZE, type=int), 200))
+    try:
+        subscribers, next_cursor = page_subscribers(
+            request.args.get('q', '').strip(), request.args.get('cursor'), limit
+        )
+    except ValueError:
+        return jsonify({'error': 'Invalid cursor'}), 400
+    return jsonify({
+        'subscribers': [
+            {
+                'id': s.id,
+                'email': s.email,
+                'location': s.location,
+                'yard_size': s.yard_size,
+                'elevation': s.elevation,
+                'timezone': s.timezone,
+                'active': s.active,
+                'created_at': s.created_at.isoformat(),
+            }
+            for s in subscribers
+        ],
+        'html': render_template('admin/_subscriber_rows.html', subscribers=subscribers),
+        'next_cursor': next_cursor,
+    })
 
-@app.route('/admin/subscriber/<int:id>/toggle')
+@web.route('/admin/subscriber/<int:id>/toggle')
 @admin_required
 def toggle_subscriber(id):
     subscriber = Subscriber.query.get_or_404(id)
     subscriber.active = not subscriber.active
     db.session.commit()
+    forget_dashboard_counts()
     flash(f'Subscriber {subscriber.email} {"activated" if subscriber.active else "deactivated"} successfully!', 'success')
-    return redirect(url_for('admin_dashboard'))
+    return redirect(url_for('web.admin_dashboard'))
 
-@app.route('/admin/subscriber/<int:id>/delete')
+@web.route('/admin/subscriber/<int:id>/delete')
 @admin_required
 def delete_subscriber(id):
     subscriber = Subscriber.query.get_or_404(id)
     db.session.delete(subscriber)
     db.session.commit()
+    forget_dashboard_counts()
     flash(f'Subscriber {subscriber.email} deleted successfully!', 'success')
-    return redirect(url_for('admin_dashboard'))
+    return redirect(url_for('web.admin_dashboard'))
 
-@app.route('/admin/send-report/<int:id>/<report_type>')
+@web.route('/admin/send-report/<int:id>/<report_type>')
 @admin_required
 def send_report(id, report_type):
     subscriber = Subscriber.query.get_or_404(id)
-    try:
-        if report_type == 'daily':
-            weather_service.send_daily_update_for_subscriber(subscriber)
-            flash(f'Daily report sent to {subscriber.email}!', 'success')
-        elif report_type == 'weekly':
-            weather_service.send_weekly_summary_for_subscriber(subscriber)
-            flash(f'Weekly report sent to {subscriber.email}!', 'success')
-    except Exception as e:
-        flash(f'Error sending report: {str(e)}', 'error')
-    return redirect(url_for('admin_dashboard'))
-
-def init_scheduler():
-    schedule.every().day.at("08:00").do(weather_service.send_daily_update)
-    schedule.every().sunday.at("09:00").do(weather_service.send_weekly_summary)
-    scheduler_thread = threading.Thread(target=run_schedule)
-    scheduler_thread.daemon = True
-    scheduler_thread.start()
+    if report_type not in ('daily', 'weekly'):
+        flash(f'Unknown report type: {report_type}', 'error')
+        return redirect(url_for('web.admin_dashboard'))
+    job_id = get_jobs().submit(f'{report_type.capitalize()} report for {subscriber.email}',
+                               send_subscriber_report, subscriber.id, report_type)
+    return redirect(url_for('web.admin_dashboard', job=job_id))
+
+@web.cli.command('preload-geocodes')
+@click.argument('path')
+def preload_geocodes_command(path):
+    """Load zip code centroids from a CSV file into the geocode cache."""
+    from weather_service import preload_geocodes
+    inserted = preload_geocodes(path)
+    click.echo(f'Loaded {inserted} geocoded locations')
+
+@web.cli.command('prefetch-forecasts')
+def prefetch_forecasts_command():
+    """Fetch and store forecasts for every active subscriber location."""
+    fetched = get_weather_service().prefetch_forecasts()
+    click.echo(f'Prefetched {fetched} forecasts')
+
+@web.cli.command('upgrade-db')
+@click.option('--fill-timezones/--no-fill-timezones', default=True, show_default=True,
+              help='Look up time zones for subscribers that have none.')
+def upgrade_db_command(fill_timezones):
+    """Add tables, columns and indexes missing from an existing database."""
+    from models import upgrade_schema
+    from subscriber_io import fill_timezones as fill
+    for change in upgrade_schema():
+        click.echo(change)
+    if fill_timezones:
+        click.echo(f'Filled in time zones for {fill(get_weather_service())} subscribers')
+    click.echo('Database is up to date')
+
+@web.cli.command('import-subscribers')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--chunk-size', default=1000, show_default=True, help='Rows geocoded and inserted per batch.')
+@click.option('--resolve-timezones/--no-resolve-timezones', default=True, show_default=True,
+              help='Look up time zones for rows that do not give one.')
+def import_subscribers_command(path, chunk_size, resolve_timezones):
+    """Bulk import subscribers from a CSV or JSONL file."""
+    from subscriber_io import file_format, import_subscribers, read_rows
+    db.create_all()
+    with open(path, newline='') as f:
+        report = import_subscribers(get_weather_service(), read_rows(f, file_format(path)), chunk_size, resolve_timezones)
+    for line, email, message in report.errors:
+        click.echo(f'Line {line} ({email}): {message}', err=True)
+    click.echo(report.summary())
+
+@web.cli.command('export-subscribers')
+@click.argument('path', type=click.Path(dir_okay=False, allow_dash=True))
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'jsonl']), help='Defaults to the file extension.')
+def export_subscribers_command(path, fmt):
+    """Export all subscribers to a CSV or JSONL file ('-' for stdout)."""
+    from subscriber_io import export_subscribers, file_format
+    fmt = fmt or file_format(path)
+    if path == '-':
+        written = export_subscribers(click.get_text_stream('stdout'), fmt)
+    else:
+        with open(path, 'w', newline='') as f:
+            written = export_subscribers(f, fmt)
+    click.echo(f'Exported {written} subscribers', err=True)
+
+def create_app(config: dict = None) -> Flask:
+    """Build the web app. The weather service is created on first use, and
+    no scheduler is started; see init_scheduler."""
+    configure()
+    app = Flask(__name__)
+    app.config['SECRET_KEY'] = os.getenv('SECRET_KEY') or os.urandom(24)
+    app.config['SQLALCHEMY_DATABASE_URI'] = database_uri()
+    app.config['DASHBOARD_COUNTS_TTL'] = float(os.getenv('DASHBOARD_COUNTS_TTL', '30'))
+    app.config.update(config or {})
+    db.init_app(app)
+    app.extensions['jobs'] = JobRegistry(app, max_workers=int(os.getenv('JOB_WORKERS', '4')))
+    app.register_blueprint(web)
+    return app
+
+def init_scheduler(app: Flask):
+    # With SCHEDULER=external the batch runner (python batch_runner.py) schedules the runs,
+    # so several web processes don't each send the same reports.
+    from outbox import start_drain_thread
+    with app.app_context():
+        service = get_weather_service()
+    if os.getenv('SCHEDULER', 'thread') == 'thread':
+        from scheduler import TimezoneScheduler
+        TimezoneScheduler(service, context_runner(app)).start()
+    start_drain_thread(service, app)
+
+# For `flask --app app` and WSGI servers (gunicorn app:app)
+app = create_app()
 
 if __name__ == '__main__':
     with app.app_context():
         db.create_all()
-    init_scheduler()
+    init_scheduler(app)
     app.run(debug=True, port=5002) 
\ No newline at end of file
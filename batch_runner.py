@@ -0,0 +1,311 @@
+import argparse
+import json
+import logging
+import math
+import multiprocessing
+import os
+import socket
+import threading
+import uuid
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from sqlalchemy.exc import IntegrityError
+
+from models import BatchShard, Subscriber, db, subscriber_timezone
+from scheduler import TimezoneScheduler
+
+logger = logging.getLogger(__name__)
+
+STRATEGIES = ('location', 'id')
+
+def cell_index(column, grid: float):
+    """SQL for ForecastCache.cell_key's index along one axis: floor(column / grid + 0.5).
+    Written with CAST so it needs no floor() function and gives the same
+    result whether the database's CAST truncates or rounds."""
+    value = column / grid + 0.5
+    whole = db.cast(value, db.Integer)
+    return db.case((value < whole, whole - 1), else_=whole)
+
+def shard_clause(shard: BatchShard, grid: float):
+    """SQL condition selecting the subscribers that belong to a shard, or None for all of them.
+    
+    The `location` strategy hashes each subscriber's forecast grid cell, so a
+    location's forecast is only fetched by one shard. The `id` strategy uses
+    the contiguous id range recorded when the run was planned."""
+    if shard.shard_count == 1:
+        return None
+    if shard.strategy == 'id':
+        conditions = []
+        if shard.id_low is not None:
+            conditions.append(Subscriber.id >= shard.id_low)
+        if shard.id_high is not None:
+            conditions.append(Subscriber.id < shard.id_high)
+        return db.and_(db.true(), *conditions)
+    lat_index = cell_index(Subscriber.latitude, grid)
+    lon_index = cell_index(Subscriber.longitude, grid)
+    return db.func.abs(lat_index * 7919 + lon_index) % shard.shard_count == shard.shard_index
+
+def plan_run(run_key: str, kind: str, timezones: Optional[List[str]], shard_count: int,
+             strategy: str = 'location', default_timezone: str = 'UTC') -> int:
+    """Create the shards for one run, unless they already exist.
+    
+    Safe to call from several schedulers at once: the unique (run_key,
+    shard_index) constraint lets exactly one of them create the run.
+    Prefetch runs always get a single shard. Returns the number of shards
+    created. Must be called inside an app context."""
+    if strategy not in STRATEGIES:
+        raise ValueError(f"Unknown shard strategy {strategy!r}, expected one of {STRATEGIES}")
+    if BatchShard.query.filter_by(run_key=run_key).first() is not None:
+        return 0
+    shard_count = 1 if kind == 'prefetch' else max(1, shard_count)
+    
+    bounds = [(None, None)] * shard_count
+    if strategy == 'id' and shard_count > 1:
+        query = db.session.query(db.func.min(Subscriber.id), db.func.max(Subscriber.id)).filter(Subscriber.active == True)
+        if timezones is not None:
+            query = query.filter(subscriber_timezone(default_timezone).in_(timezones))
+        low, high = query.one()
+        if low is not None:
+            step = math.ceil((high - low + 1) / shard_count)
+            edges = [low + i * step for i in range(1, shard_count)]
+            # Open-ended first and last ranges also cover subscribers added after planning
+            bounds = list(zip([None] + edges, edges + [None]))
+            
+    db.session.execute(db.insert(BatchShard), [
+        {
+            'run_key': run_key,
+            'kind': kind,
+            'timezones': json.dumps(timezones) if timezones is not None else None,
+            'strategy': strategy,
+            'shard_index': index,
+            'shard_count': shard_count,
+            'id_low': low,
+            'id_high': high,
+            'state': 'pending',
+            'attempts': 0,
+            'created_at': datetime.utcnow(),
+        }
+        for index, (low, high) in enumerate(bounds)
+    ])
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # Another scheduler planned the same run first
+        db.session.rollback()
+        return 0
+    logger.info(f"Planned {run_key} as {shard_count} {strategy} shards")
+    return shard_count
+
+def run_instant(run_key: str) -> datetime:
+    """The UTC instant a run was planned for, from its `kind:instant` key."""
+    return datetime.fromisoformat(run_key.partition(':')[2])
+
+class ShardScheduler(TimezoneScheduler):
+    """Timezone scheduler that only plans runs; shard workers do the work.
+    
+    Each due bucket becomes a run keyed by its kind and UTC instant, so any
+    number of schedulers can run side by side and a run is still planned once."""
+    def __init__(self, service, wrap, shard_count: int, strategy: str, **kwargs):
+        super().__init__(service, wrap, **kwargs)
+        self.shard_count = shard_count
+        self.strategy = strategy
+        
+    def _dispatch(self, kind: str, timezones: List[str], instant: datetime = None):
+        run_key = f"{kind}:{(instant or datetime.utcnow()).isoformat()}"
+        try:
+            self.wrap(lambda: plan_run(
+                run_key, kind, timezones, self.shard_count, self.strategy, self.service.default_timezone
+            ))()
+        except Exception as e:
+            logger.error(f"Failed to plan {run_key}: {str(e)}")
+
+class ShardWorker:
+    """Claims pending shards from the batch_shard table and runs them.
+    
+    A claim is a lease: the worker renews it on a heartbeat thread while the
+    shard runs, and a shard whose lease expires (its worker crashed or lost
+    the database) goes back to pending for another worker to re-claim, up to
+    `max_attempts` times. Shards nobody claimed within `max_age_hours` are
+    marked failed instead of sending a stale report. Re-running a shard after
+    a crash does not send twice: the run skips subscribers already in the
+    delivery ledger."""
+    def __init__(self, service, worker_id: str = None, lease_seconds: int = 300,
+                 max_attempts: int = 3, max_age_hours: float = 6, poll_interval: float = 5,
+                 context=None):
+        self.service = service
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.max_age = timedelta(hours=max_age_hours)
+        self.poll_interval = poll_interval
+        if context is None:
+            from flask import current_app
+            context = current_app._get_current_object().app_context
+        self.context = context
+        self.prefetch_lead_minutes = int(os.getenv('PREFETCH_LEAD_MINUTES', '30'))
+        self._stop = threading.Event()
+        
+    def _recover(self, now: datetime):
+        """Release expired leases and give up on shards that are too old or retried too often."""
+        expired = db.and_(BatchShard.state == 'running', BatchShard.lease_until < now)
+        BatchShard.query.filter(
+            db.or_(BatchShard.state == 'pending', expired),
+            BatchShard.created_at < now - self.max_age
+        ).update({'state': 'failed', 'owner': None, 'last_error': 'Not run in time'}, synchronize_session=False)
+        BatchShard.query.filter(expired, BatchShard.attempts >= self.max_attempts).update(
+            {'state': 'failed', 'owner': None, 'last_error': 'Lease expired too many times'},
+            synchronize_session=False
+        )
+        BatchShard.query.filter(expired).update({'state': 'pending', 'owner': None}, synchronize_session=False)
+        db.session.commit()
+        
+    def claim(self) -> Optional[BatchShard]:
+        """Claim the oldest pending shard, or return None if there is none."""
+        now = datetime.utcnow()
+        self._recover(now)
+        candidates = [
+            shard_id for (shard_id,) in db.session.query(BatchShard.id)
+            .filter(BatchShard.state == 'pending')
+            .order_by(BatchShard.created_at, BatchShard.shard_index)
+            .limit(20)
+        ]
+        for shard_id in candidates:
+            claimed = BatchShard.query.filter(BatchShard.id == shard_id, BatchShard.state == 'pending').update({
+                'state': 'running',
+                'owner': self.worker_id,
+                'lease_until': now + timedelta(seconds=self.lease_seconds),
+                'attempts': BatchShard.attempts + 1,
+                'started_at': now,
+            }, synchronize_session=False)
+            db.session.commit()
+            if claimed:
+                return db.session.get(BatchShard, shard_id, populate_existing=True)
+        return None
+        
+    def _heartbeat(self, shard_id: int, done: threading.Event):
+        with self.context():
+            while not done.wait(self.lease_seconds / 3):
+                with db.engine.begin() as conn:
+                    conn.execute(
+                        db.update(BatchShard)
+                        .where(BatchShard.id == shard_id, BatchShard.owner == self.worker_id)
+                        .values(lease_until=datetime.utcnow() + timedelta(seconds=self.lease_seconds))
+                    )
+                    
+    def _finish(self, shard: BatchShard, **values):
+        finished = BatchShard.query.filter(
+            BatchShard.id == shard.id, BatchShard.owner == self.worker_id
+        ).update(dict(values, owner=None, finished_at=datetime.utcnow()), synchronize_session=False)
+        db.session.commit()
+        if not finished:
+            logger.warning(f"Lost the lease on {shard!r} before it finished")
+            
+    def run_shard(self, shard: BatchShard):
+        label = f"{shard.run_key} shard {shard.shard_index + 1}/{shard.shard_count}"
+        logger.info(f"Worker {self.worker_id} running {label} (attempt {shard.attempts})")
+        timezones = json.loads(shard.timezones) if shard.timezones else None
+        done = threading.Event()
+        heartbeat = threading.Thread(target=self._heartbeat, args=(shard.id, done), daemon=True)
+        heartbeat.start()
+        try:
+            if shard.kind == 'prefetch':
+                self.service.prefetch_forecasts(self.prefetch_lead_minutes, timezones)
+                sent = failed = None
+            else:
+                send = self.service.send_daily_update if shard.kind == 'daily' else self.service.send_weekly_summary
+                report = send(timezones, shard_clause(shard, self.service.forecast_cache.grid),
+                              run_instant(shard.run_key))
+                sent, failed = report.sent, report.failed
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"{label} failed: {str(e)}")
+            state = 'failed' if shard.attempts >= self.max_attempts else 'pending'
+            self._finish(shard, state=state, last_error=str(e))
+        else:
+            self._finish(shard, state='done', sent=sent, failed=failed)
+        finally:
+            done.set()
+            heartbeat.join()
+            
+    def run_once(self) -> bool:
+        """Run one shard if any is pending. Returns whether one was run."""
+        shard = self.claim()
+        if shard is None:
+            return False
+        self.run_shard(shard)
+        return True
+        
+    def run_forever(self):
+        logger.info(f"Shard worker {self.worker_id} started")
+        while not self._stop.is_set():
+            if not self.run_once():
+                self._stop.wait(self.poll_interval)
+                
+    def stop(self):
+        self._stop.set()
+
+def _settings():
+    return {
+        'shard_count': int(os.getenv('BATCH_SHARDS', '4')),
+        'strategy': os.getenv('BATCH_SHARD_STRATEGY', 'location'),
+    }
+
+def run_worker():
+    from config import create_db_app
+    from outbox import start_drain_thread
+    from weather_service import WeatherService
+    
+    app = create_db_app()
+    service = WeatherService()
+    with app.app_context():
+        db.create_all()
+        start_drain_thread(service, app)
+        ShardWorker(
+            service,
+            lease_seconds=int(os.getenv('BATCH_LEASE_SECONDS', '300')),
+            max_attempts=int(os.getenv('BATCH_SHARD_MAX_ATTEMPTS', '3'))
+        ).run_forever()
+
+def main():
+    from config import configure
+    configure()
+    parser = argparse.ArgumentParser(description="Sharded batch runner for the weather alert service.")
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('scheduler', help='Plan runs as they come due (run one or more)')
+    worker = commands.add_parser('worker', help='Claim and run shards (run on as many hosts as needed)')
+    worker.add_argument('--processes', type=int, default=1, help='Worker processes to start on this host')
+    plan = commands.add_parser('plan', help='Plan a run now, for workers to pick up')
+    plan.add_argument('kind', choices=['prefetch', 'daily', 'weekly'])
+    plan.add_argument('--timezones', help='Comma-separated time zones (default: every subscriber)')
+    plan.add_argument('--shards', type=int, default=_settings()['shard_count'])
+    plan.add_argument('--strategy', choices=STRATEGIES, default=_settings()['strategy'])
+    args = parser.parse_args()
+    
+    if args.command == 'worker':
+        if args.processes <= 1:
+            run_worker()
+            return
+        spawn = multiprocessing.get_context('spawn')
+        processes = [spawn.Process(target=run_worker, name=f'shard-worker-{i}') for i in range(args.processes)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        return
+        
+    from config import context_runner, create_db_app
+    from weather_service import WeatherService
+    app = create_db_app()
+    service = WeatherService()
+    with app.app_context():
+        db.create_all()
+        if args.command == 'plan':
+            timezones = args.timezones.split(',') if args.timezones else None
+            run_key = f"{args.kind}:{datetime.utcnow().isoformat()}"
+            plan_run(run_key, args.kind, timezones, args.shards, args.strategy, service.default_timezone)
+            return
+    ShardScheduler(service, context_runner(app), **_settings()).run()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,250 @@
+"""End-to-end benchmark of subscriber import and the daily/weekly batch runs.
+
+Usage: python -m benchmarks.pipeline [--sizes 1000,10000] [--layouts clustered,uniform]
+                                     [--output results.json] [--compare baseline.json]
+                                     [--no-imports]
+
+Runs entirely offline: OpenWeatherMap is replaced by a local server replaying
+the recorded responses in benchmarks/fixtures, and mail goes to a local SMTP
+sink. For each synthetic population it bulk imports the subscribers (geocoding
+and time zone lookups included), then runs the daily and weekly sends with a
+cold forecast cache, recording wall time, throughput, API calls, per-stage
+latency (from the service's metrics) and peak traced memory. It also measures
+the cold import time of the web app and the batch entry points with
+`python -X importtime`. Results are written as JSON so runs on different
+builds can be compared with --compare."""
+import argparse
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+from flask import Flask
+
+import metrics
+from benchmarks import population
+from benchmarks.servers import FixtureAPIServer, SMTPSink
+from models import StoredForecast, db
+from openweather import OpenWeatherClient
+from smtp_pool import SMTPPool
+from subscriber_io import import_subscribers
+from weather_service import WeatherService
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Entry-point modules whose cold import time is measured: the web app
+# (loaded by every WSGI worker) and the batch CLIs
+STARTUP_MODULES = ('app', 'batch_runner', 'outbox', 'weather_service')
+
+@contextmanager
+def measured(result: dict, track_memory: bool):
+    """Record elapsed seconds and (optionally) peak traced memory into `result`."""
+    metrics.STAGE_SECONDS.clear()
+    if track_memory:
+        tracemalloc.start()
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        result['elapsed_s'] = round(time.perf_counter() - started, 4)
+        if track_memory:
+            result['peak_memory_mb'] = round(tracemalloc.get_traced_memory()[1] / 2 ** 20, 2)
+            tracemalloc.stop()
+        result['stages'] = {
+            stage: {
+                'count': count,
+                'mean_ms': round(total / count * 1000, 4),
+                'p50_ms': round(metrics.STAGE_SECONDS.quantile(0.5, stage=stage) * 1000, 4),
+                'p95_ms': round(metrics.STAGE_SECONDS.quantile(0.95, stage=stage) * 1000, 4),
+            }
+            for stage, (count, total) in metrics.stage_snapshot().items() if count
+        }
+
+def make_service(api_url: str, smtp_port: int) -> WeatherService:
+    service = WeatherService()
+    service.api = OpenWeatherClient('benchmark', base_url=api_url, rate_per_minute=0)
+    service.smtp_pool = SMTPPool('127.0.0.1', smtp_port, use_ssl=False, size=service.send_workers)
+    service.sender_email = 'alerts@example.com'
+    service.use_outbox = False
+    return service
+
+def run_population(size: int, layout: str, track_memory: bool, prefetched: bool) -> list:
+    rows, locations = population.generate(size, layout)
+    results = []
+    with FixtureAPIServer(locations) as api, SMTPSink() as sink, tempfile.TemporaryDirectory() as tmp:
+        app = Flask(__name__)
+        app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(tmp, 'benchmark.db')}"
+        db.init_app(app)
+        with app.app_context():
+            db.create_all()
+            service = make_service(api.url, sink.port)
+            
+            result = {'phase': 'import', 'size': size, 'layout': layout, 'locations': len(locations)}
+            calls_before = sum(api.calls.values())
+            with measured(result, track_memory):
+                report = import_subscribers(service, enumerate(rows, start=2))
+            result.update(
+                processed=report.inserted,
+                failed=len(report.errors),
+                throughput_per_s=round(report.inserted / result['elapsed_s'], 1),
+                api_calls=sum(api.calls.values()) - calls_before,
+            )
+            results.append(result)
+            
+            for report_type, run in (('daily', service.send_daily_update), ('weekly', service.send_weekly_summary)):
+                if not prefetched:
+                    StoredForecast.query.delete()
+                    db.session.commit()
+                service.forecast_cache.clear()
+                result = {'phase': report_type, 'size': size, 'layout': layout}
+                calls_before = sum(api.calls.values())
+                messages_before, bytes_before = sink.messages, sink.bytes
+                with measured(result, track_memory):
+                    report = run()
+                result.update(
+                    processed=report.sent,
+                    failed=report.failed,
+                    throughput_per_s=round(report.sent / result['elapsed_s'], 1),
+                    api_calls=sum(api.calls.values()) - calls_before,
+                    smtp_messages=sink.messages - messages_before,
+                    smtp_mb=round((sink.bytes - bytes_before) / 2 ** 20, 2),
+                )
+                results.append(result)
+            service.smtp_pool.close()
+            db.session.remove()
+            db.engine.dispose()
+    return results
+
+def import_times(module: str, runs: int = 5, top: int = 5) -> dict:
+    """Import `module` in fresh interpreters under `-X importtime` and report the
+    median cumulative import time, wall time, and the slowest imports it pulled in."""
+    cumulative, wall, slowest = [], [], {}
+    for _ in range(runs):
+        started = time.perf_counter()
+        proc = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+            capture_output=True, text=True, cwd=ROOT
+        )
+        wall.append(time.perf_counter() - started)
+        if proc.returncode != 0:
+            raise RuntimeError(f"Importing {module} failed: {proc.stderr.strip().splitlines()[-1]}")
+        for line in proc.stderr.splitlines():
+            if not line.startswith('import time:') or 'cumulative' in line:
+                continue
+            _, total, name = line[len('import time:'):].split('|')
+            # Nesting is shown by indentation: two more spaces per level
+            depth = (len(name) - len(name.lstrip()) - 1) // 2
+            name, total = name.strip(), int(total) / 1000
+            if depth == 0 and name == module:
+                cumulative.append(total)
+            elif depth == 1:
+                # Only the module's direct imports, whose times include their own dependencies
+                slowest[name] = slowest.get(name, 0) + total / runs
+    return {
+        'module': module,
+        'import_ms': round(statistics.median(cumulative), 1),
+        'wall_ms': round(statistics.median(wall) * 1000, 1),
+        'slowest': [
+            {'module': name, 'ms': round(ms, 1)}
+            for name, ms in sorted(slowest.items(), key=lambda item: -item[1])[:top]
+        ],
+    }
+
+def build_info() -> dict:
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, cwd=ROOT
+        ).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        'commit': commit,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'started_at': datetime.now(timezone.utc).isoformat(),
+    }
+
+def compare(results: list, imports: list, baseline: dict):
+    """Print the change in elapsed time and import time against a previous run."""
+    previous = {(r['phase'], r['size'], r['layout']): r for r in baseline['results']}
+    print(f"Compared with {baseline['build'].get('commit')}:", file=sys.stderr)
+    for result in results:
+        before = previous.get((result['phase'], result['size'], result['layout']))
+        if before is None or not before['elapsed_s']:
+            continue
+        change = (result['elapsed_s'] - before['elapsed_s']) / before['elapsed_s'] * 100
+        print(
+            f"  {result['phase']:>6} {result['size']:>7} {result['layout']:<9} "
+            f"{before['elapsed_s']:8.2f}s -> {result['elapsed_s']:8.2f}s ({change:+.1f}%)",
+            file=sys.stderr
+        )
+    previous = {r['module']: r for r in baseline.get('imports', [])}
+    for result in imports:
+        before = previous.get(result['module'])
+        if before is None or not before['import_ms']:
+            continue
+        change = (result['import_ms'] - before['import_ms']) / before['import_ms'] * 100
+        print(
+            f"  import {result['module']:<26} {before['import_ms']:8.1f}ms -> {result['import_ms']:8.1f}ms ({change:+.1f}%)",
+            file=sys.stderr
+        )
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='1000,10000',
+                        help='Comma-separated population sizes (e.g. 1000,10000,100000)')
+    parser.add_argument('--layouts', default=','.join(population.LAYOUTS),
+                        help='Comma-separated layouts: clustered, uniform')
+    parser.add_argument('--output', help='Write JSON results here instead of stdout')
+    parser.add_argument('--compare', help='JSON results from an earlier run to compare against')
+    parser.add_argument('--prefetched', action='store_true',
+                        help='Keep forecasts stored during import, as a scheduled prefetch would')
+    parser.add_argument('--no-memory', action='store_true',
+                        help='Skip tracemalloc, which slows the runs down')
+    parser.add_argument('--no-imports', action='store_true',
+                        help='Skip the entry-point import time measurements')
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+    
+    build = build_info()
+    imports = []
+    if not args.no_imports:
+        for module in STARTUP_MODULES:
+            result = import_times(module)
+            imports.append(result)
+            print(
+                f"import {module:<26} {result['import_ms']:8.1f}ms import {result['wall_ms']:8.1f}ms process",
+                file=sys.stderr
+            )
+    results = []
+    for size in (int(s) for s in args.sizes.split(',')):
+        for layout in args.layouts.split(','):
+            for result in run_population(size, layout, not args.no_memory, args.prefetched):
+                results.append(result)
+                print(
+                    f"{result['phase']:>6} {size:>7} {layout:<9} {result['elapsed_s']:8.2f}s "
+                    f"{result['throughput_per_s']:10.1f}/s {result['api_calls']:7d} API calls"
+                    + (f" {result['peak_memory_mb']:8.1f} MB peak" if 'peak_memory_mb' in result else ''),
+                    file=sys.stderr
+                )
+                
+    output = {'build': build, 'prefetched': args.prefetched, 'imports': imports, 'results': results}
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, imports, json.load(f))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(output, f, indent=2)
+    else:
+        json.dump(output, sys.stdout, indent=2)
+        print()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+"""Synthetic subscriber populations for the pipeline benchmark.
+
+A population is a list of subscriber rows (as accepted by
+`subscriber_io.import_subscribers`) plus the zip code coordinates the fixture
+API server should answer with. `clustered` puts subscribers in a handful of
+metro areas, as a property-management client would; `uniform` spreads them
+over the continental US, so nearly every subscriber is its own location."""
+import random
+from typing import Dict, List, Tuple
+
+# (lat, lon) of metro areas used as cluster centres
+METROS = [
+    (47.61, -122.33), (45.52, -122.68), (37.77, -122.42), (34.05, -118.24), (32.72, -117.16),
+    (33.45, -112.07), (39.74, -104.99), (40.76, -111.89), (30.27, -97.74), (29.76, -95.37),
+    (32.78, -96.80), (41.88, -87.63), (44.98, -93.27), (39.10, -94.58), (36.16, -86.78),
+    (33.75, -84.39), (25.76, -80.19), (35.23, -80.84), (38.91, -77.04), (39.95, -75.17),
+    (40.71, -74.01), (42.36, -71.06), (42.33, -83.05), (39.96, -82.99), (48.10, -119.78),
+]
+# Continental US bounding box: (south, north), (west, east)
+CONUS = ((25.0, 49.0), (-124.5, -67.0))
+LAYOUTS = ('clustered', 'uniform')
+
+def generate(size: int, layout: str, seed: int = 42) -> Tuple[List[Dict], Dict[str, Tuple[float, float]]]:
+    """Return (rows, {zip: (lat, lon)}) for `size` subscribers."""
+    if layout not in LAYOUTS:
+        raise ValueError(f"Unknown layout {layout!r}, expected one of {LAYOUTS}")
+    rng = random.Random(seed)
+    if layout == 'clustered':
+        # Roughly 40 subscribers per zip code, within ~15 km of a metro centre
+        zip_count = max(1, size // 40)
+        points = []
+        for _ in range(zip_count):
+            lat, lon = rng.choice(METROS)
+            points.append((lat + rng.gauss(0, 0.08), lon + rng.gauss(0, 0.1)))
+    else:
+        # The US has about 33k zip codes; beyond that subscribers share them
+        zip_count = min(size, 33000)
+        (south, north), (west, east) = CONUS
+        points = [(rng.uniform(south, north), rng.uniform(west, east)) for _ in range(zip_count)]
+    locations = {f'{i:05d}': (round(lat, 4), round(lon, 4)) for i, (lat, lon) in enumerate(points, start=1)}
+    zips = list(locations)
+    
+    rows = []
+    for i in range(size):
+        rows.append({
+            'email': f'subscriber{i}@example.com',
+            'zip_code': zips[i % len(zips)] if layout == 'uniform' else rng.choice(zips),
+            'yard_size': round(rng.uniform(0.1, 5.0), 2),
+            'elevation': round(rng.choice([rng.uniform(0, 1500), rng.uniform(1500, 3500), rng.uniform(3500, 9000)])),
+        })
+    return rows, locations
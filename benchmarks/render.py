@@ -0,0 +1,95 @@
+"""Micro-benchmark for email rendering cost per message.
+
+Usage: python -m benchmarks.render [--recipients N] [--scenario NAME]
+
+Times the steps of building a report for N recipients at one location, all
+from the same recorded forecast in benchmarks/fixtures/onecall.json: the
+original f-string HTML assembly (the baseline), rendering the full report
+per recipient (forecast section included), reusing one rendered forecast
+section and filling in only the recipient parts, and building the MIME
+message from the rendered content."""
+import argparse
+import logging
+import time
+from collections import namedtuple
+from datetime import datetime
+
+from benchmarks.servers import load_fixture
+from weather_service import WeatherService
+
+Recipient = namedtuple('Recipient', 'email location latitude longitude elevation')
+
+def fstring_report(report_type, recipient, days, precautions):
+    """The HTML assembly the Jinja templates replaced, kept as the baseline."""
+    if report_type == 'daily':
+        tomorrow = days[0]
+        content = f"""
+        <h2>Weather Update for {recipient.location}</h2>
+        <h3>Tomorrow's Forecast:</h3>
+        <p>Temperature: {tomorrow['temp']['day']}°F</p>
+        <p>Weather: {tomorrow['weather'][0]['description']}</p>
+        <p>Precipitation Chance: {tomorrow['pop'] * 100}%</p>
+        
+        <h3>Recommended Precautions:</h3>
+        <ul>
+        {''.join([f'<li>{p}</li>' for p in precautions[0]])}
+        </ul>
+        """
+        return (recipient.email, f"Daily Weather Update for {recipient.location}", content)
+    content = "<h2>Weekly Weather Summary</h2>"
+    for day, day_precautions in zip(days, precautions):
+        date = datetime.fromtimestamp(day['dt']).strftime('%A, %B %d')
+        content += f"""
+            <h3>{date}</h3>
+            <p>Temperature: {day['temp']['day']}°F</p>
+            <p>Weather: {day['weather'][0]['description']}</p>
+            <p>Precipitation Chance: {day['pop'] * 100}%</p>
+            
+            <h4>Recommended Precautions:</h4>
+            <ul>
+            {''.join([f'<li>{p}</li>' for p in day_precautions])}
+            </ul>
+            <hr>
+            """
+    return (recipient.email, f"Weekly Weather Summary for {recipient.location}", content)
+
+def per_message_us(fn, recipients):
+    start = time.perf_counter()
+    for recipient in recipients:
+        fn(recipient)
+    return (time.perf_counter() - start) / len(recipients) * 1e6
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--recipients', type=int, default=5000)
+    parser.add_argument('--scenario', default='winter_storm', help='Forecast from benchmarks/fixtures/onecall.json.')
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+    
+    service = WeatherService()
+    forecast = load_fixture('onecall.json')[args.scenario]
+    recipients = [
+        Recipient(f'user{i}@example.com', '98812', 48.1, -119.78, 2500)
+        for i in range(args.recipients)
+    ]
+    
+    for report_type in ('daily', 'weekly'):
+        days = service.forecast_days(report_type, forecast)
+        precautions = [service.analyze_weather_conditions(day, 2500, month=5) for day in days]
+        shared = service.render_forecast(report_type, days, precautions)
+        messages = [service.compose_message(report_type, r, shared) for r in recipients]
+        
+        baseline = per_message_us(lambda r: fstring_report(report_type, r, days, precautions), recipients)
+        full = per_message_us(
+            lambda r: service.compose_message(report_type, r, service.render_forecast(report_type, days, precautions)),
+            recipients
+        )
+        reused = per_message_us(lambda r: service.compose_message(report_type, r, shared), recipients)
+        mime = per_message_us(lambda m: service.build_message(*m).as_bytes(), messages)
+        print(
+            f"{report_type:>6}: f-string baseline {baseline:8.1f} us/msg | full render {full:8.1f} us/msg | "
+            f"shared forecast {reused:8.1f} us/msg | MIME build {mime:8.1f} us/msg"
+        )
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,186 @@
+"""Local stand-ins for OpenWeatherMap and the SMTP server used by the benchmarks.
+
+`FixtureAPIServer` replays the recorded responses in benchmarks/fixtures,
+re-stamped with the requested coordinates and the current time so cached
+forecasts stay fresh. `SMTPSink` accepts and discards mail, counting it;
+the SMTP pool's tests also use it to drop connections."""
+import copy
+import json
+import os
+import socket
+import socketserver
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Tuple
+from urllib.parse import parse_qs, urlparse
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+def load_fixture(name: str):
+    with open(os.path.join(FIXTURE_DIR, name)) as f:
+        return json.load(f)
+
+def timezone_for_longitude(lon: float) -> str:
+    """Rough US time zone for a longitude, standing in for the API's lookup."""
+    if lon > -87.5:
+        return 'America/New_York'
+    if lon > -101.0:
+        return 'America/Chicago'
+    if lon > -114.5:
+        return 'America/Denver'
+    return 'America/Los_Angeles'
+
+class _Server:
+    """Run a socketserver on a background thread for the lifetime of a `with` block."""
+    def __init__(self, server):
+        self.server = server
+        self.port = server.server_address[1]
+        self._thread = threading.Thread(target=server.serve_forever, daemon=True)
+        
+    def __enter__(self):
+        self._thread.start()
+        return self
+        
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+class FixtureAPIServer(_Server):
+    """HTTP server answering One Call and geocoding requests from fixtures.
+    
+    Each grid location gets one of the recorded forecast scenarios, picked
+    deterministically from its coordinates. Zip codes are resolved from
+    `locations` ({zip: (lat, lon)}); unknown zips get a 404 like the real API."""
+    def __init__(self, locations: Dict[str, Tuple[float, float]]):
+        scenarios = load_fixture('onecall.json')
+        geo_zip = load_fixture('geo_zip.json')
+        geo_direct = load_fixture('geo_direct.json')
+        self.calls: Dict[str, int] = {}
+        calls = self.calls
+        lock = threading.Lock()
+        
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True
+            
+            def do_GET(self):
+                url = urlparse(self.path)
+                query = {key: values[0] for key, values in parse_qs(url.query).items()}
+                with lock:
+                    calls[url.path] = calls.get(url.path, 0) + 1
+                if url.path == '/data/3.0/onecall':
+                    status, body = 200, self.onecall(float(query['lat']), float(query['lon']))
+                elif url.path == '/geo/1.0/zip':
+                    status, body = self.geocode_zip(query['zip'].split(',')[0])
+                elif url.path == '/geo/1.0/direct':
+                    status, body = 200, geo_direct
+                else:
+                    status, body = 404, {'cod': 404, 'message': 'Not found'}
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+                
+            def onecall(self, lat, lon):
+                names = sorted(scenarios)
+                forecast = copy.deepcopy(scenarios[names[zlib.crc32(f'{lat},{lon}'.encode()) % len(names)]])
+                shift = int(time.time()) - forecast['current']['dt']
+                for entry in [forecast['current']] + forecast['daily']:
+                    for field in ('dt', 'sunrise', 'sunset', 'moonrise', 'moonset'):
+                        if field in entry:
+                            entry[field] += shift
+                forecast.update(lat=lat, lon=lon, timezone=timezone_for_longitude(lon))
+                return forecast
+                
+            def geocode_zip(self, zip_code):
+                if zip_code not in locations:
+                    return 404, {'cod': '404', 'message': 'not found'}
+                lat, lon = locations[zip_code]
+                return 200, dict(geo_zip, zip=zip_code, lat=lat, lon=lon)
+                
+            def log_message(self, *args):
+                pass
+                
+        super().__init__(ThreadingHTTPServer(('127.0.0.1', 0), Handler))
+        self.url = f'http://127.0.0.1:{self.port}'
+
+class SMTPSink(_Server):
+    """Minimal SMTP server that accepts every message and throws it away.
+    Counts connections, NOOPs and messages; drop_connections() hangs up on
+    every open connection, as a server timing out idle sessions would."""
+    def __init__(self):
+        self.messages = 0
+        self.bytes = 0
+        self.connections = 0
+        self.noops = 0
+        self._open = set()
+        sink = self
+        lock = threading.Lock()
+        self._lock = lock
+        
+        class Handler(socketserver.StreamRequestHandler):
+            disable_nagle_algorithm = True
+            
+            def reply(self, line: str):
+                self.wfile.write(f'{line}\r\n'.encode())
+                
+            def handle(self):
+                with lock:
+                    sink.connections += 1
+                    sink._open.add(self.connection)
+                try:
+                    self.serve()
+                finally:
+                    with lock:
+                        sink._open.discard(self.connection)
+                        
+            def serve(self):
+                self.reply('220 localhost benchmark sink')
+                while True:
+                    line = self.rfile.readline()
+                    if not line:
+                        return
+                    command = line[:4].upper()
+                    if command == b'EHLO':
+                        self.wfile.write(b'250-localhost\r\n250 8BITMIME\r\n')
+                    elif command == b'DATA':
+                        self.reply('354 End data with <CR><LF>.<CR><LF>')
+                        size = 0
+                        for data in self.rfile:
+                            if data in (b'.\r\n', b'.\n'):
+                                break
+                            size += len(data)
+                        with lock:
+                            sink.messages += 1
+                            sink.bytes += size
+                        self.reply('250 OK')
+                    elif command == b'NOOP':
+                        with lock:
+                            sink.noops += 1
+                        self.reply('250 OK')
+                    elif command == b'QUIT':
+                        self.reply('221 Bye')
+                        return
+                    else:
+                        self.reply('250 OK')
+                        
+        server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), Handler)
+        server.daemon_threads = True
+        super().__init__(server)
+        
+    def drop_connections(self, timeout: float = 2.0):
+        """Close every open connection without a goodbye, waiting until their handlers have exited."""
+        with self._lock:
+            connections = list(self._open)
+        for connection in connections:
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        deadline = time.monotonic() + timeout
+        while self._open and time.monotonic() < deadline:
+            time.sleep(0.01)
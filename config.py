@@ -0,0 +1,46 @@
+import logging
+import os
+import threading
+
+from dotenv import load_dotenv
+
+_configured = False
+_lock = threading.Lock()
+
+def configure():
+    """Load .env and set up logging, once per process. Entry points call this;
+    library modules don't, so importing them has no side effects."""
+    global _configured
+    with _lock:
+        if _configured:
+            return
+        load_dotenv()
+        logging.basicConfig(
+            level=logging.INFO,
+            format='%(asctime)s - %(levelname)s - %(message)s'
+        )
+        _configured = True
+
+def database_uri() -> str:
+    return os.getenv('DATABASE_URL', 'sqlite:///weather_service.db')
+
+def create_db_app():
+    """A Flask app with only the database configured, for scripts and workers
+    that don't serve the web UI."""
+    from flask import Flask
+    from models import db
+    
+    configure()
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = database_uri()
+    db.init_app(app)
+    return app
+
+def context_runner(app):
+    """Return `wrap(job)` for the schedulers: wrap(job)() runs job inside an app context."""
+    def wrap(job):
+        def run():
+            with app.app_context():
+                return job()
+        return run
+    return wrap
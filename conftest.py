@@ -0,0 +1,54 @@
+import json
+import os
+import time
+
+import pytest
+from flask import Flask
+
+from models import db
+from weather_service import WeatherService
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmarks', 'fixtures')
+
+@pytest.fixture
+def app(tmp_path):
+    """A database-only app with the tables created, inside an app context.
+    The database is a file, so the batch pipeline's threads each get their own connection."""
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{tmp_path / 'test.db'}"
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        yield app
+
+@pytest.fixture
+def forecast():
+    """A One Call forecast with light rain, reissued as of now."""
+    with open(os.path.join(FIXTURE_DIR, 'onecall.json')) as f:
+        forecast = json.load(f)['mild_rain']
+    shift = int(time.time()) - forecast['current']['dt']
+    for entry in [forecast['current']] + forecast['daily']:
+        entry['dt'] += shift
+    return forecast
+
+@pytest.fixture
+def make_service(forecast):
+    """Return make(sent, fail_for=(), temp_shift=0), building a WeatherService
+    that serves `forecast` (tomorrow `temp_shift` degrees warmer) without the
+    API and sends directly, appending each recipient to `sent` and raising for
+    the addresses in `fail_for`."""
+    def make(sent, fail_for=(), temp_shift=0):
+        served = json.loads(json.dumps(forecast))
+        served['daily'][1]['temp']['day'] += temp_shift
+        
+        def send_email(to_email, subject, content):
+            if to_email in fail_for:
+                raise ValueError('SMTP connection lost')
+            sent.append(to_email)
+            
+        service = WeatherService()
+        service.use_outbox = False
+        service.get_weather_forecast = lambda lat, lon: json.loads(json.dumps(served))
+        service.send_email = send_email
+        return service
+    return make
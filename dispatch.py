@@ -0,0 +1,135 @@
+import logging
+import queue
+import threading
+import time
+from contextlib import nullcontext
+from typing import Callable, Iterable
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+class DispatchReport:
+    """Counters and timing for one batch run."""
+    def __init__(self, label: str):
+        self.label = label
+        self.total = 0
+        self.sent = 0
+        self.failed = 0
+        self.started_at = time.monotonic()
+        self.finished_at = None
+        
+    @property
+    def elapsed(self) -> float:
+        end = self.finished_at if self.finished_at is not None else time.monotonic()
+        return end - self.started_at
+        
+    @property
+    def throughput(self) -> float:
+        """Emails sent per second."""
+        return self.sent / self.elapsed if self.elapsed > 0 else 0.0
+        
+    def summary(self) -> str:
+        return (
+            f"{self.label}: {self.sent}/{self.total} sent, {self.failed} failed "
+            f"in {self.elapsed:.1f}s ({self.throughput:.1f} emails/s)"
+        )
+
+class BatchDispatcher:
+    """Two-stage fan-out for batch runs.
+    
+    Items flow through a prepare stage (forecast fetch and rendering) and a
+    send stage, each served by its own pool of worker threads. The queues
+    feeding each stage are bounded, so a slow SMTP server holds back
+    forecast fetching, and fetching holds back reading further subscribers.
+    A failure for one item is logged and counted without affecting the rest.
+    Each worker thread runs inside `context()` (e.g. a Flask app context),
+    and `on_result` is called with 'sent' or 'failed' as each item finishes."""
+    def __init__(self, prepare: Callable, send: Callable, fetch_workers: int = 8,
+                 send_workers: int = 4, queue_size: int = 100,
+                 describe: Callable = str, context: Callable = nullcontext,
+                 on_result: Callable = None):
+        self.prepare = prepare
+        self.send = send
+        self.fetch_workers = fetch_workers
+        self.send_workers = send_workers
+        self.queue_size = queue_size
+        self.describe = describe
+        self.context = context
+        self.on_result = on_result or (lambda outcome: None)
+        
+    def run(self, items: Iterable, label: str) -> DispatchReport:
+        """Push every item through both stages and wait for them to finish."""
+        report = DispatchReport(label)
+        lock = threading.Lock()
+        prepare_queue = queue.Queue(maxsize=self.queue_size)
+        send_queue = queue.Queue(maxsize=self.queue_size)
+        
+        def record_failure(item, e):
+            logger.error(f"Failed to send {label} to {self.describe(item)}: {str(e)}")
+            with lock:
+                report.failed += 1
+            self.on_result('failed')
+                
+        def prepare_worker():
+            while True:
+                item = prepare_queue.get()
+                if item is _STOP:
+                    return
+                try:
+                    message = self.prepare(item)
+                except Exception as e:
+                    record_failure(item, e)
+                    continue
+                send_queue.put((item, message))
+                
+        def send_worker():
+            while True:
+                entry = send_queue.get()
+                if entry is _STOP:
+                    return
+                item, message = entry
+                try:
+                    self.send(message)
+                except Exception as e:
+                    record_failure(item, e)
+                    continue
+                with lock:
+                    report.sent += 1
+                self.on_result('sent')
+                    
+        def in_context(worker):
+            def run():
+                with self.context():
+                    worker()
+            return run
+            
+        prepare_threads = self._start(in_context(prepare_worker), self.fetch_workers, f"{label}-fetch")
+        send_threads = self._start(in_context(send_worker), self.send_workers, f"{label}-send")
+        try:
+            for item in items:
+                report.total += 1
+                prepare_queue.put(item)
+        finally:
+            self._stop(prepare_queue, prepare_threads)
+            self._stop(send_queue, send_threads)
+            report.finished_at = time.monotonic()
+            
+        logger.info(report.summary())
+        return report
+        
+    @staticmethod
+    def _start(target: Callable, count: int, name: str):
+        threads = []
+        for i in range(max(1, count)):
+            thread = threading.Thread(target=target, name=f"{name}-{i}", daemon=True)
+            thread.start()
+            threads.append(thread)
+        return threads
+        
+    @staticmethod
+    def _stop(work_queue: queue.Queue, threads):
+        for _ in threads:
+            work_queue.put(_STOP)
+        for thread in threads:
+            thread.join()
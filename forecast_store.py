@@ -0,0 +1,65 @@
+import json
+import logging
+import zlib
+from datetime import datetime
+from typing import Dict, Iterable, Tuple
+
+from sqlalchemy import tuple_
+
+from models import StoredForecast, db
+
+logger = logging.getLogger(__name__)
+
+def load_fresh(grid: float, valid_at: datetime = None, cells: Iterable[Tuple[int, int]] = None,
+               chunk_size: int = 500) -> Dict[Tuple[int, int], Tuple[float, Dict]]:
+    """Return stored forecasts for a grid that are still fresh at `valid_at` (UTC, default now),
+    as {cell: (expires_at, forecast)}. With `cells`, only those cells are read.
+    Must be called inside an app context."""
+    now = valid_at or datetime.utcnow()
+    query = (
+        db.select(StoredForecast.lat_index, StoredForecast.lon_index,
+                  StoredForecast.expires_at, StoredForecast.payload)
+        .where(StoredForecast.grid == grid, StoredForecast.expires_at > now)
+    )
+    if cells is None:
+        rows = db.session.execute(query).all()
+    else:
+        cells = list(cells)
+        rows = []
+        for start in range(0, len(cells), chunk_size):
+            chunk = cells[start:start + chunk_size]
+            rows += db.session.execute(
+                query.where(tuple_(StoredForecast.lat_index, StoredForecast.lon_index).in_(chunk))
+            ).all()
+    return {
+        (row.lat_index, row.lon_index): (
+            (row.expires_at - datetime(1970, 1, 1)).total_seconds(),
+            json.loads(zlib.decompress(row.payload))
+        )
+        for row in rows
+    }
+
+def save(grid: float, entries: Dict[Tuple[int, int], Tuple[float, Dict]], chunk_size: int = 500):
+    """Store forecasts given as {cell: (expires_at, forecast)}, replacing older ones for the same cells.
+    Must be called inside an app context."""
+    StoredForecast.query.filter(StoredForecast.expires_at < datetime.utcnow()).delete()
+    cells = list(entries)
+    for start in range(0, len(cells), chunk_size):
+        chunk = cells[start:start + chunk_size]
+        StoredForecast.query.filter(
+            StoredForecast.grid == grid,
+            tuple_(StoredForecast.lat_index, StoredForecast.lon_index).in_(chunk)
+        ).delete(synchronize_session=False)
+        db.session.execute(db.insert(StoredForecast), [
+            {
+                'grid': grid,
+                'lat_index': cell[0],
+                'lon_index': cell[1],
+                'payload': zlib.compress(json.dumps(entries[cell][1]).encode('utf-8')),
+                'expires_at': datetime.utcfromtimestamp(entries[cell][0]),
+            }
+            for cell in chunk
+        ])
+        db.session.commit()
+    db.session.commit()
+    logger.info(f"Stored {len(cells)} prefetched forecasts")
@@ -0,0 +1,57 @@
+import logging
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Optional
+
+from models import BackgroundJob, db
+
+logger = logging.getLogger(__name__)
+
+class JobRegistry:
+    """Runs slow request work on a background thread pool and tracks its status.
+    
+    A job function is called inside an app context with a `progress` callback
+    as its first argument; its return value becomes the job's final message.
+    Status is kept in the background_job table, so any web process can report
+    on a job another one runs; jobs older than `keep` are deleted."""
+    def __init__(self, app, max_workers: int = 4, keep: timedelta = timedelta(days=1)):
+        self.app = app
+        self.keep = keep
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='job')
+        
+    def submit(self, description: str, fn: Callable, *args) -> str:
+        """Queue fn(progress, *args) and return the new job's id."""
+        job_id = uuid.uuid4().hex
+        with self.app.app_context():
+            now = datetime.utcnow()
+            BackgroundJob.query.filter(BackgroundJob.created_at < now - self.keep).delete(synchronize_session=False)
+            db.session.add(BackgroundJob(id=job_id, description=description, state='queued',
+                                         message='Waiting to start', created_at=now))
+            db.session.commit()
+        self._executor.submit(self._run, job_id, fn, args)
+        return job_id
+        
+    def _update(self, job_id: str, **fields):
+        # A fresh app context gets its own session, so this never commits the job's own work
+        with self.app.app_context():
+            BackgroundJob.query.filter_by(id=job_id).update(fields, synchronize_session=False)
+            db.session.commit()
+            
+    def _run(self, job_id: str, fn: Callable, args: tuple):
+        self._update(job_id, state='running', message='Started')
+        progress = lambda message: self._update(job_id, message=message)
+        try:
+            with self.app.app_context():
+                result = fn(progress, *args)
+        except Exception as e:
+            logger.error(f"Job {job_id} failed: {str(e)}")
+            self._update(job_id, state='failed', message=f'Error: {str(e)}', finished_at=datetime.utcnow())
+        else:
+            self._update(job_id, state='done', message=result or 'Done', finished_at=datetime.utcnow())
+            
+    def get(self, job_id: str) -> Optional[Dict]:
+        """Return the job's status, or None if it is unknown."""
+        with self.app.app_context():
+            job = db.session.get(BackgroundJob, job_id)
+            return job.to_dict() if job else None
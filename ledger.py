@@ -0,0 +1,62 @@
+import logging
+from datetime import date, datetime
+from itertools import islice
+from typing import Callable, Iterable, Iterator, Set
+
+from sqlalchemy.exc import IntegrityError
+
+from models import Delivery, OutboundEmail, db
+
+logger = logging.getLogger(__name__)
+
+def record(subscriber_id: int, report_type: str, forecast_date: date) -> bool:
+    """Note that a report was sent. Returns False if it was already recorded.
+    Uses its own connection, so it is safe from any thread with an app context."""
+    try:
+        with db.engine.begin() as conn:
+            conn.execute(db.insert(Delivery).values(
+                subscriber_id=subscriber_id, report_type=report_type,
+                forecast_date=forecast_date, sent_at=datetime.utcnow()
+            ))
+    except IntegrityError:
+        return False
+    return True
+
+def handled(subscriber_ids: Iterable[int], report_type: str, forecast_date: date) -> Set[int]:
+    """Return the ids among `subscriber_ids` that were already sent this report,
+    or already have it queued in the outbox. Outbox messages that ran out of
+    attempts don't count, so a rerun queues them again."""
+    ids = list(subscriber_ids)
+    if not ids:
+        return set()
+    with db.engine.connect() as conn:
+        sent = conn.execute(
+            db.select(Delivery.subscriber_id).where(
+                Delivery.subscriber_id.in_(ids),
+                Delivery.report_type == report_type,
+                Delivery.forecast_date == forecast_date
+            )
+        ).scalars().all()
+        queued = conn.execute(
+            db.select(OutboundEmail.subscriber_id).where(
+                OutboundEmail.subscriber_id.in_(ids),
+                OutboundEmail.report_type == report_type,
+                OutboundEmail.forecast_date == forecast_date,
+                OutboundEmail.state != 'failed'
+            )
+        ).scalars().all()
+    return set(sent) | set(queued)
+
+def pending(subscribers: Iterable, report_type: str, forecast_date: date, chunk_size: int = 500,
+            on_skip: Callable[[int], None] = None) -> Iterator:
+    """Yield the subscribers that still need this report, checking the ledger
+    one chunk at a time. `on_skip` is called with the number skipped per chunk."""
+    subscribers = iter(subscribers)
+    while True:
+        chunk = list(islice(subscribers, chunk_size))
+        if not chunk:
+            return
+        done = handled((s.id for s in chunk), report_type, forecast_date)
+        if done and on_skip:
+            on_skip(len(done))
+        yield from (s for s in chunk if s.id not in done)
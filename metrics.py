@@ -0,0 +1,217 @@
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Tuple
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class _Metric:
+    """Base for labelled metrics; one value per distinct label combination."""
+    type = ''
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+        
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} takes labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+        
+    def samples(self) -> List[Tuple[str, Tuple[str, ...], float]]:
+        with self._lock:
+            return [(self.name, key, value) for key, value in self._values.items()]
+            
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        for name, key, value in self.samples():
+            lines.append(f"{name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+        
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+            
+    def clear(self):
+        """Drop every recorded value."""
+        with self._lock:
+            self._values.clear()
+
+class Counter(_Metric):
+    """Monotonically increasing count."""
+    type = 'counter'
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+class Gauge(_Metric):
+    """Value that can go up and down."""
+    type = 'gauge'
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+            
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+class _HistogramValue:
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+class Histogram(_Metric):
+    """Distribution of observed values in cumulative buckets."""
+    type = 'histogram'
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = _HistogramValue(self.buckets)
+            entry.count += 1
+            entry.sum += value
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry.counts[i] += 1
+                    break
+                    
+    @contextmanager
+    def time(self, **labels):
+        """Observe the wall-clock duration of the block, in seconds."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+            
+    def stats(self, **labels) -> Tuple[int, float]:
+        """Return (count, sum) for one label combination."""
+        with self._lock:
+            entry = self._values.get(self._key(labels))
+            return (entry.count, entry.sum) if entry else (0, 0.0)
+            
+    def quantile(self, q: float, **labels) -> float:
+        """Estimate the q-quantile by interpolating within its bucket, as
+        Prometheus' histogram_quantile does. Returns 0.0 with no observations."""
+        with self._lock:
+            entry = self._values.get(self._key(labels))
+            if entry is None or not entry.count:
+                return 0.0
+            counts = list(entry.counts)
+            count = entry.count
+        rank = q * count
+        cumulative = 0
+        lower = 0.0
+        for bound, bucket_count in zip(self.buckets, counts):
+            if bucket_count and cumulative + bucket_count >= rank:
+                return lower + (bound - lower) * (rank - cumulative) / bucket_count
+            cumulative += bucket_count
+            lower = bound
+        return self.buckets[-1]
+        
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        with self._lock:
+            entries = [(key, list(entry.counts), entry.count, entry.sum) for key, entry in self._values.items()]
+        for key, counts, count, total in entries:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts + [count - sum(counts)]):
+                cumulative += bucket_count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+class Registry:
+    """Collection of metrics rendered together in the Prometheus text format."""
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+        
+    def register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self._metrics[metric.name] = metric
+        return metric
+        
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return '\n'.join(line for metric in metrics for line in metric.render()) + '\n'
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    'weather_stage_seconds', 'Time spent in each pipeline stage.', ['stage'],
+    buckets=(0.00005, 0.0001, 0.00025, 0.0005) + DEFAULT_BUCKETS
+))
+API_CALLS = REGISTRY.register(Counter(
+    'weather_api_calls_total', 'OpenWeatherMap HTTP requests, by endpoint and HTTP status (or connection_error).', ['endpoint', 'outcome']
+))
+API_RETRIES = REGISTRY.register(Counter(
+    'weather_api_retries_total', 'OpenWeatherMap requests retried after a transient failure.', ['endpoint']
+))
+CACHE_LOOKUPS = REGISTRY.register(Counter(
+    'weather_cache_lookups_total', 'Forecast and geocode cache lookups, by cache and result.', ['cache', 'result']
+))
+EMAILS = REGISTRY.register(Counter(
+    'weather_emails_total', 'Emails handed to SMTP, by outcome.', ['outcome']
+))
+SMTP_RETRIES = REGISTRY.register(Counter(
+    'weather_smtp_retries_total', 'SMTP sends retried on a fresh connection.'
+))
+OUTBOX_RETRIES = REGISTRY.register(Counter(
+    'weather_outbox_retries_total', 'Queued emails rescheduled after a failed delivery.'
+))
+RUN_ITEMS = REGISTRY.register(Counter(
+    'weather_run_subscribers_total', 'Subscribers processed by batch runs, by report type and outcome.',
+    ['report_type', 'outcome']
+))
+RUN_PROGRESS = REGISTRY.register(Gauge(
+    'weather_run_progress', 'Subscribers in the current batch run, by report type and state.',
+    ['report_type', 'state']
+))
+
+STAGES = ('geocode', 'forecast_fetch', 'analysis', 'render', 'smtp')
+
+def stage_snapshot() -> Dict[str, Tuple[int, float]]:
+    """Return (count, total seconds) per pipeline stage."""
+    return {stage: STAGE_SECONDS.stats(stage=stage) for stage in STAGES}
+
+def stage_summary(before: Dict[str, Tuple[int, float]]) -> str:
+    """Describe the stage timings recorded since `before` was taken."""
+    parts = []
+    for stage, (count, total) in stage_snapshot().items():
+        count -= before[stage][0]
+        total -= before[stage][1]
+        if count:
+            parts.append(f"{stage} {count}x avg {total / count * 1000:.1f}ms")
+    return ', '.join(parts) or 'no stages timed'
@@ -1,5 +1,6 @@
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
+from typing import List, Tuple
 from werkzeug.security import generate_password_hash, check_password_hash
 
 db = SQLAlchemy()
@@ -15,7 +16,7 @@ class Admin(db.Model):
         
     def check_password(self, password):
         return check_password_hash(self.password_hash, password)
-    
+        
     def __repr__(self):
         return f'<Admin {self.email}>'
 
@@ -29,6 +30,256 @@ class Subscriber(db.Model):
     longitude = db.Column(db.Float, nullable=False)
     created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     active = db.Column(db.Boolean, default=True)  # New field for subscriber status
+    timezone = db.Column(db.String(64))  # IANA name, derived from the coordinates at subscribe time
+    alert_mode = db.Column(db.Boolean, default=False)  # daily email only when the forecast changes materially
+    
+    __table_args__ = (
+        db.Index('ix_subscriber_active_id', 'active', 'id'),
+        db.Index('ix_subscriber_created_at', 'created_at', 'id'),
+        db.Index('ix_subscriber_location', 'location'),
+    )
+    
+    def __repr__(self):
+        return f'<Subscriber {self.email}>'
+
+def upgrade_schema() -> List[str]:
+    """Bring an existing database up to date with the models.
+    
+    Creates missing tables and indexes, and adds columns introduced since the
+    database was created (as nullable columns, with existing rows set to the
+    column's default). Safe to run repeatedly. Returns a line per change made."""
+    db.create_all()
+    inspector = db.inspect(db.engine)
+    changes = []
+    for table in db.metadata.sorted_tables:
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            column_type = column.type.compile(db.engine.dialect)
+            with db.engine.begin() as conn:
+                conn.execute(db.text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+                if column.default is not None and column.default.is_scalar:
+                    conn.execute(table.update().values({column.name: column.default.arg}))
+            changes.append(f'Added column {table.name}.{column.name}')
+            
+        indexes = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in indexes:
+                index.create(db.engine)
+                changes.append(f'Created index {index.name}')
+    return changes
+
+def page_subscribers(search: str = None, cursor: str = None, limit: int = 50):
+    """Return one page of subscribers, newest first, and the cursor for the next page.
+    
+    Pages are keyset-paginated on (created_at, id), so each page costs the
+    same no matter how deep it is. `search` matches the start of the email
+    address or location, case-sensitively, and is answered from their indexes.
+    The returned cursor is None on the last page."""
+    query = Subscriber.query.order_by(Subscriber.created_at.desc(), Subscriber.id.desc())
+    if search:
+        # A range on each indexed column, so matches are found through the email
+        # and location indexes instead of by scanning every subscriber
+        upper = search + '\U0010ffff'
+        matches = db.union(
+            db.select(Subscriber.id).where(Subscriber.email >= search, Subscriber.email < upper),
+            db.select(Subscriber.id).where(Subscriber.location >= search, Subscriber.location < upper)
+        ).subquery()
+        query = query.filter(Subscriber.id.in_(db.select(matches.c.id)))
+    if cursor:
+        created_at, _, last_id = cursor.rpartition('_')
+        created_at = datetime.fromisoformat(created_at)
+        query = query.filter(db.or_(
+            Subscriber.created_at < created_at,
+            db.and_(Subscriber.created_at == created_at, Subscriber.id < int(last_id))
+        ))
+    subscribers = query.limit(limit + 1).all()
+    next_cursor = None
+    if len(subscribers) > limit:
+        subscribers = subscribers[:limit]
+        last = subscribers[-1]
+        next_cursor = f'{last.created_at.isoformat()}_{last.id}'
+    return subscribers, next_cursor
+
+def subscriber_counts() -> Tuple[int, int]:
+    """Return the (total, active) subscriber counts from one pass over the (active, id) index."""
+    rows = db.session.query(Subscriber.active, db.func.count()).group_by(Subscriber.active).all()
+    return sum(count for _, count in rows), sum(count for active, count in rows if active)
+
+def subscriber_timezone(default_timezone: str):
+    """SQL expression for a subscriber's time zone, falling back to `default_timezone`."""
+    return db.func.coalesce(Subscriber.timezone, default_timezone)
+
+def active_timezones(default_timezone: str):
+    """Return the distinct time zones of active subscribers."""
+    tz = subscriber_timezone(default_timezone)
+    with db.engine.connect() as conn:
+        return [row[0] for row in conn.execute(db.select(tz).where(Subscriber.active == True).distinct())]
+
+def iter_active_subscribers(chunk_size: int = 500, timezones=None, default_timezone: str = 'UTC', shard=None):
+    """Yield active subscribers in id order as lightweight rows.
+    
+    Subscribers are read in keyset-paginated chunks, each on its own short-lived
+    connection, so no transaction stays open while a batch run is sending and
+    only the columns the batch jobs need are loaded. With `timezones`, only
+    subscribers in those time zones are returned; `shard` is an extra SQL
+    condition restricting them further."""
+    last_id = 0
+    while True:
+        query = (
+            db.select(Subscriber.id, Subscriber.email, Subscriber.location, Subscriber.latitude,
+                      Subscriber.longitude, Subscriber.elevation, Subscriber.alert_mode, Subscriber.created_at)
+            .where(Subscriber.active == True, Subscriber.id > last_id)
+            .order_by(Subscriber.id)
+            .limit(chunk_size)
+        )
+        if timezones is not None:
+            query = query.where(subscriber_timezone(default_timezone).in_(list(timezones)))
+        if shard is not None:
+            query = query.where(shard)
+        with db.engine.connect() as conn:
+            rows = conn.execute(query).all()
+        if not rows:
+            return
+        yield from rows
+        last_id = rows[-1].id
+
+class GeocodedLocation(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    location = db.Column(db.String(120), unique=True, nullable=False)  # normalized zip code or place name
+    latitude = db.Column(db.Float, nullable=False)
+    longitude = db.Column(db.Float, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<GeocodedLocation {self.location}>'
+
+class OutboundEmail(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    dedupe_key = db.Column(db.String(255), unique=True)  # set by batch runs so a rerun does not queue twice
+    to_email = db.Column(db.String(120), nullable=False)
+    subject = db.Column(db.String(255), nullable=False)
+    html = db.Column(db.Text, nullable=False)
+    state = db.Column(db.String(16), nullable=False, default='pending')  # pending, sending, sent or failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    claim_token = db.Column(db.String(32))
+    locked_until = db.Column(db.DateTime)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime)
+    # Set for batch reports, so a successful send can be recorded in the delivery ledger
+    subscriber_id = db.Column(db.Integer)
+    report_type = db.Column(db.String(16))
+    forecast_date = db.Column(db.Date)
+    
+    __table_args__ = (
+        db.Index('ix_outbound_email_state_next_attempt', 'state', 'next_attempt_at'),
+    )
+    
+    def __repr__(self):
+        return f'<OutboundEmail {self.id} {self.state} {self.to_email}>'
+
+class Delivery(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    subscriber_id = db.Column(db.Integer, db.ForeignKey('subscriber.id', ondelete='CASCADE'), nullable=False)
+    report_type = db.Column(db.String(16), nullable=False)  # daily or weekly
+    forecast_date = db.Column(db.Date, nullable=False)
+    sent_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    
+    __table_args__ = (
+        db.UniqueConstraint('subscriber_id', 'report_type', 'forecast_date', name='uq_delivery_report'),
+    )
+    
+    def __repr__(self):
+        return f'<Delivery {self.report_type} {self.forecast_date} to {self.subscriber_id}>'
+
+class StoredForecast(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    grid = db.Column(db.Float, nullable=False)  # forecast cache grid size the cell indexes refer to
+    lat_index = db.Column(db.Integer, nullable=False)
+    lon_index = db.Column(db.Integer, nullable=False)
+    payload = db.Column(db.LargeBinary, nullable=False)  # zlib-compressed One Call JSON
+    expires_at = db.Column(db.DateTime, nullable=False)
+    fetched_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    
+    __table_args__ = (
+        db.UniqueConstraint('grid', 'lat_index', 'lon_index', name='uq_stored_forecast_cell'),
+    )
+    
+    def __repr__(self):
+        return f'<StoredForecast {self.lat_index},{self.lon_index}>'
+
+class ForecastDigest(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    grid = db.Column(db.Float, nullable=False)  # forecast cache grid size the cell indexes refer to
+    lat_index = db.Column(db.Integer, nullable=False)
+    lon_index = db.Column(db.Integer, nullable=False)
+    band_low = db.Column(db.Integer, nullable=False)  # elevation band, see WeatherService.elevation_band
+    band_high = db.Column(db.Integer, nullable=False)
+    digest = db.Column(db.String(40), nullable=False)  # of the last analysed forecast and precautions
+    features = db.Column(db.Text, nullable=False)  # JSON forecast fields last alerted on, in rules.FIELDS order
+    precautions = db.Column(db.Text, nullable=False)  # JSON precautions last alerted on
+    alerted_on = db.Column(db.Date, nullable=False)  # run date of the last alert
+    alerted_at = db.Column(db.DateTime, nullable=False)
+    checked_on = db.Column(db.Date, nullable=False)  # run date of the last check
+    checked_at = db.Column(db.DateTime, nullable=False)  # first check on that date
+    previous_check_at = db.Column(db.DateTime)  # first check on the run date before; later subscribers are new
+    
+    __table_args__ = (
+        db.UniqueConstraint('grid', 'lat_index', 'lon_index', 'band_low', 'band_high', name='uq_forecast_digest_group'),
+    )
+    
+    def __repr__(self):
+        return f'<ForecastDigest {self.lat_index},{self.lon_index} band {self.band_low}-{self.band_high}>'
+
+class BackgroundJob(db.Model):
+    id = db.Column(db.String(32), primary_key=True)
+    description = db.Column(db.String(255), nullable=False)
+    state = db.Column(db.String(16), nullable=False, default='queued')  # queued, running, done or failed
+    message = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+    finished_at = db.Column(db.DateTime)
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'description': self.description,
+            'state': self.state,
+            'message': self.message,
+            'created_at': self.created_at.isoformat(),
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+        }
+        
+    def __repr__(self):
+        return f'<BackgroundJob {self.id} {self.state}>'
+
+class BatchShard(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    run_key = db.Column(db.String(120), nullable=False)  # e.g. daily:2026-10-18T15:00:00+00:00
+    kind = db.Column(db.String(16), nullable=False)  # prefetch, daily or weekly
+    timezones = db.Column(db.Text)  # JSON list of time zones covered, or NULL for everyone
+    strategy = db.Column(db.String(16), nullable=False)  # id or location
+    shard_index = db.Column(db.Integer, nullable=False)
+    shard_count = db.Column(db.Integer, nullable=False)
+    id_low = db.Column(db.Integer)  # id strategy: subscriber ids in [id_low, id_high)
+    id_high = db.Column(db.Integer)
+    state = db.Column(db.String(16), nullable=False, default='pending')  # pending, running, done or failed
+    owner = db.Column(db.String(64))
+    lease_until = db.Column(db.DateTime)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    sent = db.Column(db.Integer)
+    failed = db.Column(db.Integer)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    
+    __table_args__ = (
+        db.UniqueConstraint('run_key', 'shard_index', name='uq_batch_shard_run_index'),
+        db.Index('ix_batch_shard_state_lease', 'state', 'lease_until'),
+    )
     
     def __repr__(self):
-        return f'<Subscriber {self.email}>' 
\ No newline at end of file
+        return f'<BatchShard {self.run_key} {self.shard_index + 1}/{self.shard_count} {self.state}>'
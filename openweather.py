@@ -0,0 +1,94 @@
+import logging
+import random
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Any, Dict, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from metrics import API_CALLS, API_RETRIES
+from ratelimit import RateLimiter
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+class OpenWeatherClient:
+    """HTTP client for the OpenWeatherMap APIs.
+    
+    Requests share one pooled keep-alive session and carry connect/read
+    timeouts. 429 and 5xx responses, timeouts and connection errors are
+    retried with jittered exponential backoff, waiting for Retry-After when
+    the server sends it. A client-side rate limiter keeps calls within the
+    plan's per-minute quota. `base_url` can point at a local stub server."""
+    def __init__(self, api_key: str, base_url: str = 'https://api.openweathermap.org',
+                 connect_timeout: float = 3.05, read_timeout: float = 10, max_retries: int = 3,
+                 backoff: float = 0.5, max_backoff: float = 30, rate_per_minute: float = 60,
+                 pool_size: int = 16):
+        self.api_key = api_key
+        self.base_url = base_url.rstrip('/')
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.limiter = RateLimiter(rate_per_minute)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        
+    def _retry_delay(self, attempt: int, response: Optional[requests.Response]) -> float:
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+        if retry_after:
+            try:
+                delay = float(retry_after)
+            except ValueError:
+                try:
+                    delay = (parsedate_to_datetime(retry_after) - datetime.now(timezone.utc)).total_seconds()
+                except (TypeError, ValueError):
+                    delay = None
+            if delay is not None:
+                return min(self.max_backoff, max(0.0, delay))
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+        
+    def get(self, path: str, params: Dict[str, Any]) -> Any:
+        """GET an API path and return the decoded JSON body.
+        Errors are re-raised without the request URL, which contains the API key."""
+        url = f"{self.base_url}{path}"
+        params = dict(params, appid=self.api_key)
+        for attempt in range(self.max_retries + 1):
+            self.limiter.acquire()
+            response = None
+            try:
+                response = self.session.get(url, params=params, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                API_CALLS.inc(endpoint=path, outcome='connection_error')
+                if attempt == self.max_retries:
+                    raise type(e)(f"{type(e).__name__} calling {path}") from None
+            else:
+                API_CALLS.inc(endpoint=path, outcome=str(response.status_code))
+                if response.status_code not in RETRY_STATUSES or attempt == self.max_retries:
+                    if response.status_code >= 400:
+                        raise requests.HTTPError(
+                            f"{response.status_code} {response.reason} from {path}", response=response
+                        )
+                    return response.json()
+            API_RETRIES.inc(endpoint=path)
+            delay = self._retry_delay(attempt, response)
+            status = response.status_code if response is not None else 'connection error'
+            logger.warning(f"OpenWeather {path} returned {status}, retrying in {delay:.1f}s")
+            time.sleep(delay)
+            
+    def onecall(self, lat: float, lon: float, units: str = 'imperial') -> Dict:
+        """One Call 3.0 current conditions and forecast."""
+        return self.get('/data/3.0/onecall', {'lat': lat, 'lon': lon, 'units': units})
+        
+    def geocode_zip(self, zip_code: str, country: str = 'US') -> Dict:
+        """Coordinates for a zip/post code."""
+        return self.get('/geo/1.0/zip', {'zip': f'{zip_code},{country}'})
+        
+    def geocode_direct(self, query: str, limit: int = 1) -> list:
+        """Coordinates for a place name."""
+        return self.get('/geo/1.0/direct', {'q': query, 'limit': limit})
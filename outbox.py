@@ -0,0 +1,229 @@
+import logging
+import os
+import random
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+
+from sqlalchemy.exc import IntegrityError
+
+import ledger
+from metrics import OUTBOX_RETRIES
+from models import OutboundEmail, db
+from ratelimit import RateLimiter
+
+logger = logging.getLogger(__name__)
+
+def enqueue(to_email: str, subject: str, html: str, dedupe_key: Optional[str] = None,
+            ledger_entry: Optional[Tuple] = None) -> Optional[OutboundEmail]:
+    """Queue a rendered email for the outbox worker.
+    `ledger_entry` is (subscriber_id, report_type, forecast_date) for batch reports,
+    recorded in the delivery ledger once the email is sent.
+    A message with the same dedupe key that ran out of attempts is replaced
+    and retried from scratch; returns None if one is still queued or was sent."""
+    message = OutboundEmail(to_email=to_email, subject=subject, html=html, dedupe_key=dedupe_key)
+    if ledger_entry is not None:
+        message.subscriber_id, message.report_type, message.forecast_date = ledger_entry
+    db.session.add(message)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        requeued = OutboundEmail.query.filter(
+            OutboundEmail.dedupe_key == dedupe_key,
+            OutboundEmail.state == 'failed'
+        ).update({
+            'to_email': to_email,
+            'subject': subject,
+            'html': html,
+            'state': 'pending',
+            'attempts': 0,
+            'next_attempt_at': datetime.utcnow(),
+            'claim_token': None,
+            'locked_until': None,
+            'last_error': None,
+        }, synchronize_session=False)
+        db.session.commit()
+        if not requeued:
+            logger.info(f"Skipping already queued email {dedupe_key}")
+            return None
+        logger.info(f"Requeued failed email {dedupe_key}")
+        return OutboundEmail.query.filter_by(dedupe_key=dedupe_key).one()
+    return message
+
+class OutboxWorker:
+    """Drains the outbox table, sending each message through the weather service.
+    
+    Messages are claimed in batches by setting a claim token and a lease, so
+    several workers can share the table and a crashed worker's messages are
+    picked up again once their lease expires. Each message's lease is renewed
+    just before it is sent, and a message whose claim was lost is skipped.
+    A batch is sent by `send_workers` threads at once (matching the SMTP
+    pool), each inside `context()`, all sharing the `rate_per_minute` limit.
+    Failed sends are retried with jittered exponential backoff until
+    `max_attempts`."""
+    def __init__(self, service, rate_per_minute: float = 60, batch_size: int = 50,
+                 max_attempts: int = 8, base_delay: float = 30, max_delay: float = 3600,
+                 lease_seconds: int = 600, poll_interval: float = 5, send_workers: int = 4,
+                 context=None):
+        self.service = service
+        self.limiter = RateLimiter(rate_per_minute)
+        # Claim no more than the rate limit lets us send within one lease
+        if rate_per_minute:
+            batch_size = min(batch_size, max(1, int(rate_per_minute * lease_seconds / 60)))
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.send_workers = max(1, send_workers)
+        if context is None:
+            from flask import current_app
+            context = current_app._get_current_object().app_context
+        self.context = context
+        self._stop = threading.Event()
+        
+    def claim_batch(self) -> List[OutboundEmail]:
+        """Claim up to batch_size due messages, recovering expired leases first."""
+        now = datetime.utcnow()
+        OutboundEmail.query.filter(
+            OutboundEmail.state == 'sending',
+            OutboundEmail.locked_until < now
+        ).update({'state': 'pending', 'claim_token': None}, synchronize_session=False)
+        
+        due_ids = db.session.query(OutboundEmail.id).filter(
+            OutboundEmail.state == 'pending',
+            OutboundEmail.next_attempt_at <= now
+        ).order_by(OutboundEmail.next_attempt_at).limit(self.batch_size).subquery()
+        token = uuid.uuid4().hex
+        OutboundEmail.query.filter(
+            OutboundEmail.id.in_(db.select(due_ids.c.id)),
+            OutboundEmail.state == 'pending'
+        ).update({
+            'state': 'sending',
+            'claim_token': token,
+            'locked_until': now + timedelta(seconds=self.lease_seconds)
+        }, synchronize_session=False)
+        db.session.commit()
+        return OutboundEmail.query.filter_by(claim_token=token).order_by(OutboundEmail.id).all()
+        
+    def backoff(self, attempts: int) -> float:
+        """Seconds to wait before retry number `attempts`."""
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempts - 1))
+        return delay * random.uniform(0.5, 1.0)
+        
+    def deliver(self, message: OutboundEmail):
+        self.limiter.acquire()
+        # Waiting on the rate limit can outlast the batch's lease; renew it, and
+        # skip the message if another worker has reclaimed it in the meantime
+        renewed = OutboundEmail.query.filter(
+            OutboundEmail.id == message.id,
+            OutboundEmail.claim_token == message.claim_token,
+            OutboundEmail.state == 'sending'
+        ).update({'locked_until': datetime.utcnow() + timedelta(seconds=self.lease_seconds)}, synchronize_session=False)
+        db.session.commit()
+        if not renewed:
+            logger.warning(f"Lost the claim on email {message.id} to {message.to_email}, skipping it")
+            return
+        message.attempts += 1
+        message.claim_token = None
+        try:
+            self.service.send_email(message.to_email, message.subject, message.html)
+        except Exception as e:
+            message.last_error = str(e)
+            if message.attempts >= self.max_attempts:
+                message.state = 'failed'
+                logger.error(f"Giving up on email {message.id} to {message.to_email} after {message.attempts} attempts")
+            else:
+                message.state = 'pending'
+                OUTBOX_RETRIES.inc()
+                message.next_attempt_at = datetime.utcnow() + timedelta(seconds=self.backoff(message.attempts))
+        else:
+            message.state = 'sent'
+            message.sent_at = datetime.utcnow()
+        db.session.commit()
+        if message.state == 'sent' and message.subscriber_id is not None:
+            ledger.record(message.subscriber_id, message.report_type, message.forecast_date)
+            
+    def _deliver_by_id(self, message_id: int):
+        # Each thread has its own app context and session, so it loads its own copy
+        with self.context():
+            try:
+                self.deliver(db.session.get(OutboundEmail, message_id))
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f"Failed to deliver email {message_id}: {str(e)}")
+                
+    def run_once(self) -> int:
+        """Send one batch of due messages. Returns how many were attempted."""
+        message_ids = [message.id for message in self.claim_batch()]
+        if len(message_ids) > 1 and self.send_workers > 1:
+            with ThreadPoolExecutor(max_workers=min(self.send_workers, len(message_ids)),
+                                    thread_name_prefix='outbox-send') as executor:
+                list(executor.map(self._deliver_by_id, message_ids))
+        else:
+            for message_id in message_ids:
+                self._deliver_by_id(message_id)
+        return len(message_ids)
+        
+    def run_forever(self):
+        """Keep draining the outbox, sleeping while nothing is due, until stop() is called."""
+        logger.info("Outbox worker started")
+        while not self._stop.is_set():
+            try:
+                attempted = self.run_once()
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f"Outbox worker failed to claim a batch: {str(e)}")
+                attempted = 0
+            if not attempted:
+                self._stop.wait(self.poll_interval)
+                
+    def start(self) -> threading.Thread:
+        """Drain the outbox on a daemon thread."""
+        def run():
+            with self.context():
+                self.run_forever()
+        thread = threading.Thread(target=run, name='outbox', daemon=True)
+        thread.start()
+        return thread
+        
+    def stop(self):
+        self._stop.set()
+
+def worker_from_env(service, context=None) -> OutboxWorker:
+    """An outbox worker configured from the OUTBOX_* settings."""
+    return OutboxWorker(
+        service,
+        rate_per_minute=float(os.getenv('OUTBOX_RATE_PER_MINUTE', '60')),
+        batch_size=int(os.getenv('OUTBOX_BATCH_SIZE', '50')),
+        max_attempts=int(os.getenv('OUTBOX_MAX_ATTEMPTS', '8')),
+        send_workers=int(os.getenv('OUTBOX_SEND_WORKERS', os.getenv('SMTP_POOL_SIZE', '4'))),
+        context=context
+    )
+
+def start_drain_thread(service, app) -> Optional[OutboxWorker]:
+    """Drain the outbox on a thread of this process, next to its scheduler or
+    shard worker. Skipped when the outbox is disabled or OUTBOX_WORKER=external
+    (the outbox is drained by `python outbox.py` processes instead)."""
+    if not service.use_outbox or os.getenv('OUTBOX_WORKER', 'thread') != 'thread':
+        return None
+    worker = worker_from_env(service, app.app_context)
+    worker.start()
+    return worker
+
+def main():
+    from config import create_db_app
+    from weather_service import WeatherService
+    
+    app = create_db_app()
+    with app.app_context():
+        db.create_all()
+        worker_from_env(WeatherService()).run_forever()
+
+if __name__ == "__main__":
+    main()
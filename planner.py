@@ -0,0 +1,166 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Callable, Dict, Iterable, List, Set, Tuple
+
+import numpy as np
+
+from metrics import STAGE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+class DispatchPlan:
+    """Shared work for one batch run, grouped by location.
+    
+    Built from a pass over the active subscribers: each distinct location cell
+    has its forecast fetched once, and each distinct (cell, elevation band) pair
+    is analyzed and rendered once, with the precaution rules for all groups
+    evaluated in a single vectorized pass. Sending then only fills in the recipient's
+    address and location label. Groups not seen while building (a subscriber
+    added mid-run) are filled in on first use. Groups with alert-mode
+    subscribers are listed in `alert_groups`. Once the plan's cells are known,
+    `load_stored(cells)` is called for their stored forecasts, as
+    {cell: (expires_at, forecast)}; those are used as they are, and the rest
+    come from the service's forecast cache."""
+    def __init__(self, service, report_type: str, fetch_workers: int = 8,
+                 load_stored: Callable[[Set[Tuple[int, int]]], Dict] = None):
+        self.service = service
+        self.report_type = report_type
+        self.fetch_workers = fetch_workers
+        self.load_stored = load_stored
+        self.stored = {}
+        self.month = datetime.now().month
+        self.subscribers = 0
+        self.alert_groups = set()
+        self._features = {}
+        self._masks = {}
+        self._days: Dict[Tuple[int, int], object] = {}
+        self._fragments: Dict[Tuple, object] = {}
+        self._lock = threading.Lock()
+        
+    def group_key(self, subscriber) -> Tuple:
+        cell = self.service.forecast_cache.cell_key(subscriber.latitude, subscriber.longitude)
+        return (cell, self.service.elevation_band(subscriber.elevation))
+        
+    def build(self, subscribers: Iterable) -> 'DispatchPlan':
+        """Group subscribers, fetch each cell's forecast in parallel, then analyze and render each group."""
+        groups = {}
+        for subscriber in subscribers:
+            self.subscribers += 1
+            key = self.group_key(subscriber)
+            groups.setdefault(key, subscriber)
+            if getattr(subscriber, 'alert_mode', False):
+                self.alert_groups.add(key)
+                
+        cells = {}
+        for (cell, _), subscriber in groups.items():
+            cells.setdefault(cell, subscriber)
+        if self.load_stored and cells:
+            self.stored = self.load_stored(set(cells))
+        with ThreadPoolExecutor(max_workers=max(1, self.fetch_workers)) as executor:
+            list(executor.map(lambda item: self._load_days(*item), cells.items()))
+            
+        self._analyze(groups)
+        return self
+        
+    def _analyze(self, groups: Dict[Tuple, object]):
+        """Evaluate the rules for every group at once and render each group's forecast."""
+        band_elevations = {}
+        for (_, band), subscriber in groups.items():
+            band_elevations.setdefault(band, subscriber.elevation)
+        columns = {band: i for i, band in enumerate(band_elevations)}
+        
+        offsets = {}
+        features = []
+        rows = 0
+        for cell, cell_features in self._features.items():
+            offsets[cell] = rows
+            features.append(cell_features)
+            rows += len(cell_features)
+        if not features:
+            masks = None
+        else:
+            with STAGE_SECONDS.time(stage='analysis'):
+                masks = self.service.rules.evaluate_features(
+                    np.concatenate(features), list(band_elevations.values()), self.month
+                )
+                
+        for key in groups:
+            cell, band = key
+            days = self._days[cell]
+            if isinstance(days, Exception):
+                fragment = days
+            else:
+                start = offsets[cell]
+                group_masks = masks[start:start + len(days), columns[band]]
+                fragment = self._render(days, group_masks)
+            with self._lock:
+                if not isinstance(days, Exception):
+                    self._masks.setdefault(key, group_masks)
+                self._fragments.setdefault(key, fragment)
+                
+    def _render(self, days, masks):
+        try:
+            precautions = [self.service.rules.messages(mask) for mask in masks]
+            return self.service.render_forecast(self.report_type, days, precautions)
+        except Exception as e:
+            return e
+            
+    def _load_days(self, cell: Tuple[int, int], subscriber):
+        with self._lock:
+            if cell in self._days:
+                return self._days[cell]
+        try:
+            if cell in self.stored:
+                forecast = self.stored[cell][1]
+            else:
+                forecast = self.service.get_cached_forecast(subscriber.latitude, subscriber.longitude)
+            days = self.service.forecast_days(self.report_type, forecast)
+            features = self.service.rules.day_features(days)
+        except Exception as e:
+            days = e
+        with self._lock:
+            if cell not in self._days and not isinstance(days, Exception):
+                self._features[cell] = features
+            return self._days.setdefault(cell, days)
+            
+    def _load_fragment(self, key: Tuple, subscriber):
+        with self._lock:
+            if key in self._fragments:
+                return self._fragments[key]
+        days = self._load_days(key[0], subscriber)
+        if isinstance(days, Exception):
+            fragment = days
+        else:
+            with STAGE_SECONDS.time(stage='analysis'):
+                masks = self.service.rules.evaluate_features(
+                    self._features[key[0]], [subscriber.elevation], self.month
+                )
+            fragment = self._render(days, masks[:, 0])
+            with self._lock:
+                self._masks.setdefault(key, masks[:, 0])
+        with self._lock:
+            return self._fragments.setdefault(key, fragment)
+            
+    def message_for(self, subscriber) -> Tuple[str, str, str]:
+        """Return (to, subject, content) for one subscriber, reusing the group's rendered forecast."""
+        fragment = self._load_fragment(self.group_key(subscriber), subscriber)
+        if isinstance(fragment, Exception):
+            raise fragment
+        return self.service.compose_message(self.report_type, subscriber, fragment)
+        
+    def analyses(self, keys: Iterable[Tuple]) -> Dict[Tuple, Tuple[np.ndarray, List[str]]]:
+        """Return the first forecast day of each analyzed group in `keys` as
+        (features, precautions). Groups whose forecast failed are left out."""
+        with self._lock:
+            return {
+                key: (self._features[key[0]][0], self.service.rules.messages(self._masks[key][0]))
+                for key in keys if key in self._masks
+            }
+            
+    def summary(self, label: str) -> str:
+        return (
+            f"{label} plan: {self.subscribers} subscribers in {len(self._days)} locations, "
+            f"{len(self._fragments)} forecast variants"
+        )
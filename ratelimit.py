@@ -0,0 +1,32 @@
+import threading
+import time
+from typing import Optional
+
+class RateLimiter:
+    """Token bucket allowing `rate` calls per `per` seconds.
+    
+    Up to `burst` calls (default: one period's worth) may go through back to
+    back; after that, acquire() blocks until a token is available. A rate of 0
+    disables limiting. Safe to share between threads."""
+    def __init__(self, rate: float, per: float = 60.0, burst: Optional[float] = None):
+        self.rate = rate
+        self.per = per
+        self.capacity = burst if burst is not None else max(rate, 1)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+        
+    def acquire(self):
+        """Take one token, sleeping until one is available."""
+        if not self.rate:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate / self.per)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) * self.per / self.rate
+            time.sleep(wait)
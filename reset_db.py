@@ -1,8 +1,10 @@
-from app import db, app
-from models import Admin, Subscriber
+from config import create_db_app
+from models import db
+
+app = create_db_app()
 
 with app.app_context():
     db.drop_all()
     db.create_all()
 
-print('Database reset complete') 
\ No newline at end of file
+print('Database reset complete') 
@@ -0,0 +1,100 @@
+import json
+import logging
+from datetime import datetime
+from functools import lru_cache
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Inputs a rule can test, in column order of the feature matrix
+FIELDS = ('temp', 'snow', 'rain', 'pop', 'wind', 'elevation', 'month')
+OPERATORS = ('lt', 'le', 'gt', 'ge')
+MAX_RULES = 64
+
+class RuleEngine:
+    """Precaution rules compiled into threshold matrices.
+    
+    Each rule is a set of threshold conditions on the fields in FIELDS, e.g.
+    {"temp": {"lt": 32}}. Compilation turns every condition into an open
+    interval low < value < high, so evaluating all rules over a batch of
+    forecast days and elevations is a couple of array comparisons. Results are
+    bitmasks with bit i set when rule i fired."""
+    def __init__(self, rules: List[Dict]):
+        if len(rules) > MAX_RULES:
+            raise ValueError(f"At most {MAX_RULES} precaution rules are supported, got {len(rules)}")
+        self.rules = rules
+        self.low = np.full((len(rules), len(FIELDS)), -np.inf)
+        self.high = np.full((len(rules), len(FIELDS)), np.inf)
+        self.bits = np.left_shift(np.uint64(1), np.arange(len(rules), dtype=np.uint64))
+        thresholds = set()
+        for i, rule in enumerate(rules):
+            for field, conditions in rule['when'].items():
+                if field not in FIELDS:
+                    raise ValueError(f"Rule {rule.get('id', i)} uses unknown field: {field}")
+                column = FIELDS.index(field)
+                for op, value in conditions.items():
+                    if op not in OPERATORS:
+                        raise ValueError(f"Rule {rule.get('id', i)} uses unknown operator: {op}")
+                    value = float(value)
+                    if op == 'gt':
+                        self.low[i, column] = max(self.low[i, column], value)
+                    elif op == 'ge':
+                        self.low[i, column] = max(self.low[i, column], np.nextafter(value, -np.inf))
+                    elif op == 'lt':
+                        self.high[i, column] = min(self.high[i, column], value)
+                    else:
+                        self.high[i, column] = min(self.high[i, column], np.nextafter(value, np.inf))
+                    if field == 'elevation':
+                        thresholds.add(value)
+        self.elevation_thresholds = sorted(thresholds)
+        self._messages = lru_cache(maxsize=1024)(self._decode)
+        
+    @classmethod
+    def from_file(cls, path: str) -> 'RuleEngine':
+        """Load and compile a JSON rule table."""
+        with open(path, encoding='utf-8') as f:
+            rules = json.load(f)
+        logger.info(f"Loaded {len(rules)} precaution rules from {path}")
+        return cls(rules)
+        
+    @staticmethod
+    def day_features(days: Sequence[Dict]) -> np.ndarray:
+        """Extract the forecast fields of each day into an (n_days, len(FIELDS)) array."""
+        features = np.zeros((len(days), len(FIELDS)))
+        for i, day in enumerate(days):
+            features[i, 0] = day['temp']['day']
+            features[i, 1] = day.get('snow', 0)
+            features[i, 2] = day.get('rain', 0)
+            features[i, 3] = day.get('pop', 0)
+            features[i, 4] = day.get('wind_speed', 0)
+        return features
+        
+    def evaluate(self, days: Sequence[Dict], elevations: Sequence[float],
+                 month: Optional[int] = None) -> np.ndarray:
+        """Evaluate every rule for every (day, elevation) pair.
+        
+        Returns a uint64 array of shape (len(days), len(elevations)) of rule bitmasks.
+        `month` defaults to the current month."""
+        return self.evaluate_features(self.day_features(days), elevations, month)
+        
+    def evaluate_features(self, day_features: np.ndarray, elevations: Sequence[float],
+                          month: Optional[int] = None) -> np.ndarray:
+        """Like evaluate, for days already converted with day_features."""
+        if month is None:
+            month = datetime.now().month
+        features = np.repeat(day_features[:, None, :], len(elevations), axis=1)
+        features[:, :, FIELDS.index('elevation')] = np.asarray(elevations, dtype=float)[None, :]
+        features[:, :, FIELDS.index('month')] = month
+        
+        values = features[:, :, None, :]
+        fired = ((values > self.low) & (values < self.high)).all(axis=-1)
+        return np.bitwise_or.reduce(np.where(fired, self.bits, np.uint64(0)), axis=-1)
+        
+    def _decode(self, mask: int) -> tuple:
+        return tuple(rule['message'] for i, rule in enumerate(self.rules) if mask >> i & 1)
+        
+    def messages(self, mask) -> List[str]:
+        """Map a rule bitmask to its precaution messages, in rule table order."""
+        return list(self._messages(int(mask)))
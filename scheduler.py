@@ -0,0 +1,114 @@
+import logging
+import os
+import threading
+from datetime import datetime, timedelta
+from typing import Callable, List, Tuple
+
+import pytz
+
+logger = logging.getLogger(__name__)
+
+DAILY_SEND_TIME = "08:00"
+WEEKLY_SEND_TIME = "09:00"
+WEEKLY_SEND_DAY = 6  # Sunday
+KINDS = ('prefetch', 'daily', 'weekly')
+
+class TimezoneScheduler:
+    """Runs the prefetch, daily and weekly jobs at each subscriber's local time.
+    
+    Active subscribers are bucketed by the UTC instant at which their local
+    send time next occurs; time zones sharing an instant share a bucket. The
+    scheduler sleeps until the earliest instant is due and then runs the job
+    of every bucket due then (say one zone's daily report and another's
+    weekly summary), each for just its own time zones, so load is spread
+    across the day instead of landing on one server-local hour. The bucket plan is rebuilt
+    after every dispatch and at least every `refresh_seconds`, so new time
+    zones are picked up without polling."""
+    def __init__(self, service, wrap: Callable = lambda job: job,
+                 prefetch_lead_minutes: int = None, refresh_seconds: float = 900):
+        self.service = service
+        self.wrap = wrap
+        if prefetch_lead_minutes is None:
+            prefetch_lead_minutes = int(os.getenv('PREFETCH_LEAD_MINUTES', '30'))
+        self.prefetch_lead = timedelta(minutes=prefetch_lead_minutes)
+        self.refresh_seconds = refresh_seconds
+        self._stop = threading.Event()
+        
+    @staticmethod
+    def _next_local(tz_name: str, at: str, after: datetime, weekday: int = None) -> datetime:
+        """First UTC instant strictly after `after` at local time `at` (HH:MM) in the zone,
+        optionally restricted to one weekday."""
+        tz = pytz.timezone(tz_name)
+        hour, minute = map(int, at.split(':'))
+        local_date = after.astimezone(tz).date()
+        while True:
+            local = tz.localize(datetime(local_date.year, local_date.month, local_date.day, hour, minute))
+            instant = local.astimezone(pytz.utc)
+            if instant > after and (weekday is None or local_date.weekday() == weekday):
+                return instant
+            local_date += timedelta(days=1)
+            
+    def next_instant(self, kind: str, tz_name: str, after: datetime) -> datetime:
+        """Next UTC instant after `after` at which `kind` is due for a time zone."""
+        if kind == 'prefetch':
+            return self._next_local(tz_name, DAILY_SEND_TIME, after + self.prefetch_lead) - self.prefetch_lead
+        if kind == 'daily':
+            return self._next_local(tz_name, DAILY_SEND_TIME, after)
+        return self._next_local(tz_name, WEEKLY_SEND_TIME, after, WEEKLY_SEND_DAY)
+        
+    def next_buckets(self, timezones: List[str], after: datetime) -> Tuple[datetime, List[Tuple[str, List[str]]]]:
+        """Return the earliest instant after `after` at which a job is due, with
+        (kind, time zones) for every job due then, prefetches first."""
+        buckets = {}
+        for tz_name in timezones:
+            for kind in KINDS:
+                buckets.setdefault((self.next_instant(kind, tz_name, after), kind), []).append(tz_name)
+        instant = min(instant for instant, _ in buckets)
+        due = [(kind, sorted(buckets[(instant, kind)])) for kind in KINDS if (instant, kind) in buckets]
+        return instant, due
+        
+    def _timezones(self) -> List[str]:
+        from models import active_timezones
+        valid = []
+        for tz_name in self.wrap(lambda: active_timezones(self.service.default_timezone))():
+            if tz_name in pytz.all_timezones_set:
+                valid.append(tz_name)
+            else:
+                logger.warning(f"Ignoring subscribers with unknown time zone: {tz_name}")
+        return valid or [self.service.default_timezone]
+        
+    def _dispatch(self, kind: str, timezones: List[str], instant: datetime = None):
+        logger.info(f"Running {kind} job for {', '.join(timezones)}")
+        try:
+            if kind == 'prefetch':
+                job = lambda: self.service.prefetch_forecasts(int(self.prefetch_lead.total_seconds() // 60), timezones)
+            elif kind == 'daily':
+                job = lambda: self.service.send_daily_update(timezones, run_at=instant)
+            else:
+                job = lambda: self.service.send_weekly_summary(timezones, run_at=instant)
+            self.wrap(job)()
+        except Exception as e:
+            logger.error(f"{kind} job for {', '.join(timezones)} failed: {str(e)}")
+            
+    def run(self):
+        """Dispatch buckets as they come due until stop() is called."""
+        cursor = datetime.now(pytz.utc)
+        while not self._stop.is_set():
+            instant, due = self.next_buckets(self._timezones(), cursor)
+            delay = (instant - datetime.now(pytz.utc)).total_seconds()
+            if delay > 0:
+                # Wake up early now and then to pick up newly added time zones
+                self._stop.wait(min(delay, self.refresh_seconds))
+                continue
+            for kind, timezones in due:
+                self._dispatch(kind, timezones, instant)
+            cursor = instant
+            
+    def start(self) -> threading.Thread:
+        """Run the scheduler on a daemon thread."""
+        thread = threading.Thread(target=self.run, name='scheduler', daemon=True)
+        thread.start()
+        return thread
+        
+    def stop(self):
+        self._stop.set()
@@ -0,0 +1,128 @@
+import logging
+import smtplib
+import ssl
+import threading
+import time
+from contextlib import contextmanager
+from typing import List, Optional
+
+from metrics import SMTP_RETRIES
+
+logger = logging.getLogger(__name__)
+
+class _Session:
+    """An open SMTP connection plus the bookkeeping needed to recycle it."""
+    def __init__(self, server: smtplib.SMTP):
+        self.server = server
+        self.messages_sent = 0
+        self.last_used = time.monotonic()
+
+class SMTPPool:
+    """Pool of authenticated SMTP sessions reused across sends.
+    
+    At most `size` sessions are open at once. An idle session is checked with
+    NOOP before reuse, a dropped session is replaced by a fresh one, and a
+    session is closed after `max_messages` sends to stay under provider
+    per-connection limits."""
+    def __init__(self, host: str, port: int, username: Optional[str] = None,
+                 password: Optional[str] = None, use_ssl: bool = True, size: int = 4,
+                 max_messages: int = 100, idle_check: float = 10.0, timeout: float = 30.0):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.use_ssl = use_ssl
+        self.size = size
+        self.max_messages = max_messages
+        self.idle_check = idle_check
+        self.timeout = timeout
+        self._idle: List[_Session] = []
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(size)
+        
+    def _connect(self) -> _Session:
+        logger.info(f"Opening SMTP session to {self.host}:{self.port}")
+        if self.use_ssl:
+            server = smtplib.SMTP_SSL(self.host, self.port, timeout=self.timeout,
+                                      context=ssl.create_default_context())
+        else:
+            server = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        try:
+            if self.password:
+                server.login(self.username, self.password)
+        except Exception:
+            self._close(server)
+            raise
+        return _Session(server)
+        
+    @staticmethod
+    def _close(server: smtplib.SMTP):
+        try:
+            server.quit()
+        except (smtplib.SMTPException, OSError):
+            server.close()
+            
+    def _is_alive(self, session: _Session) -> bool:
+        if time.monotonic() - session.last_used < self.idle_check:
+            return True
+        try:
+            return session.server.noop()[0] == 250
+        except (smtplib.SMTPException, OSError):
+            return False
+            
+    def _checkout(self, fresh: bool) -> _Session:
+        while not fresh:
+            with self._lock:
+                session = self._idle.pop() if self._idle else None
+            if session is None:
+                return self._connect()
+            if self._is_alive(session):
+                return session
+            logger.info("Discarding stale SMTP session")
+            self._close(session.server)
+        return self._connect()
+            
+    def _checkin(self, session: _Session):
+        session.last_used = time.monotonic()
+        if session.messages_sent >= self.max_messages:
+            self._close(session.server)
+            return
+        with self._lock:
+            self._idle.append(session)
+            
+    @contextmanager
+    def session(self, fresh: bool = False):
+        """Borrow a healthy session; it returns to the pool unless it failed.
+        With `fresh`, skip idle sessions and open a new one."""
+        self._slots.acquire()
+        try:
+            session = self._checkout(fresh)
+            try:
+                yield session
+            except Exception:
+                self._close(session.server)
+                raise
+            self._checkin(session)
+        finally:
+            self._slots.release()
+            
+    def send_message(self, msg):
+        """Send a message on a pooled session, reconnecting once if the server dropped it."""
+        for attempt in range(2):
+            try:
+                with self.session(fresh=attempt > 0) as session:
+                    session.server.send_message(msg)
+                    session.messages_sent += 1
+                    return
+            except smtplib.SMTPServerDisconnected:
+                if attempt:
+                    raise
+                SMTP_RETRIES.inc()
+                logger.warning("SMTP session disconnected, retrying on a new session")
+                
+    def close(self):
+        """Close all idle sessions."""
+        with self._lock:
+            sessions, self._idle = self._idle, []
+        for session in sessions:
+            self._close(session.server)
@@ -0,0 +1,231 @@
+import csv
+import json
+import logging
+from datetime import datetime
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, TextIO, Tuple
+
+from email_validator import EmailNotValidError, validate_email
+
+from models import Subscriber, db
+from weather_service import normalize_location
+
+logger = logging.getLogger(__name__)
+
+EXPORT_FIELDS = [
+    'email', 'location', 'yard_size', 'elevation', 'latitude', 'longitude',
+    'timezone', 'active', 'alert_mode', 'created_at',
+]
+
+class ImportReport:
+    """Outcome of a bulk import: counts plus one (line, email, message) entry per rejected row."""
+    def __init__(self):
+        self.inserted = 0
+        self.duplicates = 0
+        self.errors: List[Tuple[int, str, str]] = []
+        
+    def error(self, line: int, email: str, message: str):
+        logger.warning(f"Skipping subscriber on line {line} ({email}): {message}")
+        self.errors.append((line, email, message))
+        
+    def summary(self) -> str:
+        return (
+            f"Imported {self.inserted} subscribers, skipped {self.duplicates} already subscribed, "
+            f"rejected {len(self.errors)} rows"
+        )
+
+def file_format(path: str) -> str:
+    """Return 'jsonl' or 'csv' from a file name."""
+    return 'jsonl' if path.endswith(('.jsonl', '.ndjson')) else 'csv'
+
+def read_rows(f: TextIO, fmt: str = 'csv') -> Iterator[Tuple[int, Dict]]:
+    """Stream (line number, row dict) pairs from a CSV or JSONL file."""
+    if fmt == 'jsonl':
+        for line, text in enumerate(f, start=1):
+            if text.strip():
+                try:
+                    row = json.loads(text)
+                except json.JSONDecodeError as e:
+                    row = {'_error': f"Invalid JSON: {str(e)}"}
+                yield line, row if isinstance(row, dict) else {'_error': 'Expected a JSON object'}
+        return
+    reader = csv.DictReader(f)
+    reader.fieldnames = [name.strip() for name in reader.fieldnames or []]
+    for row in reader:
+        yield reader.line_num, row
+
+def _flag(value, default: bool = True) -> bool:
+    if value in (None, ''):
+        return default
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() in ('1', 'true', 'yes', 'y', 'active')
+
+def _number(value):
+    return None if value in (None, '') else float(value)
+
+def _parse(row: Dict) -> Dict:
+    """Validate one input row and return the subscriber columns it maps to.
+    Raises ValueError with a readable message for a bad row."""
+    if '_error' in row:
+        raise ValueError(row['_error'])
+    location = str(row.get('location') or row.get('zip_code') or row.get('zip') or '').strip()
+    if not location:
+        raise ValueError('Missing location')
+    try:
+        email = validate_email(str(row.get('email') or '').strip(), check_deliverability=False).normalized
+    except EmailNotValidError as e:
+        raise ValueError(f"Invalid email: {str(e)}")
+    try:
+        yard_size = _number(row.get('yard_size'))
+        elevation = _number(row.get('elevation'))
+        latitude = _number(row.get('latitude'))
+        longitude = _number(row.get('longitude'))
+    except (TypeError, ValueError):
+        raise ValueError('yard_size, elevation, latitude and longitude must be numbers')
+    if yard_size is None or elevation is None:
+        raise ValueError('Missing yard_size or elevation')
+    if (latitude is None) != (longitude is None):
+        raise ValueError('latitude and longitude must be given together')
+    try:
+        created_at = datetime.fromisoformat(row['created_at']) if row.get('created_at') else datetime.utcnow()
+    except (TypeError, ValueError):
+        raise ValueError('created_at must be an ISO 8601 timestamp')
+    return {
+        'email': email,
+        'location': location,
+        'yard_size': yard_size,
+        'elevation': elevation,
+        'latitude': latitude,
+        'longitude': longitude,
+        'timezone': (row.get('timezone') or '').strip() or None,
+        'active': _flag(row.get('active')),
+        'alert_mode': _flag(row.get('alert_mode'), default=False),
+        'created_at': created_at,
+    }
+
+def import_subscribers(service, rows: Iterable[Tuple[int, Dict]], chunk_size: int = 1000,
+                       resolve_timezones: bool = True) -> ImportReport:
+    """Insert subscribers from (line, row) pairs in chunks.
+    
+    Rows are validated, de-duplicated by email (within the file and against
+    existing subscribers), geocoded through `service.geocode_many` unless they
+    already carry coordinates, and bulk inserted. Time zones missing from the
+    input are resolved once per forecast grid cell. Must be called inside an
+    app context."""
+    report = ImportReport()
+    seen = set()
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            break
+        _import_chunk(service, chunk, seen, report, resolve_timezones)
+        logger.info(report.summary())
+    return report
+
+def _import_chunk(service, chunk, seen, report: ImportReport, resolve_timezones: bool):
+    parsed = []
+    for line, row in chunk:
+        try:
+            entry = _parse(row)
+        except ValueError as e:
+            report.error(line, str(row.get('email', '')), str(e))
+            continue
+        if entry['email'] in seen:
+            report.error(line, entry['email'], 'Duplicate email in input')
+            continue
+        seen.add(entry['email'])
+        parsed.append((line, entry))
+        
+    existing = {
+        email for (email,) in db.session.query(Subscriber.email)
+        .filter(Subscriber.email.in_([entry['email'] for _, entry in parsed]))
+    }
+    report.duplicates += sum(1 for _, entry in parsed if entry['email'] in existing)
+    parsed = [(line, entry) for line, entry in parsed if entry['email'] not in existing]
+    
+    missing = [entry['location'] for _, entry in parsed if entry['latitude'] is None]
+    coords = service.geocode_many(missing) if missing else {}
+    ready = []
+    for line, entry in parsed:
+        if entry['latitude'] is None:
+            found = coords[normalize_location(entry['location'])]
+            if isinstance(found, Exception):
+                report.error(line, entry['email'], str(found))
+                continue
+            entry['latitude'], entry['longitude'] = found['lat'], found['lon']
+        ready.append(entry)
+        
+    if resolve_timezones:
+        cache = service.forecast_cache
+        cells = {cache.cell_key(e['latitude'], e['longitude']) for e in ready if not e['timezone']}
+        if cells:
+            zones = service.timezones_for_cells(cells)
+            for entry in ready:
+                if not entry['timezone']:
+                    entry['timezone'] = zones[cache.cell_key(entry['latitude'], entry['longitude'])]
+                    
+    if ready:
+        db.session.execute(db.insert(Subscriber), ready)
+        db.session.commit()
+        report.inserted += len(ready)
+
+def fill_timezones(service, chunk_size: int = 1000) -> int:
+    """Set the time zone of subscribers that have none, looking it up once
+    per forecast grid cell. Returns the number of subscribers updated.
+    Must be called inside an app context."""
+    cache = service.forecast_cache
+    updated = 0
+    last_id = 0
+    while True:
+        with db.engine.connect() as conn:
+            rows = conn.execute(
+                db.select(Subscriber.id, Subscriber.latitude, Subscriber.longitude)
+                .where(Subscriber.timezone == None, Subscriber.id > last_id)
+                .order_by(Subscriber.id)
+                .limit(chunk_size)
+            ).all()
+        if not rows:
+            return updated
+        zones = service.timezones_for_cells({cache.cell_key(row.latitude, row.longitude) for row in rows})
+        db.session.execute(db.update(Subscriber), [
+            {'id': row.id, 'timezone': zones[cache.cell_key(row.latitude, row.longitude)]}
+            for row in rows
+        ])
+        db.session.commit()
+        updated += len(rows)
+        last_id = rows[-1].id
+        logger.info(f"Filled in time zones for {updated} subscribers")
+
+def export_subscribers(f: TextIO, fmt: str = 'csv', chunk_size: int = 1000) -> int:
+    """Stream every subscriber to `f` as CSV or JSONL, oldest first, reading
+    the table in keyset-paginated chunks. Returns the number written."""
+    columns = [getattr(Subscriber, name) for name in EXPORT_FIELDS]
+    writer = None
+    if fmt == 'csv':
+        writer = csv.DictWriter(f, fieldnames=EXPORT_FIELDS)
+        writer.writeheader()
+    written = 0
+    last_id = 0
+    while True:
+        with db.engine.connect() as conn:
+            rows = conn.execute(
+                db.select(Subscriber.id, *columns)
+                .where(Subscriber.id > last_id)
+                .order_by(Subscriber.id)
+                .limit(chunk_size)
+            ).all()
+        if not rows:
+            break
+        for row in rows:
+            record = {name: getattr(row, name) for name in EXPORT_FIELDS}
+            if isinstance(record['created_at'], datetime):
+                record['created_at'] = record['created_at'].isoformat()
+            if writer:
+                writer.writerow(record)
+            else:
+                f.write(json.dumps(record) + '\n')
+        written += len(rows)
+        last_id = rows[-1].id
+    return written
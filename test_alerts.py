@@ -0,0 +1,65 @@
+from datetime import date, timedelta
+
+from alerts import ChangeDetector, changes, parse_tolerances
+from models import Delivery, ForecastDigest, Subscriber, db
+
+def test_changes_respect_tolerances():
+    tolerances = parse_tolerances('temp=3')
+    before = ([50, 0, 0, 0.1, 5, 0, 0], ['Check gutters'])
+    assert changes(before, ([52, 0, 0.5, 0.2, 9, 0, 0], ['Check gutters']), tolerances) == []
+    assert changes(before, ([54, 0, 0, 0.1, 5, 0, 0], ['Check gutters']), tolerances) == ['temp 50 -> 54']
+    assert changes(before, ([50, 0, 0, 0.1, 5, 0, 0], ['Protect pipes']), tolerances) == [
+        'new precaution: Protect pipes', 'precaution cleared: Check gutters'
+    ]
+
+def test_alert_mode_subscribers_only_get_changed_forecasts(app, make_service):
+    db.session.add_all([
+        Subscriber(email=f'user{i}@example.com', location='98812', yard_size=1, elevation=100,
+                   latitude=48.1, longitude=-119.78, alert_mode=i > 0)
+        for i in range(3)
+    ])
+    db.session.commit()
+    
+    sent = []
+    service = make_service(sent)
+    today = service.run_date()
+    service.send_daily_update()
+    assert sorted(sent) == ['user0@example.com', 'user1@example.com', 'user2@example.com']
+    
+    def next_day():
+        Delivery.query.delete()
+        ForecastDigest.query.update({
+            'alerted_on': today - timedelta(days=1),
+            'checked_on': today - timedelta(days=1),
+        })
+        db.session.commit()
+        
+    next_day()
+    sent = []
+    report = make_service(sent, temp_shift=2).send_daily_update()
+    assert sent == ['user0@example.com']
+    assert report.sent == 1
+    
+    next_day()
+    sent = []
+    make_service(sent, temp_shift=8).send_daily_update()
+    assert sorted(sent) == ['user0@example.com', 'user1@example.com', 'user2@example.com']
+    assert ForecastDigest.query.one().alerted_on == today
+
+def test_new_subscribers_get_their_first_alert_mode_email(app):
+    detector = ChangeDetector(0.1)
+    key = ((481, -1198), (0, 0))
+    yesterday = date.today() - timedelta(days=1)
+    detector.update({key: ([50, 0, 0, 0, 5, 0, 0], [])}, yesterday)
+    joined = Subscriber(email='new@example.com', location='98812', yard_size=1, elevation=100,
+                        latitude=48.1, longitude=-119.78, alert_mode=True)
+    db.session.add(joined)
+    db.session.commit()
+    
+    detector = ChangeDetector(0.1)
+    assert detector.update({key: ([50, 0, 0, 0, 5, 0, 0], [])}, date.today()) == 0
+    assert detector.wants(key, joined)
+    
+    detector = ChangeDetector(0.1)
+    detector.update({key: ([50, 0, 0, 0, 5, 0, 0], [])}, date.today() + timedelta(days=1))
+    assert not detector.wants(key, joined)
@@ -0,0 +1,134 @@
+import os
+import subprocess
+import sys
+
+from app import create_app, dashboard_counts, forget_dashboard_counts
+from models import Subscriber, db
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+def test_importing_the_web_app_skips_the_batch_pipeline():
+    check = (
+        "import sys, threading, app; "
+        "loaded = {'weather_service', 'planner', 'numpy', 'scheduler', 'batch_runner'} & set(sys.modules); "
+        "assert not loaded, loaded; "
+        "assert threading.active_count() == 1"
+    )
+    subprocess.run([sys.executable, '-c', check], cwd=ROOT, check=True)
+
+def test_app_factory_serves_pages():
+    app = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite://', 'WTF_CSRF_ENABLED': False})
+    with app.app_context():
+        db.create_all()
+    client = app.test_client()
+    assert client.get('/').status_code == 200
+    assert client.get('/admin/dashboard').location.endswith('/admin/login')
+    assert 'weather_service' not in app.extensions
+
+def test_job_status_is_visible_to_other_web_processes(tmp_path):
+    config = {'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'jobs.db'}", 'WTF_CSRF_ENABLED': False}
+    first, second = create_app(config), create_app(config)
+    with first.app_context():
+        db.create_all()
+    job_id = first.extensions['jobs'].submit('Test job', lambda progress: 'Finished')
+    first.extensions['jobs']._executor.shutdown(wait=True)
+    
+    response = second.test_client().get(f'/jobs/{job_id}')
+    assert response.status_code == 200
+    assert response.get_json()['state'] == 'done'
+    assert response.get_json()['message'] == 'Finished'
+    assert second.test_client().get('/jobs/unknown').status_code == 404
+
+def test_dashboard_counts_are_cached_until_subscribers_change():
+    app = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite://', 'WTF_CSRF_ENABLED': False})
+    with app.app_context():
+        db.create_all()
+        db.session.add_all([
+            Subscriber(email=f'user{i}@example.com', location='98812', yard_size=1, elevation=100,
+                       latitude=48.1, longitude=-119.78, active=i != 0)
+            for i in range(3)
+        ])
+        db.session.commit()
+    with app.test_request_context():
+        assert dashboard_counts() == (3, 2)
+        db.session.delete(db.session.get(Subscriber, 1))
+        db.session.commit()
+        assert dashboard_counts() == (3, 2)
+        forget_dashboard_counts()
+        assert dashboard_counts() == (2, 2)
+
+def test_subscribers_api_clamps_the_page_size():
+    app = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite://', 'WTF_CSRF_ENABLED': False})
+    with app.app_context():
+        db.create_all()
+        db.session.add(Subscriber(email='a@example.com', location='98812', yard_size=1, elevation=100,
+                                  latitude=48.1, longitude=-119.78))
+        db.session.commit()
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['admin_id'] = 1
+    for limit in (0, -5):
+        response = client.get(f'/admin/api/subscribers?limit={limit}')
+        assert response.status_code == 200
+        assert len(response.get_json()['subscribers']) == 1
+
+def test_subscriber_search_matches_prefixes_through_the_indexes():
+    from datetime import datetime, timedelta
+    from models import page_subscribers
+    app = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite://', 'WTF_CSRF_ENABLED': False})
+    with app.app_context():
+        db.create_all()
+        db.session.add_all([
+            Subscriber(email=f'user{i}@example.com', location=f'9881{i % 3}', yard_size=1, elevation=100,
+                       latitude=48.1, longitude=-119.78, created_at=datetime(2026, 1, 1) + timedelta(minutes=i))
+            for i in range(12)
+        ])
+        db.session.commit()
+        
+        page, cursor = page_subscribers('user1', limit=2)
+        assert [s.email for s in page] == ['user11@example.com', 'user10@example.com']
+        page, cursor = page_subscribers('user1', cursor, limit=2)
+        assert [s.email for s in page] == ['user1@example.com'] and cursor is None
+        assert len(page_subscribers('98812')[0]) == 4
+        assert page_subscribers('user1%')[0] == []
+        
+        search = db.union(
+            db.select(Subscriber.id).where(Subscriber.email >= 'x', Subscriber.email < 'x\U0010ffff'),
+            db.select(Subscriber.id).where(Subscriber.location >= 'x', Subscriber.location < 'x\U0010ffff')
+        )
+        plan = ' '.join(row[-1] for row in db.session.execute(db.text(
+            'EXPLAIN QUERY PLAN ' + str(search.compile(db.engine, compile_kwargs={'literal_binds': True}))
+        )))
+        assert 'ix_subscriber_location' in plan and 'SCAN subscriber' not in plan
+
+def test_subscribing_takes_the_time_zone_from_a_known_forecast_or_looks_it_up_later(tmp_path, forecast):
+    import forecast_store
+    from weather_service import WeatherService
+    app = create_app({'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'app.db'}", 'WTF_CSRF_ENABLED': False})
+    fetched = []
+    
+    def get_weather_forecast(lat, lon):
+        fetched.append((lat, lon))
+        return dict(forecast, timezone='America/Denver')
+        
+    service = WeatherService()
+    service._get_coordinates = lambda zip_code: {'98812': {'lat': 48.1, 'lon': -119.78},
+                                                 '80202': {'lat': 39.75, 'lon': -104.99}}[zip_code]
+    service.get_weather_forecast = get_weather_forecast
+    app.extensions['weather_service'] = service
+    with app.app_context():
+        db.create_all()
+        cell = service.forecast_cache.cell_key(48.1, -119.78)
+        expires_at = service.forecast_cache.expires_at(forecast)
+        forecast_store.save(service.forecast_cache.grid,
+                            {cell: (expires_at, dict(forecast, timezone='America/Los_Angeles'))})
+                            
+    client = app.test_client()
+    for email, zip_code in (('stored@example.com', '98812'), ('unknown@example.com', '80202')):
+        client.post('/', data={'email': email, 'zip_code': zip_code, 'yard_size': 1,
+                               'elevation': 100, 'action': 'subscribe'})
+    app.extensions['jobs']._executor.shutdown(wait=True)
+    with app.app_context():
+        zones = {s.email: s.timezone for s in Subscriber.query}
+    assert zones == {'stored@example.com': 'America/Los_Angeles', 'unknown@example.com': 'America/Denver'}
+    assert len(fetched) == 1
@@ -0,0 +1,77 @@
+from datetime import datetime, timedelta
+
+from batch_runner import ShardWorker, plan_run, shard_clause
+from models import BatchShard, Subscriber, db, iter_active_subscribers
+from weather_service import ForecastCache
+
+class Report:
+    def __init__(self, sent):
+        self.sent = sent
+        self.failed = 0
+
+class StubService:
+    default_timezone = 'UTC'
+    
+    def __init__(self):
+        self.forecast_cache = ForecastCache(grid=0.1)
+        self.runs = []
+        
+    def send_daily_update(self, timezones=None, shard=None, run_at=None):
+        emails = [row.email for row in iter_active_subscribers(timezones=timezones, shard=shard)]
+        self.runs.append(emails)
+        return Report(len(emails))
+
+def add_subscribers(count):
+    db.session.add_all([
+        Subscriber(email=f'user{i}@example.com', location='98812', yard_size=1, elevation=100,
+                   latitude=40 + i % 7 * 0.3, longitude=-100 - i % 5 * 0.3)
+        for i in range(count)
+    ])
+    db.session.commit()
+
+def test_each_subscriber_lands_in_exactly_one_shard(app):
+    add_subscribers(60)
+    for strategy in ('location', 'id'):
+        run_key = f'daily:{strategy}'
+        assert plan_run(run_key, 'daily', None, 4, strategy) == 4
+        assert plan_run(run_key, 'daily', None, 4, strategy) == 0
+        
+        emails = []
+        for shard in BatchShard.query.filter_by(run_key=run_key):
+            emails += [row.email for row in iter_active_subscribers(shard=shard_clause(shard, 0.1))]
+        assert sorted(emails) == sorted(s.email for s in Subscriber.query)
+
+def test_location_shards_use_the_forecast_cache_cells_at_rounding_boundaries(app):
+    # Each latitude and longitude is an exact half cell from its neighbours
+    halves = [-1.75, -1.25, -0.75, -0.25, 0.25, 0.75, 1.25, 1.75]
+    db.session.add_all([
+        Subscriber(email=f'user{i}.{j}@example.com', location='98812', yard_size=1, elevation=100,
+                   latitude=lat, longitude=lon)
+        for i, lat in enumerate(halves) for j, lon in enumerate(halves)
+    ])
+    db.session.commit()
+    cache = ForecastCache(grid=0.5)
+    plan_run('daily:halves', 'daily', None, 5)
+    for shard in BatchShard.query.filter_by(run_key='daily:halves'):
+        rows = iter_active_subscribers(shard=shard_clause(shard, cache.grid))
+        for row in rows:
+            lat_index, lon_index = cache.cell_key(row.latitude, row.longitude)
+            assert abs(lat_index * 7919 + lon_index) % 5 == shard.shard_index
+            
+    assert cache.cell_key(0.25, -0.25) == (1, 0)
+    assert cache.cell_key(-0.75, 0.75) == (-1, 2)
+
+def test_expired_lease_is_reclaimed_by_another_worker(app):
+    add_subscribers(10)
+    plan_run('daily:2026-10-18T15:00:00+00:00', 'daily', None, 1)
+    service = StubService()
+    crashed = ShardWorker(service, worker_id='crashed')
+    shard = crashed.claim()
+    BatchShard.query.filter_by(id=shard.id).update({'lease_until': datetime.utcnow() - timedelta(seconds=1)})
+    db.session.commit()
+    
+    assert ShardWorker(service, worker_id='healthy').run_once()
+    
+    shard = BatchShard.query.one()
+    assert (shard.state, shard.attempts, shard.sent) == ('done', 2, 10)
+    assert len(service.runs) == 1
@@ -0,0 +1,46 @@
+from weather_service import ForecastCache
+
+def make_loader(calls):
+    def loader(lat, lon):
+        calls.append((lat, lon))
+        return {'current': {'dt': 2000000000}, 'daily': [], 'lat': lat, 'lon': lon}
+    return loader
+
+def test_nearby_coordinates_share_one_fetch():
+    calls = []
+    cache = ForecastCache(grid=0.1)
+    loader = make_loader(calls)
+    
+    cache.get(48.101, -119.781, loader)
+    cache.get(48.099, -119.779, loader)
+    
+    assert calls == [(48.1, -119.8)]
+    assert cache.stats()['hits'] == 1
+    assert cache.stats()['misses'] == 1
+
+def test_least_recently_used_cell_is_evicted():
+    calls = []
+    cache = ForecastCache(grid=1.0, max_entries=2)
+    loader = make_loader(calls)
+    
+    cache.get(10, 10, loader)
+    cache.get(20, 20, loader)
+    cache.get(10, 10, loader)
+    cache.get(30, 30, loader)
+    cache.get(20, 20, loader)
+    
+    assert calls == [(10.0, 10.0), (20.0, 20.0), (30.0, 30.0), (20.0, 20.0)]
+    assert cache.stats()['evictions'] == 2
+
+def test_entries_expire_relative_to_issue_time():
+    calls = []
+    cache = ForecastCache(grid=1.0, ttl=60)
+    
+    def stale_loader(lat, lon):
+        calls.append((lat, lon))
+        return {'current': {'dt': 0}, 'daily': []}
+    
+    cache.get(10, 10, stale_loader)
+    cache.get(10, 10, stale_loader)
+    
+    assert len(calls) == 2
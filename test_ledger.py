@@ -0,0 +1,119 @@
+from datetime import date
+
+import forecast_store
+import ledger
+from batch_runner import run_instant
+from models import Delivery, OutboundEmail, Subscriber, db
+from outbox import OutboxWorker, enqueue
+
+def add_subscribers(count):
+    db.session.add_all([
+        Subscriber(email=f'user{i}@example.com', location='98812', yard_size=1, elevation=100,
+                   latitude=48.1, longitude=-119.78)
+        for i in range(count)
+    ])
+    db.session.commit()
+
+def test_rerun_only_sends_to_subscribers_missed_by_a_failed_run(app, make_service):
+    add_subscribers(6)
+    
+    sent = []
+    report = make_service(sent, fail_for={'user2@example.com'}).send_daily_update()
+    assert (report.sent, report.failed) == (5, 1)
+    
+    resent = []
+    report = make_service(resent).send_daily_update()
+    assert (report.sent, report.failed) == (1, 0)
+    assert resent == ['user2@example.com']
+    assert Delivery.query.count() == 6
+    
+    assert make_service([]).send_daily_update().sent == 0
+    assert make_service([]).send_weekly_summary().sent == 6
+
+def test_queued_reports_count_as_handled(app):
+    add_subscribers(3)
+    first, second, third = Subscriber.query.order_by(Subscriber.id)
+    today = date.today()
+    enqueue(first.email, 'Daily', '<p>hi</p>', 'daily:1', (first.id, 'daily', today))
+    assert ledger.record(second.id, 'daily', today)
+    assert not ledger.record(second.id, 'daily', today)
+    
+    remaining = ledger.pending(Subscriber.query.order_by(Subscriber.id), 'daily', today, chunk_size=2)
+    assert [s.id for s in remaining] == [third.id]
+    assert OutboundEmail.query.one().subscriber_id == first.id
+
+def test_rerun_requeues_reports_that_ran_out_of_attempts(app, make_service):
+    add_subscribers(2)
+    service = make_service([])
+    service.use_outbox = True
+    assert service.send_daily_update().sent == 2
+    
+    def bounce(to_email, subject, content):
+        raise ValueError('Mailbox full')
+        
+    service.send_email = bounce
+    assert OutboxWorker(service, rate_per_minute=0, max_attempts=1).run_once() == 2
+    assert OutboundEmail.query.filter_by(state='failed').count() == 2
+    
+    assert service.send_daily_update().sent == 2
+    queued = OutboundEmail.query.all()
+    assert [(message.state, message.attempts) for message in queued] == [('pending', 0), ('pending', 0)]
+    
+    sent = []
+    service.send_email = lambda to_email, subject, content: sent.append(to_email)
+    assert OutboxWorker(service, rate_per_minute=0).run_once() == 2
+    assert sorted(sent) == ['user0@example.com', 'user1@example.com']
+    assert Delivery.query.count() == 2
+    assert service.send_daily_update().sent == 0
+
+def test_prefetched_forecasts_outlive_a_small_forecast_cache(app, make_service, forecast):
+    db.session.add_all([
+        Subscriber(email=f'far{i}@example.com', location='98812', yard_size=1, elevation=100,
+                   latitude=40 + i, longitude=-100)
+        for i in range(4)
+    ])
+    db.session.commit()
+    sent = []
+    service = make_service(sent)
+    service.forecast_cache.max_entries = 1
+    forecast_store.save(service.forecast_cache.grid, {
+        service.forecast_cache.cell_key(40 + i, -100): (service.forecast_cache.expires_at(forecast), forecast)
+        for i in range(4)
+    })
+    
+    calls = []
+    service.get_weather_forecast = lambda lat, lon: calls.append((lat, lon))
+    assert service.send_daily_update().sent == 4
+    assert calls == []
+
+def test_a_run_reads_only_its_own_stored_forecasts(app, make_service, forecast, monkeypatch):
+    add_subscribers(2)
+    service = make_service([])
+    cache = service.forecast_cache
+    expires_at = cache.expires_at(forecast)
+    entries = {(300 + i, -1000): (expires_at, forecast) for i in range(300)}
+    entries[cache.cell_key(48.1, -119.78)] = (expires_at, forecast)
+    forecast_store.save(cache.grid, entries)
+    
+    read = []
+    load_fresh = forecast_store.load_fresh
+    
+    def recording_load_fresh(*args, **kwargs):
+        loaded = load_fresh(*args, **kwargs)
+        read.extend(loaded)
+        return loaded
+        
+    monkeypatch.setattr(forecast_store, 'load_fresh', recording_load_fresh)
+    assert service.send_daily_update().sent == 2
+    assert read == [cache.cell_key(48.1, -119.78)]
+
+def test_deliveries_are_dated_by_the_run_in_its_time_zone(app, make_service):
+    add_subscribers(2)
+    db.session.execute(db.update(Subscriber).values(timezone='Asia/Tokyo'))
+    db.session.commit()
+    # 08:00 on the 18th in Tokyo is still the 17th in UTC
+    run_at = run_instant('daily:2026-10-17T23:00:00+00:00')
+    service = make_service([])
+    assert service.run_date(run_at, ['Asia/Tokyo']) == date(2026, 10, 18)
+    assert service.send_daily_update(['Asia/Tokyo'], run_at=run_at).sent == 2
+    assert {delivery.forecast_date for delivery in Delivery.query} == {date(2026, 10, 18)}
@@ -0,0 +1,27 @@
+import pytest
+
+from metrics import Counter, Histogram, Registry
+
+def test_histogram_renders_cumulative_buckets():
+    registry = Registry()
+    histogram = registry.register(Histogram('stage_seconds', 'Stage time.', ['stage'], buckets=(0.1, 1.0)))
+    
+    histogram.observe(0.05, stage='render')
+    histogram.observe(0.5, stage='render')
+    histogram.observe(5, stage='render')
+    
+    lines = registry.render().splitlines()
+    assert 'stage_seconds_bucket{stage="render",le="0.1"} 1' in lines
+    assert 'stage_seconds_bucket{stage="render",le="1.0"} 2' in lines
+    assert 'stage_seconds_bucket{stage="render",le="+Inf"} 3' in lines
+    assert 'stage_seconds_count{stage="render"} 3' in lines
+    assert histogram.stats(stage='render') == (3, pytest.approx(5.55))
+
+def test_counter_requires_its_labels():
+    counter = Counter('emails_total', 'Emails.', ['outcome'])
+    counter.inc(outcome='sent')
+    counter.inc(2, outcome='sent')
+    
+    assert counter.value(outcome='sent') == 3
+    with pytest.raises(ValueError):
+        counter.inc(result='sent')
@@ -0,0 +1,57 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+from openweather import OpenWeatherClient
+
+class StubHandler(BaseHTTPRequestHandler):
+    # Responses to hand out in order: (status, headers, body)
+    responses = []
+    requests_seen = []
+    
+    def do_GET(self):
+        self.requests_seen.append(self.path)
+        status, headers, body = self.responses.pop(0)
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+        
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def stub():
+    StubHandler.responses = []
+    StubHandler.requests_seen = []
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{server.server_port}'
+    server.shutdown()
+
+def test_retries_rate_limited_response_after_retry_after(stub):
+    StubHandler.responses = [
+        (429, {'Retry-After': '0'}, {'message': 'slow down'}),
+        (200, {}, {'lat': 48.1, 'lon': -119.78}),
+    ]
+    client = OpenWeatherClient('secret', base_url=stub, rate_per_minute=0)
+    
+    assert client.geocode_zip('98812') == {'lat': 48.1, 'lon': -119.78}
+    assert len(StubHandler.requests_seen) == 2
+    assert 'appid=secret' in StubHandler.requests_seen[0]
+
+def test_client_errors_are_not_retried_and_hide_the_key(stub):
+    StubHandler.responses = [(401, {}, {'message': 'Invalid API key'})]
+    client = OpenWeatherClient('secret', base_url=stub, rate_per_minute=0)
+    
+    with pytest.raises(requests.HTTPError) as excinfo:
+        client.onecall(48.1, -119.78)
+    assert 'secret' not in str(excinfo.value)
+    assert len(StubHandler.requests_seen) == 1
@@ -0,0 +1,72 @@
+import threading
+import time
+from datetime import datetime, timedelta
+
+from models import OutboundEmail, db
+from outbox import OutboxWorker, enqueue, start_drain_thread
+
+class RecordingService:
+    use_outbox = True
+    
+    def __init__(self, delay=0):
+        self.sent = []
+        self.delay = delay
+        self.sending = 0
+        self.most_at_once = 0
+        self._lock = threading.Lock()
+        
+    def send_email(self, to_email, subject, content):
+        with self._lock:
+            self.sending += 1
+            self.most_at_once = max(self.most_at_once, self.sending)
+        time.sleep(self.delay)
+        with self._lock:
+            self.sending -= 1
+            self.sent.append(to_email)
+
+def test_batch_is_capped_to_what_the_rate_allows_within_a_lease(app):
+    assert OutboxWorker(RecordingService(), rate_per_minute=4, batch_size=50, lease_seconds=600).batch_size == 40
+    assert OutboxWorker(RecordingService(), rate_per_minute=1, batch_size=50, lease_seconds=30).batch_size == 1
+    assert OutboxWorker(RecordingService(), rate_per_minute=0, batch_size=50).batch_size == 50
+
+def test_message_reclaimed_after_its_lease_expired_is_not_sent_twice(app):
+    enqueue('a@example.com', 'Forecast', '<p>a</p>')
+    enqueue('b@example.com', 'Forecast', '<p>b</p>')
+    first, second = RecordingService(), RecordingService()
+    slow = OutboxWorker(first, rate_per_minute=0)
+    batch = slow.claim_batch()
+    slow.deliver(batch[0])
+    
+    # The slow worker is still rate limited when its lease runs out
+    OutboundEmail.query.filter_by(state='sending').update(
+        {'locked_until': datetime.utcnow() - timedelta(seconds=1)}, synchronize_session=False)
+    db.session.commit()
+    assert OutboxWorker(second, rate_per_minute=0).run_once() == 1
+    slow.deliver(batch[1])
+    
+    assert first.sent == ['a@example.com']
+    assert second.sent == ['b@example.com']
+    assert OutboundEmail.query.filter_by(state='sent').count() == 2
+    assert OutboundEmail.query.filter_by(to_email='b@example.com').one().attempts == 1
+
+def test_a_batch_is_sent_concurrently(app):
+    for i in range(8):
+        enqueue(f'user{i}@example.com', 'Forecast', f'<p>{i}</p>')
+    service = RecordingService(delay=0.1)
+    assert OutboxWorker(service, rate_per_minute=0, send_workers=4).run_once() == 8
+    assert sorted(service.sent) == sorted(f'user{i}@example.com' for i in range(8))
+    assert service.most_at_once == 4
+    assert OutboundEmail.query.filter_by(state='sent').count() == 8
+
+def test_drain_thread_sends_queued_email(app):
+    enqueue('a@example.com', 'Forecast', '<p>a</p>')
+    service = RecordingService()
+    worker = start_drain_thread(service, app)
+    try:
+        for _ in range(100):
+            if service.sent:
+                break
+            time.sleep(0.05)
+    finally:
+        worker.stop()
+    assert service.sent == ['a@example.com']
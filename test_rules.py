@@ -0,0 +1,27 @@
+from rules import RuleEngine
+
+RULES = [
+    {'id': 'freezing', 'message': 'freezing', 'when': {'temp': {'lt': 32}}},
+    {'id': 'rain', 'message': 'rain', 'when': {'rain': {'gt': 0.5}}},
+    {'id': 'spring', 'message': 'spring', 'when': {'month': {'ge': 3, 'le': 5}}},
+    {'id': 'high', 'message': 'high', 'when': {'elevation': {'gt': 2000}}},
+]
+
+def test_rules_evaluate_over_days_and_elevations():
+    engine = RuleEngine(RULES)
+    days = [{'temp': {'day': 20}, 'rain': 0.5}, {'temp': {'day': 32}, 'rain': 0.6}]
+    
+    masks = engine.evaluate(days, [2000, 2500], month=3)
+    
+    assert masks.shape == (2, 2)
+    assert engine.messages(masks[0, 0]) == ['freezing', 'spring']
+    assert engine.messages(masks[0, 1]) == ['freezing', 'spring', 'high']
+    assert engine.messages(masks[1, 1]) == ['rain', 'spring', 'high']
+
+def test_inclusive_bounds_and_elevation_thresholds():
+    engine = RuleEngine(RULES)
+    day = [{'temp': {'day': 50}}]
+    
+    assert engine.messages(engine.evaluate(day, [0], month=5)[0, 0]) == ['spring']
+    assert engine.messages(engine.evaluate(day, [0], month=6)[0, 0]) == []
+    assert engine.elevation_thresholds == [2000.0]
@@ -0,0 +1,32 @@
+from datetime import datetime
+
+import pytz
+
+from scheduler import TimezoneScheduler
+
+class StubService:
+    default_timezone = 'UTC'
+
+def test_buckets_due_at_the_same_instant_all_run():
+    scheduler = TimezoneScheduler(StubService(), prefetch_lead_minutes=30)
+    # Sunday 2026-10-18: 08:00 in Chicago and 09:00 in New York are both 13:00 UTC
+    instant, due = scheduler.next_buckets(['America/Chicago', 'America/New_York'],
+                                          datetime(2026, 10, 18, 12, 45, tzinfo=pytz.utc))
+    assert instant == datetime(2026, 10, 18, 13, 0, tzinfo=pytz.utc)
+    assert due == [('daily', ['America/Chicago']), ('weekly', ['America/New_York'])]
+
+def test_a_week_of_buckets_covers_every_job():
+    scheduler = TimezoneScheduler(StubService(), prefetch_lead_minutes=30)
+    timezones = ['America/Chicago', 'America/New_York']
+    cursor, end = datetime(2026, 10, 12, tzinfo=pytz.utc), datetime(2026, 10, 19, tzinfo=pytz.utc)
+    runs = []
+    while True:
+        cursor, due = scheduler.next_buckets(timezones, cursor)
+        if cursor >= end:
+            break
+        runs += [(kind, tz_name) for kind, tz_names in due for tz_name in tz_names]
+        
+    for tz_name in timezones:
+        assert runs.count(('prefetch', tz_name)) == 7
+        assert runs.count(('daily', tz_name)) == 7
+        assert runs.count(('weekly', tz_name)) == 1
@@ -0,0 +1,47 @@
+from email.mime.text import MIMEText
+
+from benchmarks.servers import SMTPSink
+from smtp_pool import SMTPPool
+
+def message(i):
+    msg = MIMEText(f'Report {i}')
+    msg['From'] = 'weather@example.com'
+    msg['To'] = f'user{i}@example.com'
+    msg['Subject'] = 'Weather update'
+    return msg
+
+def test_idle_session_is_checked_with_noop_before_reuse():
+    with SMTPSink() as sink:
+        pool = SMTPPool('127.0.0.1', sink.port, use_ssl=False, idle_check=0)
+        pool.send_message(message(1))
+        pool.send_message(message(2))
+        pool.close()
+    assert (sink.messages, sink.connections, sink.noops) == (2, 1, 1)
+
+def test_stale_session_found_by_noop_is_replaced():
+    with SMTPSink() as sink:
+        pool = SMTPPool('127.0.0.1', sink.port, use_ssl=False, idle_check=0)
+        pool.send_message(message(1))
+        sink.drop_connections()
+        pool.send_message(message(2))
+        pool.close()
+    assert (sink.messages, sink.connections) == (2, 2)
+
+def test_send_reconnects_when_the_server_dropped_the_session():
+    with SMTPSink() as sink:
+        # A recently used session skips the NOOP, so the send itself hits the closed connection
+        pool = SMTPPool('127.0.0.1', sink.port, use_ssl=False, idle_check=60)
+        pool.send_message(message(1))
+        sink.drop_connections()
+        pool.send_message(message(2))
+        pool.send_message(message(3))
+        pool.close()
+    assert (sink.messages, sink.connections, sink.noops) == (3, 2, 0)
+
+def test_session_is_recycled_after_max_messages():
+    with SMTPSink() as sink:
+        pool = SMTPPool('127.0.0.1', sink.port, use_ssl=False, max_messages=2)
+        for i in range(5):
+            pool.send_message(message(i))
+        pool.close()
+    assert (sink.messages, sink.connections) == (5, 3)
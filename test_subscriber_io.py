@@ -0,0 +1,104 @@
+import io
+import time
+
+import forecast_store
+from models import GeocodedLocation, Subscriber, db, upgrade_schema
+from subscriber_io import export_subscribers, fill_timezones, import_subscribers, read_rows
+from weather_service import ForecastCache, preload_geocodes
+
+class StubService:
+    def __init__(self):
+        self.forecast_cache = ForecastCache(grid=0.1)
+        self.geocoded = []
+        
+    def geocode_many(self, locations):
+        self.geocoded.append(sorted(set(locations)))
+        return {
+            location: ValueError(f'Could not find coordinates for location: {location}')
+            if location == '00000' else {'lat': 40.0, 'lon': -105.0}
+            for location in locations
+        }
+        
+    def timezones_for_cells(self, cells):
+        return {cell: 'America/Denver' for cell in cells}
+
+def test_import_dedupes_geocodes_once_and_reports_bad_rows(app):
+    service = StubService()
+    data = io.StringIO(
+        'email,zip_code,yard_size,elevation\n'
+        'a@example.com,80302,1,5400\n'
+        'b@example.com,80302,2,5400\n'
+        'a@example.com,80302,1,5400\n'
+        'not-an-email,80302,1,5400\n'
+        'c@example.com,00000,1,5400\n'
+        'd@example.com,80302,big,5400\n'
+    )
+    report = import_subscribers(service, read_rows(data))
+    
+    assert report.inserted == 2
+    assert sorted(line for line, _, _ in report.errors) == [4, 5, 6, 7]
+    assert service.geocoded == [['00000', '80302']]
+    assert {s.timezone for s in Subscriber.query} == {'America/Denver'}
+
+def test_export_round_trips_through_import(app):
+    service = StubService()
+    import_subscribers(service, read_rows(io.StringIO(
+        '{"email": "a@example.com", "location": "80302", "yard_size": 1, "elevation": 5400, "active": false}\n'
+    ), 'jsonl'))
+    exported = io.StringIO()
+    assert export_subscribers(exported) == 1
+    
+    Subscriber.query.delete()
+    exported.seek(0)
+    report = import_subscribers(service, read_rows(exported))
+    
+    subscriber = Subscriber.query.one()
+    assert report.inserted == 1
+    assert subscriber.active is False
+    assert (subscriber.latitude, subscriber.longitude) == (40.0, -105.0)
+    assert len(service.geocoded) == 1
+
+def test_preload_geocodes_reads_the_tab_delimited_gazetteer(app, tmp_path):
+    path = tmp_path / '2023_Gaz_zcta_national.txt'
+    path.write_text(
+        'GEOID\tALAND\tAWATER\tALAND_SQMI\tAWATER_SQMI\tINTPTLAT\tINTPTLONG                                                                                                               \n'
+        '00601\t166847909\t799292\t64.42\t0.309\t18.180555\t-66.749961                                                                                                            \n'
+        '98812\t1053470329\t25306620\t406.747\t9.771\t48.121346\t-119.759447\n'
+        '\t1\t1\t1\t1\t\t\n'
+    )
+    assert preload_geocodes(str(path)) == 2
+    stored = GeocodedLocation.query.filter_by(location='98812').one()
+    assert (stored.latitude, stored.longitude) == (48.121346, -119.759447)
+
+def test_upgrade_adds_new_columns_and_fills_timezones(app):
+    # The subscriber table as created before the timezone and alert_mode columns
+    Subscriber.__table__.drop(db.engine)
+    with db.engine.begin() as conn:
+        conn.execute(db.text(
+            'CREATE TABLE subscriber (id INTEGER PRIMARY KEY, email VARCHAR(120) NOT NULL UNIQUE, '
+            'location VARCHAR(120) NOT NULL, yard_size FLOAT NOT NULL, elevation FLOAT NOT NULL, '
+            'latitude FLOAT NOT NULL, longitude FLOAT NOT NULL, created_at DATETIME NOT NULL, active BOOLEAN)'
+        ))
+        conn.execute(db.text(
+            "INSERT INTO subscriber VALUES (1, 'a@example.com', '80302', 1, 5400, 40.0, -105.0, "
+            "'2026-01-01 00:00:00', 1)"
+        ))
+        
+    changes = upgrade_schema()
+    assert 'Added column subscriber.timezone' in changes
+    assert 'Added column subscriber.alert_mode' in changes
+    assert 'Created index ix_subscriber_active_id' in changes
+    assert upgrade_schema() == []
+    
+    assert fill_timezones(StubService()) == 1
+    subscriber = db.session.get(Subscriber, 1)
+    assert (subscriber.timezone, subscriber.alert_mode) == ('America/Denver', False)
+    assert fill_timezones(StubService()) == 0
+
+def test_stored_forecasts_can_be_loaded_for_some_cells_only(app):
+    forecast = {'current': {'dt': 0}, 'timezone': 'America/Denver'}
+    expires_at = time.time() + 3600
+    forecast_store.save(0.1, {(400, -1050 - i): (expires_at, forecast) for i in range(3)})
+    
+    assert set(forecast_store.load_fresh(0.1)) == {(400, -1050), (400, -1051), (400, -1052)}
+    assert set(forecast_store.load_fresh(0.1, cells=[(400, -1051), (1, 1)])) == {(400, -1051)}
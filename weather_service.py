@@ -1,41 +1,312 @@
 import os
 import json
+import hashlib
 import requests
-import schedule
 import time
+import random
 import smtplib
 import logging
+import math
+import tempfile
+import threading
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
-from datetime import datetime, timedelta
-from dotenv import load_dotenv
-from typing import Dict, List
+from datetime import date, datetime, timedelta
+from typing import Callable, Dict, List, Optional, Tuple
 import pytz
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader, Template, select_autoescape
+from markupsafe import Markup
+from dispatch import BatchDispatcher
+from metrics import CACHE_LOOKUPS, EMAILS, RUN_ITEMS, RUN_PROGRESS, STAGE_SECONDS, stage_snapshot, stage_summary
+from planner import DispatchPlan
+from rules import RuleEngine
+from openweather import OpenWeatherClient
+from smtp_pool import SMTPPool
 
-# Load environment variables
-load_dotenv()
-
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s'
-)
 logger = logging.getLogger(__name__)
 
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates', 'email')
+
+def load_email_templates() -> Dict[str, Template]:
+    """Compile the email templates once, reusing bytecode cached on disk by earlier processes."""
+    cache_dir = os.getenv(
+        'EMAIL_TEMPLATE_CACHE_DIR',
+        os.path.join(tempfile.gettempdir(), 'weather_service_email_templates')
+    )
+    os.makedirs(cache_dir, exist_ok=True)
+    env = Environment(
+        loader=FileSystemLoader(TEMPLATE_DIR),
+        autoescape=select_autoescape(['html']),
+        bytecode_cache=FileSystemBytecodeCache(cache_dir),
+        trim_blocks=True,
+        lstrip_blocks=True,
+        auto_reload=False
+    )
+    return {
+        name: env.get_template(f'{name}.html')
+        for name in ('daily', 'daily_forecast', 'weekly_forecast')
+    }
+
+def html_part(content: str) -> Tuple[MIMEText, str]:
+    """Encode an HTML body once, with a boundary derived from its content.
+    A fixed boundary spares the generator from scanning the body for a free one."""
+    digest = hashlib.sha1(content.encode('utf-8')).hexdigest()
+    return MIMEText(content, 'html'), f"==============={digest}=="
+
+def normalize_location(location: str) -> str:
+    """Normalize a zip code or place name for use as a geocode cache key."""
+    return ' '.join(location.strip().lower().split())
+
+def preload_geocodes(path: str, chunk_size: int = 1000) -> int:
+    """Bulk load zip code centroids from a CSV file into the geocode table.
+    
+    The file needs a zip column (zip, zip_code or GEOID) and coordinate columns
+    (lat/latitude/INTPTLAT and lon/lng/longitude/INTPTLONG). The delimiter is
+    detected, so the tab-delimited Census ZCTA gazetteer loads as is. Locations
+    already in the table are left untouched. Must be called inside an app
+    context. Returns the number of rows inserted."""
+    import csv
+    from models import GeocodedLocation, db
+    
+    def pick(row, *names):
+        for name in names:
+            if row.get(name) not in (None, ''):
+                return row[name].strip()
+        return None
+        
+    def flush(batch):
+        existing = {
+            location for (location,) in db.session.query(GeocodedLocation.location)
+            .filter(GeocodedLocation.location.in_(list(batch)))
+        }
+        rows = [entry for key, entry in batch.items() if key not in existing]
+        if rows:
+            db.session.execute(db.insert(GeocodedLocation), rows)
+            db.session.commit()
+        return len(rows)
+        
+    inserted = 0
+    skipped = 0
+    batch = {}
+    with open(path, newline='') as f:
+        sample = f.read(64 * 1024)
+        f.seek(0)
+        try:
+            dialect = csv.Sniffer().sniff(sample, delimiters=',\t;|')
+        except csv.Error:
+            dialect = csv.excel_tab if path.lower().endswith('.txt') else csv.excel
+        reader = csv.DictReader(f, dialect=dialect)
+        reader.fieldnames = [name.strip() for name in reader.fieldnames or []]
+        for row in reader:
+            zip_code = pick(row, 'zip', 'zip_code', 'ZIP', 'GEOID')
+            lat = pick(row, 'lat', 'latitude', 'LAT', 'INTPTLAT')
+            lon = pick(row, 'lon', 'lng', 'longitude', 'LNG', 'INTPTLONG')
+            if not zip_code or lat is None or lon is None:
+                skipped += 1
+                continue
+            key = normalize_location(zip_code.zfill(5) if zip_code.isdigit() else zip_code)
+            batch[key] = {'location': key, 'latitude': float(lat), 'longitude': float(lon)}
+            if len(batch) >= chunk_size:
+                inserted += flush(batch)
+                batch = {}
+    if batch:
+        inserted += flush(batch)
+    if skipped:
+        logger.warning(f"Skipped {skipped} rows without a zip code and coordinates in {path}")
+    logger.info(f"Preloaded {inserted} geocoded locations from {path}")
+    return inserted
+
+class ForecastCache:
+    """LRU cache of forecasts keyed by coordinates snapped to a grid.
+    
+    Subscribers whose coordinates fall into the same grid cell share one
+    forecast, fetched for the cell centre. Entries expire `ttl` seconds after
+    the forecast's issue time (`current.dt` in the One Call response)."""
+    def __init__(self, grid: float = 0.1, max_entries: int = 1024, ttl: int = 10800):
+        self.grid = grid
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._key_locks: Dict[Tuple[int, int], threading.Lock] = {}
+        
+    def cell_key(self, lat: float, lon: float) -> Tuple[int, int]:
+        """Return the grid cell containing the given coordinates. Halves round
+        up, matching the SQL in batch_runner.shard_clause."""
+        return (math.floor(lat / self.grid + 0.5), math.floor(lon / self.grid + 0.5))
+        
+    def cell_center(self, key: Tuple[int, int]) -> Tuple[float, float]:
+        """Return the coordinates used to fetch the forecast for a cell."""
+        return (round(key[0] * self.grid, 4), round(key[1] * self.grid, 4))
+        
+    def _lookup(self, key: Tuple[int, int]):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, forecast = entry
+        if expires_at <= time.time():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return forecast
+        
+    def peek(self, lat: float, lon: float) -> Optional[Dict]:
+        """Return the cached forecast for the cell containing (lat, lon), or None, without loading it."""
+        with self._lock:
+            return self._lookup(self.cell_key(lat, lon))
+            
+    def get(self, lat: float, lon: float, loader: Callable[[float, float], Dict]) -> Dict:
+        """Return the forecast for the cell containing (lat, lon), calling
+        `loader` with the cell centre on a miss."""
+        key = self.cell_key(lat, lon)
+        with self._lock:
+            forecast = self._lookup(key)
+            if forecast is not None:
+                self.hits += 1
+                CACHE_LOOKUPS.inc(cache='forecast', result='hit')
+                return forecast
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+            
+        # Only one thread loads a given cell; the others wait and then hit.
+        with key_lock:
+            with self._lock:
+                forecast = self._lookup(key)
+                if forecast is not None:
+                    self.hits += 1
+                    CACHE_LOOKUPS.inc(cache='forecast', result='hit')
+                    return forecast
+                self.misses += 1
+                CACHE_LOOKUPS.inc(cache='forecast', result='miss')
+                
+            forecast = loader(*self.cell_center(key))
+            with self._lock:
+                self._store(key, self.expires_at(forecast), forecast)
+                self._key_locks.pop(key, None)
+            return forecast
+            
+    def expires_at(self, forecast: Dict) -> float:
+        """Epoch time at which a forecast goes stale: its issue time plus the TTL."""
+        return forecast.get('current', {}).get('dt', time.time()) + self.ttl
+        
+    def _store(self, key: Tuple[int, int], expires_at: float, forecast: Dict):
+        self._entries[key] = (expires_at, forecast)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+            
+    def seed(self, entries: Dict[Tuple[int, int], Tuple[float, Dict]]):
+        """Load forecasts fetched elsewhere, given as {cell: (expires_at, forecast)}."""
+        with self._lock:
+            for key, (expires_at, forecast) in entries.items():
+                self._store(key, expires_at, forecast)
+                
+    def stats(self) -> Dict[str, int]:
+        """Return hit/miss counters and the current number of entries."""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'size': len(self._entries),
+            }
+            
+    def clear(self):
+        """Drop all cached forecasts."""
+        with self._lock:
+            self._entries.clear()
+
+class lazy:
+    """Like functools.cached_property, but built under a lock so threads
+    racing on first use share one instance. Assigning the attribute replaces it."""
+    def __init__(self, build: Callable):
+        self.build = build
+        self.name = build.__name__
+        self.__doc__ = build.__doc__
+        self._lock = threading.Lock()
+        
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+        with self._lock:
+            if self.name not in instance.__dict__:
+                instance.__dict__[self.name] = self.build(instance)
+        return instance.__dict__[self.name]
+
 class WeatherService:
+    """Fetches, analyzes and sends the weather reports.
+    
+    The API client, SMTP pool, precaution rules and email templates are built
+    on first use, so processes that never send (the web app, most CLI
+    commands) don't pay for them."""
     def __init__(self):
         self.api_key = os.getenv('OPENWEATHER_API_KEY')
         self.sender_email = os.getenv('SENDER_EMAIL')
         self.email_password = os.getenv('EMAIL_PASSWORD')
+        self.forecast_cache = ForecastCache(
+            grid=float(os.getenv('FORECAST_CACHE_GRID', '0.1')),
+            max_entries=int(os.getenv('FORECAST_CACHE_SIZE', '1024')),
+            ttl=int(os.getenv('FORECAST_CACHE_TTL', '10800'))
+        )
+        self._html_part = lru_cache(maxsize=256)(html_part)
+        self.geocode_cache_size = int(os.getenv('GEOCODE_CACHE_SIZE', '4096'))
+        self._geocode_lru = OrderedDict()
+        self._geocode_lock = threading.Lock()
+        self.fetch_workers = int(os.getenv('BATCH_FETCH_WORKERS', '8'))
+        self.send_workers = int(os.getenv('BATCH_SEND_WORKERS', '4'))
+        self.queue_size = int(os.getenv('BATCH_QUEUE_SIZE', '100'))
+        self.chunk_size = int(os.getenv('BATCH_CHUNK_SIZE', '500'))
+        self.default_timezone = os.getenv('DEFAULT_TIMEZONE', 'UTC')
+        self.use_outbox = os.getenv('EMAIL_OUTBOX', 'true').lower() == 'true'
+        self.response_log_sample_rate = float(os.getenv('API_RESPONSE_LOG_SAMPLE_RATE', '0.01'))
+        
+    @lazy
+    def api(self) -> OpenWeatherClient:
+        return OpenWeatherClient(
+            self.api_key,
+            base_url=os.getenv('OPENWEATHER_BASE_URL', 'https://api.openweathermap.org'),
+            connect_timeout=float(os.getenv('OPENWEATHER_CONNECT_TIMEOUT', '3.05')),
+            read_timeout=float(os.getenv('OPENWEATHER_READ_TIMEOUT', '10')),
+            max_retries=int(os.getenv('OPENWEATHER_MAX_RETRIES', '3')),
+            rate_per_minute=float(os.getenv('OPENWEATHER_RATE_PER_MINUTE', '60'))
+        )
+        
+    @lazy
+    def smtp_pool(self) -> SMTPPool:
+        return SMTPPool(
+            host=os.getenv('SMTP_HOST', 'smtp.gmail.com'),
+            port=int(os.getenv('SMTP_PORT', '465')),
+            username=self.sender_email,
+            password=self.email_password,
+            use_ssl=os.getenv('SMTP_USE_SSL', 'true').lower() == 'true',
+            size=int(os.getenv('SMTP_POOL_SIZE', '4')),
+            max_messages=int(os.getenv('SMTP_MAX_MESSAGES_PER_SESSION', '100'))
+        )
+        
+    @lazy
+    def rules(self) -> RuleEngine:
+        return RuleEngine.from_file(os.getenv(
+            'WEATHER_RULES_PATH',
+            os.path.join(os.path.dirname(os.path.abspath(__file__)), 'weather_rules.json')
+        ))
+        
+    @lazy
+    def email_templates(self) -> Dict[str, Template]:
+        return load_email_templates()
         
     def get_weather_forecast(self, lat: float, lon: float) -> Dict:
         """Get 7-day weather forecast for given coordinates."""
-        url = f"https://api.openweathermap.org/data/3.0/onecall?lat={lat}&lon={lon}&units=imperial&appid={self.api_key}"
         try:
-            response = requests.get(url)
-            response.raise_for_status()  # Raise an exception for bad status codes
-            data = response.json()
-            logger.info(f"API Response for coordinates ({lat}, {lon}): {data}")
+            with STAGE_SECONDS.time(stage='forecast_fetch'):
+                data = self.api.onecall(lat, lon)
+            self._log_response(f"API Response for coordinates ({lat}, {lon})", data)
             
             if 'daily' not in data:
                 logger.error(f"No daily data in API response: {data}")
@@ -50,83 +321,194 @@ class WeatherService:
         except json.JSONDecodeError as e:
             logger.error(f"Failed to parse API response: {str(e)}")
             raise ValueError("Invalid response from weather API")
-        
-    def analyze_weather_conditions(self, forecast: Dict, elevation: float) -> List[str]:
-        """Analyze weather conditions and return necessary precautions."""
-        precautions = []
-        
-        # Analyze temperature
-        temp = forecast['temp']['day']
-        if temp < 32:
-            precautions.append("❄️ Freezing temperatures expected. Protect water pipes and ensure heating system is working.")
-        elif temp > 85:
-            precautions.append("🌡️ High temperatures expected. Ensure AC is functioning properly.")
             
-        # Analyze precipitation
-        if forecast.get('snow', 0) > 0:
-            precautions.append("🌨️ Snowfall expected. Clear walkways and check snow removal equipment.")
+    def _log_response(self, description: str, data):
+        """Log a raw API response at DEBUG, for a sample of calls only."""
+        if logger.isEnabledFor(logging.DEBUG) and random.random() < self.response_log_sample_rate:
+            logger.debug(f"{description}: {data}")
             
-        if forecast.get('rain', 0) > 0.5:
-            precautions.append("🌧️ Heavy rain expected. Check gutters and drainage systems.")
-            
-        # Spring/Summer specific (March through August)
-        current_month = datetime.now().month
-        if 3 <= current_month <= 8:
-            precautions.append("🌱 Regular yard maintenance may be needed - check for weed growth.")
-            
-        # Elevation specific
-        if elevation > 2000:
-            precautions.append("⛰️ High elevation location - monitor road conditions and access routes.")
-            
-        return precautions
+    def get_cached_forecast(self, lat: float, lon: float) -> Dict:
+        """Get forecast for given coordinates, served from the forecast cache when possible."""
+        return self.forecast_cache.get(lat, lon, self.get_weather_forecast)
         
-    def send_email(self, to_email: str, subject: str, content: str):
-        """Send email to subscriber using Gmail SMTP."""
-        msg = MIMEMultipart()
+    def _log_cache_stats(self, run: str, before: Dict[str, int]):
+        after = self.forecast_cache.stats()
+        logger.info(
+            f"Forecast cache for {run}: {after['hits'] - before['hits']} hits, "
+            f"{after['misses'] - before['misses']} misses, {after['size']} cached locations"
+        )
+        
+    def analyze_weather_conditions(self, forecast: Dict, elevation: float, month: int = None) -> List[str]:
+        """Analyze weather conditions and return necessary precautions.
+        `month` defaults to the current month."""
+        with STAGE_SECONDS.time(stage='analysis'):
+            return self.rules.messages(self.rules.evaluate([forecast], [elevation], month)[0, 0])
+            
+    def build_message(self, to_email: str, subject: str, content: str) -> MIMEMultipart:
+        """Build the MIME message for one recipient.
+        Recipients at the same location share identical content, so the encoded
+        HTML part and its boundary are cached and only the headers are built per message."""
+        part, boundary = self._html_part(content)
+        msg = MIMEMultipart(boundary=boundary)
         msg['From'] = self.sender_email
         msg['To'] = to_email
         msg['Subject'] = subject
         
-        msg.attach(MIMEText(content, 'html'))
+        msg.attach(part)
+        return msg
+        
+    def send_email(self, to_email: str, subject: str, content: str):
+        """Send email to subscriber over a pooled SMTP session."""
+        msg = self.build_message(to_email, subject, content)
         
         try:
-            logger.info(f"Attempting to establish SMTP connection to Gmail server")
-            import ssl
-            context = ssl.create_default_context()
-            
-            with smtplib.SMTP_SSL('smtp.gmail.com', 465, context=context) as server:
-                logger.info(f"SMTP connection established. Attempting login with sender email: {self.sender_email}")
-                server.login(self.sender_email, self.email_password)
-                logger.info("SMTP login successful")
-                
-                logger.info(f"Attempting to send email to: {to_email}")
-                server.send_message(msg)
-                logger.info(f"Email sent successfully to {to_email}")
-                
+            with STAGE_SECONDS.time(stage='smtp'):
+                self.smtp_pool.send_message(msg)
+            EMAILS.inc(outcome='sent')
+            logger.info(f"Email sent successfully to {to_email}")
+            
         except smtplib.SMTPAuthenticationError as e:
+            EMAILS.inc(outcome='failed')
             logger.error(f"SMTP Authentication failed: {str(e)}")
             raise ValueError("Failed to authenticate with Gmail. Please check your email and password.")
         except Exception as e:
+            EMAILS.inc(outcome='failed')
             logger.error(f"Failed to send email to {to_email}: {str(e)}")
             raise ValueError(f"Failed to send email: {str(e)}")
-
+            
     def _get_coordinates(self, location: str) -> Dict[str, float]:
+        """Get coordinates for a location, checking the in-process LRU and the
+        geocode table before falling back to the OpenWeatherMap API."""
+        key = normalize_location(location)
+        with self._geocode_lock:
+            coords = self._geocode_lru.get(key)
+            if coords is not None:
+                self._geocode_lru.move_to_end(key)
+                CACHE_LOOKUPS.inc(cache='geocode', result='hit')
+                return dict(coords)
+                
+        coords = self._load_stored_coordinates(key)
+        if coords is None:
+            CACHE_LOOKUPS.inc(cache='geocode', result='miss')
+            coords = self._fetch_coordinates(location)
+            self._store_coordinates(key, coords)
+        else:
+            CACHE_LOOKUPS.inc(cache='geocode', result='stored')
+            
+        with self._geocode_lock:
+            self._geocode_lru[key] = coords
+            self._geocode_lru.move_to_end(key)
+            while len(self._geocode_lru) > self.geocode_cache_size:
+                self._geocode_lru.popitem(last=False)
+        return dict(coords)
+        
+    def _load_stored_coordinates(self, key: str):
+        """Look up previously geocoded coordinates in the database, if one is available."""
+        from flask import has_app_context
+        if not has_app_context():
+            return None
+        from models import GeocodedLocation
+        entry = GeocodedLocation.query.filter_by(location=key).first()
+        if entry is None:
+            return None
+        return {'lat': entry.latitude, 'lon': entry.longitude}
+        
+    def _store_coordinates(self, key: str, coords: Dict[str, float]):
+        """Persist freshly geocoded coordinates so later lookups skip the API."""
+        from flask import has_app_context
+        if not has_app_context():
+            return
+        from models import GeocodedLocation, db
+        from sqlalchemy.exc import IntegrityError
+        try:
+            db.session.add(GeocodedLocation(location=key, latitude=coords['lat'], longitude=coords['lon']))
+            db.session.commit()
+        except IntegrityError:
+            # Another request stored the same location first
+            db.session.rollback()
+            
+    def geocode_many(self, locations) -> Dict[str, object]:
+        """Resolve many locations at once for bulk imports.
+        
+        Each distinct location is looked up in the in-process LRU, then in one
+        query against the geocode table, and only the rest are sent to the API
+        (in parallel, under its rate limit). New coordinates are stored in bulk.
+        Returns a dict keyed by normalized location holding the coordinates, or
+        the exception raised for a location that couldn't be geocoded."""
+        from flask import has_app_context
+        pending = {normalize_location(location): location for location in locations}
+        results = {}
+        with self._geocode_lock:
+            for key in list(pending):
+                coords = self._geocode_lru.get(key)
+                if coords is not None:
+                    results[key] = dict(coords)
+                    del pending[key]
+        CACHE_LOOKUPS.inc(len(results), cache='geocode', result='hit')
+        
+        if pending and has_app_context():
+            from models import GeocodedLocation
+            keys = list(pending)
+            for start in range(0, len(keys), 500):
+                for entry in GeocodedLocation.query.filter(GeocodedLocation.location.in_(keys[start:start + 500])):
+                    results[entry.location] = {'lat': entry.latitude, 'lon': entry.longitude}
+                    pending.pop(entry.location, None)
+                    CACHE_LOOKUPS.inc(cache='geocode', result='stored')
+                    
+        def fetch(item):
+            key, location = item
+            try:
+                return key, self._fetch_coordinates(location)
+            except Exception as e:
+                return key, e
+                
+        CACHE_LOOKUPS.inc(len(pending), cache='geocode', result='miss')
+        fetched = {}
+        if pending:
+            with ThreadPoolExecutor(max_workers=max(1, self.fetch_workers)) as executor:
+                for key, outcome in executor.map(fetch, pending.items()):
+                    results[key] = outcome
+                    if not isinstance(outcome, Exception):
+                        fetched[key] = outcome
+        if fetched and has_app_context():
+            from models import GeocodedLocation, db
+            from sqlalchemy.exc import IntegrityError
+            try:
+                db.session.execute(db.insert(GeocodedLocation), [
+                    {'location': key, 'latitude': coords['lat'], 'longitude': coords['lon']}
+                    for key, coords in fetched.items()
+                ])
+                db.session.commit()
+            except IntegrityError:
+                # Some were stored concurrently; fall back to one at a time
+                db.session.rollback()
+                for key, coords in fetched.items():
+                    self._store_coordinates(key, coords)
+                    
+        with self._geocode_lock:
+            for key, coords in results.items():
+                if isinstance(coords, Exception):
+                    continue
+                self._geocode_lru[key] = coords
+                self._geocode_lru.move_to_end(key)
+            while len(self._geocode_lru) > self.geocode_cache_size:
+                self._geocode_lru.popitem(last=False)
+        return results
+        
+    def _fetch_coordinates(self, location: str) -> Dict[str, float]:
         """Get coordinates for a location using OpenWeatherMap API.
         If a 5-digit zip code is provided, use the zip code endpoint; otherwise use the direct search endpoint."""
         location = location.strip()
         try:
-            if location.isdigit() and len(location) == 5:
-                # Use zip code endpoint; defaulting country to US
-                url = f"http://api.openweathermap.org/geo/1.0/zip?zip={location},US&appid={self.api_key}"
-            else:
-                url = f"http://api.openweathermap.org/geo/1.0/direct?q={location}&limit=1&appid={self.api_key}"
-            
             logger.info(f"Fetching coordinates for location: {location}")
-            response = requests.get(url)
-            response.raise_for_status()
-            data = response.json()
-            
-            logger.info(f"Geocoding API response: {data}")
+            with STAGE_SECONDS.time(stage='geocode'):
+                if location.isdigit() and len(location) == 5:
+                    # Use zip code endpoint; defaulting country to US
+                    data = self.api.geocode_zip(location)
+                else:
+                    data = self.api.geocode_direct(location)
+                    
+            self._log_response("Geocoding API response", data)
             
             if not data:
                 raise ValueError(f"Could not find coordinates for location: {location}")
@@ -140,7 +522,7 @@ class WeatherService:
                 if not data or 'lat' not in data[0] or 'lon' not in data[0]:
                     raise ValueError(f"Invalid coordinate data received for location {location}")
                 coords = {'lat': data[0]['lat'], 'lon': data[0]['lon']}
-            
+                
             logger.info(f"Coordinates found for {location}: {coords}")
             return coords
             
@@ -150,99 +532,277 @@ class WeatherService:
         except (json.JSONDecodeError, KeyError, IndexError) as e:
             logger.error(f"Failed to parse coordinate data: {str(e)}")
             raise ValueError(f"Failed to parse coordinate data: {str(e)}")
-
-    def send_daily_update_for_subscriber(self, subscriber):
-        """Send daily weather update for a specific subscriber."""
-        forecast = self.get_weather_forecast(subscriber.latitude, subscriber.longitude)
+            
+    def forecast_days(self, report_type: str, forecast: Dict) -> List[Dict]:
+        """Pick the forecast days covered by a 'daily' or 'weekly' report."""
         if 'daily' not in forecast or not forecast['daily']:
             raise Exception("No daily forecast data available from the API.")
-        try:
-            tomorrow = forecast['daily'][1]
-        except IndexError:
-            raise Exception("Daily forecast data is incomplete. Expected at least 2 days of forecast.")
-        precautions = self.analyze_weather_conditions(tomorrow, subscriber.elevation)
-        
-        content = f"""
-        <h2>Weather Update for {subscriber.location}</h2>
-        <h3>Tomorrow's Forecast:</h3>
-        <p>Temperature: {tomorrow['temp']['day']}°F</p>
-        <p>Weather: {tomorrow['weather'][0]['description']}</p>
-        <p>Precipitation Chance: {tomorrow['pop'] * 100}%</p>
-        
-        <h3>Recommended Precautions:</h3>
-        <ul>
-        {''.join([f'<li>{p}</li>' for p in precautions])}
-        </ul>
-        """
-        
-        self.send_email(
-            subscriber.email,
-            f"Daily Weather Update for {subscriber.location}",
-            content
-        )
-
+        if report_type == 'daily':
+            try:
+                return [forecast['daily'][1]]
+            except IndexError:
+                raise Exception("Daily forecast data is incomplete. Expected at least 2 days of forecast.")
+        return forecast['daily'][:7]
+        
+    def elevation_band(self, elevation: float) -> Tuple[int, int]:
+        """Bucket an elevation so that all elevations in a bucket get the same precautions."""
+        thresholds = self.rules.elevation_thresholds
+        return (bisect_left(thresholds, elevation), bisect_right(thresholds, elevation))
+        
+    def render_forecast(self, report_type: str, days: List[Dict], precautions: List[List[str]]) -> str:
+        """Render the part of a report shared by every recipient at one location."""
+        with STAGE_SECONDS.time(stage='render'):
+            if report_type == 'daily':
+                return self.email_templates['daily_forecast'].render(day=days[0], precautions=precautions[0])
+            entries = [
+                {
+                    'day': day,
+                    'date': datetime.fromtimestamp(day['dt']).strftime('%A, %B %d'),
+                    'precautions': day_precautions,
+                }
+                for day, day_precautions in zip(days, precautions)
+            ]
+            return self.email_templates['weekly_forecast'].render(days=entries)
+            
+    def compose_message(self, report_type: str, subscriber, forecast_html: str) -> Tuple[str, str, str]:
+        """Fill in the per-recipient parts of a report as (to, subject, content)."""
+        if report_type == 'daily':
+            with STAGE_SECONDS.time(stage='render'):
+                content = self.email_templates['daily'].render(
+                    location=subscriber.location,
+                    forecast_html=Markup(forecast_html)
+                )
+            return (subscriber.email, f"Daily Weather Update for {subscriber.location}", content)
+        return (subscriber.email, f"Weekly Weather Summary for {subscriber.location}", forecast_html)
+        
+    def build_report(self, report_type: str, subscriber) -> Tuple[str, str, str]:
+        """Fetch, analyze and render a report for a single subscriber as (to, subject, content)."""
+        forecast = self.get_cached_forecast(subscriber.latitude, subscriber.longitude)
+        days = self.forecast_days(report_type, forecast)
+        precautions = [self.analyze_weather_conditions(day, subscriber.elevation) for day in days]
+        return self.compose_message(report_type, subscriber, self.render_forecast(report_type, days, precautions))
+        
+    def build_daily_update(self, subscriber) -> Tuple[str, str, str]:
+        """Fetch and render the daily update for a subscriber as (to, subject, content)."""
+        return self.build_report('daily', subscriber)
+        
+    def build_weekly_summary(self, subscriber) -> Tuple[str, str, str]:
+        """Fetch and render the weekly summary for a subscriber as (to, subject, content)."""
+        return self.build_report('weekly', subscriber)
+        
+    def deliver(self, to_email: str, subject: str, content: str, dedupe_key: str = None, ledger_entry=None):
+        """Queue an email in the outbox, or send it right away when the outbox is disabled.
+        
+        `ledger_entry` is (subscriber_id, report_type, forecast_date) for batch
+        reports; it is written to the delivery ledger once the email is sent.
+        Must be called inside an app context when the outbox is enabled or a
+        ledger entry is given."""
+        if not self.use_outbox:
+            self.send_email(to_email, subject, content)
+            if ledger_entry is not None:
+                import ledger
+                ledger.record(*ledger_entry)
+            return
+        from outbox import enqueue
+        enqueue(to_email, subject, content, dedupe_key, ledger_entry)
+        
+    def send_daily_update_for_subscriber(self, subscriber):
+        """Send daily weather update for a specific subscriber."""
+        self.deliver(*self.build_daily_update(subscriber))
+        
     def send_weekly_summary_for_subscriber(self, subscriber):
         """Send weekly weather summary for a specific subscriber."""
-        forecast = self.get_weather_forecast(subscriber.latitude, subscriber.longitude)
-        if 'daily' not in forecast or not forecast['daily']:
-            raise Exception("No daily forecast data available from the API.")
-        content = "<h2>Weekly Weather Summary</h2>"
-        for day in forecast['daily'][:7]:
-            date = datetime.fromtimestamp(day['dt']).strftime('%A, %B %d')
-            precautions = self.analyze_weather_conditions(day, subscriber.elevation)
-            content += f"""
-            <h3>{date}</h3>
-            <p>Temperature: {day['temp']['day']}°F</p>
-            <p>Weather: {day['weather'][0]['description']}</p>
-            <p>Precipitation Chance: {day['pop'] * 100}%</p>
-            
-            <h4>Recommended Precautions:</h4>
-            <ul>
-            {''.join([f'<li>{p}</li>' for p in precautions])}
-            </ul>
-            <hr>
-            """
-        self.send_email(
-            subscriber.email,
-            f"Weekly Weather Summary for {subscriber.location}",
-            content
+        self.deliver(*self.build_weekly_summary(subscriber))
+        
+    def _dispatcher(self, prepare: Callable, send: Callable, on_result: Callable = None) -> BatchDispatcher:
+        from flask import current_app
+        return BatchDispatcher(
+            prepare=prepare,
+            send=send,
+            fetch_workers=self.fetch_workers,
+            send_workers=self.send_workers,
+            queue_size=self.queue_size,
+            describe=lambda subscriber: subscriber.email,
+            context=current_app._get_current_object().app_context,
+            on_result=on_result
         )
-
-    def send_daily_update(self):
-        """Send daily updates to all active subscribers."""
-        from models import Subscriber, db
-        with db.session.begin():
-            subscribers = Subscriber.query.filter_by(active=True).all()
-            for subscriber in subscribers:
-                try:
-                    self.send_daily_update_for_subscriber(subscriber)
-                except Exception as e:
-                    logger.error(f"Failed to send daily update to {subscriber.email}: {str(e)}")
-
-    def send_weekly_summary(self):
-        """Send weekly summary to all active subscribers."""
-        from models import Subscriber, db
-        with db.session.begin():
-            subscribers = Subscriber.query.filter_by(active=True).all()
-            for subscriber in subscribers:
-                try:
-                    self.send_weekly_summary_for_subscriber(subscriber)
-                except Exception as e:
-                    logger.error(f"Failed to send weekly summary to {subscriber.email}: {str(e)}")
+        
+    def known_timezone(self, lat: float, lon: float) -> Optional[str]:
+        """Return the IANA time zone for coordinates from a forecast already
+        cached or stored for their grid cell, or None without calling the API."""
+        import forecast_store
+        cache = self.forecast_cache
+        forecast = cache.peek(lat, lon)
+        if forecast is None:
+            cell = cache.cell_key(lat, lon)
+            stored = forecast_store.load_fresh(cache.grid, cells=[cell]).get(cell)
+            forecast = stored[1] if stored else {}
+        name = forecast.get('timezone')
+        try:
+            pytz.timezone(name)
+            return name
+        except Exception:
+            return None
+            
+    def _subscribers(self, timezones=None, shard=None):
+        from models import iter_active_subscribers
+        return iter_active_subscribers(self.chunk_size, timezones, self.default_timezone, shard)
+        
+    def prefetch_forecasts(self, lead_minutes: int = 0, timezones=None) -> int:
+        """Fetch forecasts for every distinct subscriber location ahead of a send window.
+        
+        Forecasts that will still be fresh `lead_minutes` from now are kept;
+        the rest are fetched in parallel (under the API client's rate limit)
+        and written to the forecast store, where the next batch run picks them
+        up without calling the API. With `timezones`, only subscribers in those
+        time zones are covered. Returns the number of forecasts fetched."""
+        import forecast_store
+        cache = self.forecast_cache
+        cells = {cache.cell_key(s.latitude, s.longitude) for s in self._subscribers(timezones)}
+        stored = forecast_store.load_fresh(cache.grid, datetime.utcnow() + timedelta(minutes=lead_minutes), cells)
+        missing = [cell for cell in cells if cell not in stored]
+        fetched = self._fetch_cells(missing)
+        logger.info(
+            f"Prefetched {len(fetched)} of {len(missing)} missing forecasts "
+            f"for {len(cells)} locations ({len(cells) - len(missing)} already stored)"
+        )
+        return len(fetched)
+        
+    def _fetch_cells(self, cells) -> Dict:
+        """Fetch forecasts for grid cells in parallel, save them to the forecast
+        store and seed the cache. Returns {cell: (expires_epoch, forecast)} for
+        the cells that could be fetched."""
+        import forecast_store
+        cache = self.forecast_cache
+        
+        def fetch(cell):
+            try:
+                forecast = self.get_weather_forecast(*cache.cell_center(cell))
+            except Exception as e:
+                logger.error(f"Failed to prefetch forecast for cell {cell}: {str(e)}")
+                return cell, None
+            return cell, (cache.expires_at(forecast), forecast)
+            
+        with ThreadPoolExecutor(max_workers=max(1, self.fetch_workers)) as executor:
+            fetched = {cell: entry for cell, entry in executor.map(fetch, cells) if entry}
+        forecast_store.save(cache.grid, fetched)
+        cache.seed(fetched)
+        return fetched
+        
+    def timezones_for_cells(self, cells) -> Dict[Tuple[int, int], str]:
+        """Return the time zone of each grid cell, reading stored forecasts
+        first and fetching the rest in parallel. Cells whose forecast can't be
+        fetched get the default time zone."""
+        import forecast_store
+        cells = set(cells)
+        entries = forecast_store.load_fresh(self.forecast_cache.grid, cells=cells)
+        entries.update(self._fetch_cells([cell for cell in cells if cell not in entries]))
+        zones = {}
+        for cell in cells:
+            name = entries[cell][1].get('timezone') if cell in entries else None
+            try:
+                pytz.timezone(name)
+                zones[cell] = name
+            except Exception:
+                zones[cell] = self.default_timezone
+        return zones
+        
+    def run_date(self, run_at: datetime = None, timezones=None) -> date:
+        """The local date a run due at `run_at` (UTC, default now) is for. The
+        time zones of one run share a local send time, so any of them gives
+        the same date; runs for everyone use the default time zone."""
+        run_at = run_at or datetime.now(pytz.utc)
+        if run_at.tzinfo is None:
+            run_at = pytz.utc.localize(run_at)
+        tz_name = min(timezones) if timezones else self.default_timezone
+        try:
+            tz = pytz.timezone(tz_name)
+        except pytz.UnknownTimeZoneError:
+            tz = pytz.timezone(self.default_timezone)
+        return run_at.astimezone(tz).date()
+        
+    def _run_batch(self, report_type: str, label: str, timezones=None, shard=None, run_at: datetime = None):
+        """Send one report to every active subscriber that hasn't had it for this run's date.
+        
+        Subscribers already in the delivery ledger (or with the report already
+        queued in the outbox) for the run date are skipped, so rerunning after a crash
+        only sends to the rest. Alert-mode subscribers only get the daily
+        report when their forecast changed (see alerts.ChangeDetector)."""
+        import forecast_store
+        import ledger
+        from alerts import ChangeDetector
+        if timezones is not None:
+            label = f"{label} ({', '.join(sorted(timezones))})"
+        cache_before = self.forecast_cache.stats()
+        stages_before = stage_snapshot()
+        # Prefetched forecasts for the run's cells go straight to the plan: seeding the
+        # cache with them would evict most of them again once there are more cells than it holds
+        forecast_date = self.run_date(run_at, timezones)
+        plan = DispatchPlan(self, report_type, self.fetch_workers,
+                            lambda cells: forecast_store.load_fresh(self.forecast_cache.grid, cells=cells))
+        skipped = []
+        plan.build(ledger.pending(self._subscribers(timezones, shard), report_type, forecast_date,
+                                  self.chunk_size, skipped.append))
+        logger.info(plan.summary(label))
+        if skipped:
+            RUN_ITEMS.inc(sum(skipped), report_type=report_type, outcome='skipped')
+            logger.info(f"Skipping {sum(skipped)} subscribers already sent the {label} for {forecast_date}")
+            
+        alerts = None
+        if report_type == 'daily' and plan.alert_groups:
+            alerts = ChangeDetector(self.forecast_cache.grid)
+            alerts.update(plan.analyses(plan.alert_groups), forecast_date)
+            logger.info(alerts.summary(label))
+            
+        RUN_PROGRESS.set(plan.subscribers, report_type=report_type, state='total')
+        for state in ('sent', 'failed', 'unchanged'):
+            RUN_PROGRESS.set(0, report_type=report_type, state=state)
+            
+        def on_result(outcome):
+            RUN_PROGRESS.inc(report_type=report_type, state=outcome)
+            RUN_ITEMS.inc(report_type=report_type, outcome=outcome)
+            
+        def prepare(subscriber):
+            return subscriber.id, plan.message_for(subscriber)
+            
+        def send(item):
+            subscriber_id, message = item
+            self.deliver(
+                *message,
+                dedupe_key=f"{report_type}:{forecast_date.isoformat()}:{message[0]}",
+                ledger_entry=(subscriber_id, report_type, forecast_date)
+            )
+            
+        subscribers = ledger.pending(self._subscribers(timezones, shard), report_type, forecast_date, self.chunk_size)
+        if alerts is not None:
+            subscribers = alerts.select(subscribers, plan.group_key, lambda subscriber: on_result('unchanged'))
+        report = self._dispatcher(prepare, send, on_result).run(subscribers, label)
+        if alerts is not None and alerts.suppressed:
+            logger.info(f"Held back the {label} from {alerts.suppressed} alert-mode subscribers with no forecast change")
+        self._log_cache_stats(label, cache_before)
+        logger.info(f"Stage timings for {label}: {stage_summary(stages_before)}")
+        return report
+        
+    def send_daily_update(self, timezones=None, shard=None, run_at: datetime = None):
+        """Send daily updates to all active subscribers, or those in the given time zones
+        (and matching the `shard` SQL condition). `run_at` is the instant the run was
+        due, which decides its date. Returns the run's DispatchReport."""
+        return self._run_batch('daily', "daily update", timezones, shard, run_at)
+        
+    def send_weekly_summary(self, timezones=None, shard=None, run_at: datetime = None):
+        """Send weekly summary to all active subscribers, or those in the given time zones
+        (and matching the `shard` SQL condition). `run_at` is the instant the run was
+        due, which decides its date. Returns the run's DispatchReport."""
+        return self._run_batch('weekly', "weekly summary", timezones, shard, run_at)
 
 def main():
+    from config import context_runner, create_db_app
+    from outbox import start_drain_thread
+    from scheduler import TimezoneScheduler
+    app = create_db_app()
     service = WeatherService()
-    
-    # Schedule daily updates (8 AM local time)
-    schedule.every().day.at("08:00").do(service.send_daily_update)
-    
-    # Schedule weekly summary (Sunday at 9 AM local time)
-    schedule.every().sunday.at("09:00").do(service.send_weekly_summary)
-    
-    # Keep the script running
-    while True:
-        schedule.run_pending()
-        time.sleep(60)
+    start_drain_thread(service, app)
+    TimezoneScheduler(service, context_runner(app)).run()
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file